@@ -0,0 +1,218 @@
+"""
+Adaptive quiz sessions.
+
+A session holds a running ability estimate (logits, the same scale as the
+calibrated question difficulty). Each answer updates it with an Elo step
+and adds the item's Fisher information, p(1 - p), to the precision, both
+O(1). The next question is the unused bank item whose difficulty is
+closest to the estimate, found by bisecting a per-topic list sorted by
+difficulty. The session ends once the estimate is precise enough or the
+question limit is reached.
+
+Sessions live in memory and expire after SESSION_TTL_SECONDS of inactivity.
+"""
+
+import bisect
+import math
+import threading
+import time
+import uuid
+
+from sqlalchemy.orm import Session
+
+import models
+import question_bank
+
+MAX_QUESTIONS = 10
+MIN_QUESTIONS = 4
+TARGET_SE = 0.6  # stop when the ability's standard error drops below this
+PRIOR_PRECISION = 1.0  # prior ~ N(ability, 1)
+SESSION_TTL_SECONDS = 3600
+INDEX_TTL_SECONDS = 600
+
+
+def sigmoid(x: float) -> float:
+    return 1 / (1 + math.exp(-x))
+
+
+class DifficultyIndex:
+    """Bank questions of one topic and grade, sorted by difficulty"""
+
+    def __init__(self, questions):
+        # Uncalibrated questions sit at 0, the centre of the scale
+        rows = sorted(((q.difficulty or 0.0, q.id, question_bank.question_row(q)) for q in questions),
+                      key=lambda row: (row[0], row[1]))
+        self.difficulties = [d for d, _, _ in rows]
+        self.questions = [q for _, _, q in rows]
+        self.mean_difficulty = sum(self.difficulties) / len(rows) if rows else 0.0
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.questions)
+
+    def nearest(self, target: float, used):
+        """Position of the unused question closest in difficulty to target, or None"""
+        right = bisect.bisect_left(self.difficulties, target)
+        left = right - 1
+        while left >= 0 or right < len(self.difficulties):
+            if right < len(self.difficulties) and (
+                left < 0 or self.difficulties[right] - target <= target - self.difficulties[left]
+            ):
+                if right not in used:
+                    return right
+                right += 1
+            else:
+                if left not in used:
+                    return left
+                left -= 1
+        return None
+
+
+class AdaptiveSession:
+    def __init__(self, student_id, subject, topic, grade, index: DifficultyIndex, ability: float, max_questions: int):
+        self.id = uuid.uuid4().hex
+        self.student_id = student_id
+        self.subject = subject
+        self.topic = topic
+        self.grade = grade
+        self.index = index
+        self.ability = ability
+        self.precision = PRIOR_PRECISION
+        self.max_questions = max_questions
+        self.used = set()
+        self.history = []
+        self.current = None
+        self.done = False
+        self.lock = threading.Lock()
+        self.touched = time.monotonic()
+
+    @property
+    def standard_error(self) -> float:
+        return 1 / math.sqrt(self.precision)
+
+    @property
+    def mastery(self) -> float:
+        """Predicted accuracy on a question of the topic's average difficulty"""
+        return sigmoid(self.ability - self.index.mean_difficulty)
+
+    def next_question(self):
+        position = self.index.nearest(self.ability, self.used)
+        if position is None:
+            self.done = True
+            self.current = None
+            return None
+        self.used.add(position)
+        self.current = position
+        return self.index.questions[position]
+
+    def answer(self, question_id: int, chosen: str, latency_ms=None):
+        """Score the current question, update the estimate and pick the next one"""
+        with self.lock:
+            return self._answer(question_id, chosen, latency_ms)
+
+    def _answer(self, question_id: int, chosen: str, latency_ms):
+        if self.done or self.current is None:
+            raise ValueError("This quiz session is already finished")
+        question = self.index.questions[self.current]
+        if question["id"] != question_id:
+            raise ValueError("That is not the current question")
+
+        correct = chosen == question["correct"]
+        difficulty = self.index.difficulties[self.current]
+        expected = sigmoid(self.ability - difficulty)
+        # Elo step sized by the current uncertainty: big moves early, small later
+        self.ability += (1 / self.precision) * (int(correct) - expected) * 1.5
+        self.precision += expected * (1 - expected)
+        self.history.append({
+            "question_id": question_id, "question": question["question"], "chosen": chosen,
+            "correct": correct, "latency_ms": latency_ms, "difficulty": difficulty,
+        })
+
+        asked = len(self.history)
+        if asked >= self.max_questions or (asked >= MIN_QUESTIONS and self.standard_error < TARGET_SE):
+            self.done = True
+            self.current = None
+            next_question = None
+        else:
+            next_question = self.next_question()
+        return {
+            "correct": correct,
+            "correct_answer": question["correct"],
+            "explanation": question.get("explanation"),
+            "next_question": next_question,
+            **self.state(),
+        }
+
+    def state(self):
+        return {
+            "session_id": self.id,
+            "ability": round(self.ability, 3),
+            "standard_error": round(self.standard_error, 3),
+            "mastery": round(self.mastery, 3),
+            "asked": len(self.history),
+            "score": sum(1 for h in self.history if h["correct"]),
+            "max_questions": self.max_questions,
+            "done": self.done,
+        }
+
+
+class AdaptiveQuizManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._indexes = {}
+
+    def _index(self, db: Session, subject: str, topic: str, grade: int):
+        key = (question_bank.topic_key(subject, topic), grade)
+        with self._lock:
+            index = self._indexes.get(key)
+        if index is None or time.monotonic() - index.built_at > INDEX_TTL_SECONDS:
+            questions = db.query(models.QuizQuestion).filter(
+                models.QuizQuestion.topic_key == key[0],
+                models.QuizQuestion.grade == grade
+            ).all()
+            index = DifficultyIndex(questions)
+            with self._lock:
+                self._indexes[key] = index
+        return index
+
+    def invalidate(self, subject=None, topic=None, grade=None):
+        """Drop one topic's cached index (after new questions), or all of them (after calibration)"""
+        with self._lock:
+            if subject is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop((question_bank.topic_key(subject, topic), grade), None)
+
+    def _expire(self):
+        cutoff = time.monotonic() - SESSION_TTL_SECONDS
+        for session_id in [sid for sid, s in self._sessions.items() if s.touched < cutoff]:
+            del self._sessions[session_id]
+
+    def start(self, db: Session, subject: str, topic: str, grade: int, student_id=None, max_questions=MAX_QUESTIONS):
+        index = self._index(db, subject, topic, grade)
+        if not len(index):
+            return None
+        ability = None
+        if student_id is not None:
+            ability = db.query(models.StudentAbility.ability).filter(
+                models.StudentAbility.student_id == student_id
+            ).scalar()
+        session = AdaptiveSession(student_id, subject, topic, grade, index,
+                                  ability if ability is not None else index.mean_difficulty,
+                                  max(1, min(max_questions, len(index))))
+        session.next_question()
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None:
+            session.touched = time.monotonic()
+        return session
+
+
+adaptive_quizzes = AdaptiveQuizManager()
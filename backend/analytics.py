@@ -0,0 +1,211 @@
+"""
+Pre-aggregated learning analytics (PRD §3.1).
+
+Quiz results and lesson logs are folded into analytics_daily, one row per
+(student, subject, day), at write time. XP comes from the leaderboard's
+per-day xp_rollups. The read functions group those small tables into
+compact series at day, week or month granularity, so dashboard cost no
+longer grows with the size of test_results.
+"""
+
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+
+GRANULARITIES = ("day", "week", "month")
+DEFAULT_SUBJECT = "general"
+BACKFILL_SETTING = "analytics_backfilled"
+
+_backfill_lock = threading.Lock()
+_backfilled = False
+
+
+def bucket_expr(column, granularity: str):
+    """SQL expression mapping a date column to the start of its bucket (as 'YYYY-MM-DD')"""
+    if granularity == "week":
+        # Monday of the week: jump to the next Sunday (or stay), then back 6 days
+        return func.date(column, "weekday 0", "-6 days")
+    if granularity == "month":
+        return func.strftime("%Y-%m-01", column)
+    return func.date(column)
+
+
+# ==================== WRITES ====================
+
+def _bump(db: Session, student_id: int, subject: str, day: date, **increments):
+    values = {"quizzes": 0, "questions": 0, "correct": 0, "lessons": 0, "active_seconds": 0}
+    values.update(increments)
+    stmt = sqlite_insert(models.DailyActivity).values(
+        student_id=student_id, subject=subject or DEFAULT_SUBJECT, day=day, **values
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["student_id", "subject", "day"],
+        set_={
+            name: getattr(models.DailyActivity, name) + getattr(stmt.excluded, name)
+            for name in increments
+        },
+    )
+    db.execute(stmt)
+
+
+def record_quiz(db: Session, student_id: int, subject: str, score: int, total_questions: int,
+                seconds: int = None, when: datetime = None):
+    """Fold one quiz result into the daily rollup. Does not commit."""
+    ensure_backfilled(db)
+    when = when or datetime.utcnow()
+    _bump(db, student_id, subject, when.date(), quizzes=1, questions=total_questions or 0,
+          correct=score or 0, active_seconds=max(0, seconds or 0))
+
+
+def record_lesson(db: Session, student_id: int, subject: str, seconds: int = None, when: datetime = None):
+    """Fold one lesson log into the daily rollup. Does not commit."""
+    ensure_backfilled(db)
+    when = when or datetime.utcnow()
+    _bump(db, student_id, subject, when.date(), lessons=1, active_seconds=max(0, seconds or 0))
+
+
+def ensure_backfilled(db: Session):
+    """Aggregate history written before the rollup existed, exactly once.
+
+    Runs before the first incremental write or read, so every row is counted
+    either here or by record_quiz/record_lesson but never by both.
+    """
+    global _backfilled
+    if _backfilled:
+        return
+    with _backfill_lock:
+        if _backfilled:
+            return
+        done = db.query(models.Settings).filter(models.Settings.key == BACKFILL_SETTING).first()
+        if not done:
+            with db.get_bind().connect() as conn:
+                conn.execute(text("""
+                    INSERT INTO analytics_daily (student_id, subject, day, quizzes, questions, correct, lessons, active_seconds)
+                    SELECT COALESCE(r.student_id, s.id), COALESCE(r.subject, :general), date(r.timestamp),
+                           COUNT(*), SUM(COALESCE(r.total_questions, 0)), SUM(COALESCE(r.score, 0)), 0, 0
+                    FROM test_results r LEFT JOIN students s ON r.student_id IS NULL AND s.name = r.student_name
+                    WHERE COALESCE(r.student_id, s.id) IS NOT NULL AND r.timestamp IS NOT NULL
+                    GROUP BY 1, 2, 3
+                    ON CONFLICT(student_id, subject, day) DO UPDATE SET
+                        quizzes = quizzes + excluded.quizzes,
+                        questions = questions + excluded.questions,
+                        correct = correct + excluded.correct
+                """), {"general": DEFAULT_SUBJECT})
+                conn.execute(text("""
+                    INSERT INTO analytics_daily (student_id, subject, day, quizzes, questions, correct, lessons, active_seconds)
+                    SELECT student_id, COALESCE(subject, :general), date(timestamp), 0, 0, 0, COUNT(*), 0
+                    FROM lesson_logs
+                    WHERE student_id IS NOT NULL AND timestamp IS NOT NULL
+                    GROUP BY 1, 2, 3
+                    ON CONFLICT(student_id, subject, day) DO UPDATE SET
+                        lessons = lessons + excluded.lessons
+                """), {"general": DEFAULT_SUBJECT})
+                conn.execute(
+                    text("INSERT OR REPLACE INTO settings (key, value) VALUES (:key, :value)"),
+                    {"key": BACKFILL_SETTING, "value": datetime.utcnow().isoformat()}
+                )
+                conn.commit()
+        _backfilled = True
+
+
+# ==================== READS ====================
+
+def _window(days: int):
+    return date.today() - timedelta(days=max(0, days - 1))
+
+
+def _scoped(query, column, student_id):
+    return query.filter(column == student_id) if student_id is not None else query
+
+
+def xp_series(db: Session, student_id: int = None, granularity: str = "day", days: int = 90):
+    """XP earned per bucket, plus the running total when scoped to one student"""
+    start = _window(days)
+    bucket = bucket_expr(models.XPRollup.bucket_start, granularity)
+    query = db.query(bucket, func.sum(models.XPRollup.xp)).filter(
+        models.XPRollup.bucket == "day",
+        models.XPRollup.bucket_start >= start
+    )
+    rows = _scoped(query, models.XPRollup.student_id, student_id).group_by(bucket).order_by(bucket).all()
+
+    series = {
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "buckets": [b for b, _ in rows],
+        "xp": [int(xp or 0) for _, xp in rows],
+    }
+    if student_id is not None:
+        student_xp = db.query(models.Student.xp).filter(models.Student.id == student_id).scalar() or 0
+        running = student_xp - sum(series["xp"])
+        totals = []
+        for xp in series["xp"]:
+            running += xp
+            totals.append(running)
+        series["total"] = totals
+    return series
+
+
+def scores_by_subject(db: Session, student_id: int = None, days: int = 90):
+    start = _window(days)
+    activity = models.DailyActivity
+    query = db.query(
+        activity.subject,
+        func.sum(activity.quizzes), func.sum(activity.questions), func.sum(activity.correct)
+    ).filter(activity.day >= start, activity.quizzes > 0)
+    rows = _scoped(query, activity.student_id, student_id).group_by(activity.subject).order_by(activity.subject).all()
+    return {
+        "start": start.isoformat(),
+        "subjects": [
+            {
+                "subject": subject,
+                "quizzes": int(quizzes or 0),
+                "questions": int(questions or 0),
+                "correct": int(correct or 0),
+                "accuracy": round(100 * correct / questions) if questions else 0,
+            }
+            for subject, quizzes, questions, correct in rows
+        ],
+    }
+
+
+def activity_heatmap(db: Session, student_id: int = None, days: int = 365):
+    """Activity count (quizzes + lessons) per active day, GitHub-style"""
+    start = _window(days)
+    activity = models.DailyActivity
+    day = func.date(activity.day)
+    query = db.query(day, func.sum(activity.quizzes + activity.lessons)).filter(activity.day >= start)
+    rows = _scoped(query, activity.student_id, student_id).group_by(day).order_by(day).all()
+    return {
+        "start": start.isoformat(),
+        "days": [d for d, _ in rows],
+        "counts": [int(count or 0) for _, count in rows],
+    }
+
+
+def time_on_subject(db: Session, student_id: int = None, granularity: str = "week", days: int = 90):
+    """Active seconds per subject, in total and per bucket"""
+    start = _window(days)
+    activity = models.DailyActivity
+    bucket = bucket_expr(activity.day, granularity)
+    query = db.query(activity.subject, bucket, func.sum(activity.active_seconds)).filter(activity.day >= start)
+    rows = _scoped(query, activity.student_id, student_id).group_by(activity.subject, bucket).order_by(bucket).all()
+
+    buckets = sorted({b for _, b, _ in rows})
+    index = {b: i for i, b in enumerate(buckets)}
+    subjects = {}
+    for subject, b, seconds in rows:
+        entry = subjects.setdefault(subject, {"subject": subject, "seconds": 0, "series": [0] * len(buckets)})
+        entry["seconds"] += int(seconds or 0)
+        entry["series"][index[b]] = int(seconds or 0)
+
+    return {
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "buckets": buckets,
+        "subjects": sorted(subjects.values(), key=lambda e: -e["seconds"]),
+    }
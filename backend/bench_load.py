@@ -0,0 +1,352 @@
+"""
+End-to-end load test: realistic student traffic against a real server.
+
+Boots uvicorn in a scratch directory (so it gets its own SQLite database,
+caches and job artifacts) with FAKE_PROVIDERS=1, seeds badges and a class
+of students with quiz history, lessons and flashcards through the API,
+then runs concurrent virtual students for a fixed time. Each one picks a
+profile, loads the dashboard bootstrap and then walks through a lesson,
+takes a quiz or reviews flashcards, the way the frontend does.
+
+Reports throughput, errors and p50/p95/p99 latency per endpoint and
+writes them to a JSON file. With --baseline, exits non-zero when an
+endpoint's p95 regressed by more than --tolerance, so it can gate a merge.
+
+Usage: python bench_load.py [--users 8] [--duration 60] [--out bench_load.json]
+                            [--baseline previous.json] [--tolerance 0.25]
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from bench_startup import free_port, health_ok
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BOOT_TIMEOUT_SECONDS = 30.0
+REQUEST_TIMEOUT_SECONDS = 120.0
+
+SUBJECTS = {
+    "Science": ["Volcanoes", "The Water Cycle", "Plants", "Magnets"],
+    "Math": ["Fractions", "Multiplication", "Shapes"],
+    "History": ["Ancient Egypt", "The Ashanti Empire"],
+}
+# How often each visit does what, after picking a profile
+SCENARIOS = {"lesson": 0.4, "quiz": 0.35, "flashcards": 0.25}
+RATINGS = ["easy", "medium", "hard"]
+
+
+# ==================== CLIENT ====================
+
+class Client:
+    """One keep-alive connection per virtual student; records every request"""
+
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+        self.conn = None
+
+    def request(self, method, path, name=None, body=None):
+        """Parsed JSON (or None) from the response; `name` groups paths with ids in them"""
+        headers = {"Accept-Encoding": "gzip"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        start = time.perf_counter()
+        status, payload = 0, b""
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=REQUEST_TIMEOUT_SECONDS)
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+            status, payload = response.status, response.read()
+            encoding = response.getheader("Content-Encoding")
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            encoding = None
+        if self.recorder:
+            self.recorder.record(f"{method} {name or path}", time.perf_counter() - start, status)
+        if status != 200 or not payload:
+            return None
+        if encoding == "gzip":
+            payload = gzip.decompress(payload)
+        try:
+            return json.loads(payload)
+        except ValueError:
+            return payload  # NDJSON streams and audio
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, seconds, status):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+
+# ==================== TRAFFIC ====================
+
+def visit(client, rng, students):
+    student = rng.choice(students)
+    sid = student["id"]
+    client.request("GET", "/api/students")
+    client.request("GET", f"/api/students/{sid}/bootstrap", "/api/students/{id}/bootstrap")
+
+    scenario = rng.choices(list(SCENARIOS), weights=list(SCENARIOS.values()))[0]
+    subject = rng.choice(list(SUBJECTS))
+    topic = rng.choice(SUBJECTS[subject])
+    grade = student["grade"]
+
+    if scenario == "lesson":
+        plan = client.request("POST", "/api/lesson/plan", body={"subject": subject, "topic": topic, "grade": grade})
+        plan = (plan or {}).get("plan") or [topic]
+        session_id = uuid.uuid4().hex
+        for subtopic in plan[:rng.randint(1, min(3, len(plan)))]:
+            lesson = client.request("POST", "/api/lesson/content", body={
+                "subject": subject, "topic": topic, "subtopic": subtopic, "grade": grade,
+                "plan": plan, "session_id": session_id
+            })
+            client.request("POST", f"/api/students/{sid}/lesson-log", "/api/students/{id}/lesson-log", body={
+                "subject": subject, "topic": topic, "content": (lesson or {}).get("content") or subtopic
+            })
+            client.request("POST", "/api/quiz/stream", body={
+                "subject": subject, "topic": f"{topic}: {subtopic}", "grade": grade, "num_questions": 3, "student_id": sid
+            })
+        client.request("POST", f"/api/lesson/session/{session_id}/end", "/api/lesson/session/{id}/end")
+        client.request("POST", f"/api/students/{sid}/activity", "/api/students/{id}/activity")
+        client.request("POST", f"/api/students/{sid}/check-badges", "/api/students/{id}/check-badges")
+
+    elif scenario == "quiz":
+        quiz = client.request("POST", "/api/quiz", body={
+            "subject": subject, "topic": topic, "grade": grade, "num_questions": 5, "student_id": sid
+        })
+        questions = (quiz or {}).get("questions") or []
+        score = sum(rng.random() < 0.7 for _ in questions)
+        submit_quiz(client, student, subject, topic, score, len(questions) or 5, rng.randint(30, 300))
+        client.request("POST", f"/api/students/{sid}/check-badges", "/api/students/{id}/check-badges")
+
+    else:
+        cards = client.request("GET", f"/api/students/{sid}/flashcards", "/api/students/{id}/flashcards") or []
+        for card in cards[:5]:
+            client.request("POST", f"/api/flashcards/{card['id']}/review", "/api/flashcards/{id}/review",
+                           body={"rating": rng.choice(RATINGS)})
+
+
+def submit_quiz(client, student, subject, topic, score, total, seconds):
+    client.request("POST", "/api/results", body={
+        "student_name": student["name"], "student_id": student["id"], "grade": student["grade"],
+        "subject": subject, "topic": topic, "score": score, "total_questions": total, "duration_seconds": seconds
+    })
+    client.request("POST", "/api/students/xp", body={"student_id": student["id"], "xp_amount": score * 5})
+
+
+def seed(port, rng, count):
+    """A class of students with some history; returns [{id, name, grade}]"""
+    client = Client(port, None)
+    students = []
+    try:
+        for n in range(count):
+            student = client.request("POST", "/api/students", body={"name": f"Student {n + 1}", "grade": rng.randint(1, 6)})
+            if student is None:
+                raise RuntimeError("Could not create students; is the server healthy?")
+            student = {"id": student["id"], "name": student["name"], "grade": student["grade"]}
+            students.append(student)
+            for _ in range(rng.randint(5, 20)):
+                subject = rng.choice(list(SUBJECTS))
+                submit_quiz(client, student, subject, rng.choice(SUBJECTS[subject]), rng.randint(0, 5), 5, rng.randint(30, 300))
+            for _ in range(rng.randint(2, 6)):
+                subject = rng.choice(list(SUBJECTS))
+                client.request("POST", f"/api/students/{student['id']}/lesson-log", body={
+                    "subject": subject, "topic": rng.choice(SUBJECTS[subject]),
+                    "content": "## A lesson\n\n" + "Some **important** words about the topic. " * 40
+                })
+            for i in range(rng.randint(5, 15)):
+                client.request("POST", f"/api/students/{student['id']}/flashcards", body={
+                    "student_id": student["id"], "topic": "Review", "front": f"Question {i}?", "back": f"Answer {i}."
+                })
+    finally:
+        client.close()
+    return students
+
+
+def run_load(port, students, users, duration, seed_value):
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+    visits = [0] * users
+
+    def user(n):
+        rng = random.Random(seed_value * 1000 + n)
+        client = Client(port, recorder)
+        try:
+            while time.perf_counter() < deadline:
+                visit(client, rng, students)
+                visits[n] += 1
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=user, args=(n,), name=f"student-{n}") for n in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start, sum(visits)
+
+
+# ==================== REPORT ====================
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies, statuses, elapsed):
+    values = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if not 200 <= status < 300)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "mean_ms": round(sum(values) / len(values) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def report(recorder, elapsed):
+    endpoints = {
+        endpoint: summarize(values, recorder.statuses[endpoint], elapsed)
+        for endpoint, values in sorted(recorder.latencies.items())
+    }
+    everything = [v for values in recorder.latencies.values() for v in values]
+    statuses = defaultdict(int)
+    for counts in recorder.statuses.values():
+        for status, count in counts.items():
+            statuses[status] += count
+    return endpoints, summarize(everything, statuses, elapsed) if everything else None
+
+
+def regressions(endpoints, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f).get("endpoints", {})
+    found = []
+    for endpoint, stats in endpoints.items():
+        before = baseline.get(endpoint)
+        if before and before.get("p95_ms") and stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(f"{endpoint}: p95 {before['p95_ms']} ms -> {stats['p95_ms']} ms")
+    return found
+
+
+# ==================== SERVER ====================
+
+def start_server(workdir, port, env):
+    """uvicorn on the app in BACKEND_DIR, with relative ./data paths inside workdir"""
+    subprocess.run([sys.executable, os.path.join(BACKEND_DIR, "init_badges.py")], cwd=workdir, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    start = time.perf_counter()
+    while time.perf_counter() - start < BOOT_TIMEOUT_SECONDS:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        if health_ok(port):
+            return server
+        time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError(f"/health did not answer within {BOOT_TIMEOUT_SECONDS}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay student traffic and report per-endpoint latency")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent virtual students")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load")
+    parser.add_argument("--students", type=int, default=30, help="Students to seed")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for traffic, data and fake providers")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="FAKE_TIME_SCALE for provider latency (0 = instant)")
+    parser.add_argument("--out", default="bench_load.json")
+    parser.add_argument("--baseline", help="Earlier results to compare p95 against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 slowdown before failing")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory (database, logs)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    env = dict(os.environ, FAKE_PROVIDERS="1", FAKE_SEED=str(args.seed), FAKE_TIME_SCALE=str(args.time_scale))
+    port = free_port()
+    server = start_server(workdir, port, env)
+    try:
+        rng = random.Random(args.seed)
+        seed_start = time.perf_counter()
+        students = seed(port, rng, args.students)
+        print(f"Seeded {len(students)} students in {time.perf_counter() - seed_start:.1f}s; "
+              f"running {args.users} users for {args.duration:.0f}s")
+        recorder, elapsed, visits = run_load(port, students, args.users, args.duration, args.seed)
+    finally:
+        server.terminate()
+        server.wait()
+        if args.keep:
+            print(f"Scratch directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    endpoints, total = report(recorder, elapsed)
+    results = {
+        "run_at": datetime.utcnow().isoformat(),
+        "config": {"users": args.users, "duration": args.duration, "students": args.students,
+                   "seed": args.seed, "time_scale": args.time_scale},
+        "elapsed_seconds": round(elapsed, 2),
+        "visits": visits,
+        "total": total,
+        "endpoints": endpoints,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'endpoint':<48}{'reqs':>7}{'err':>5}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint, stats in list(endpoints.items()) + [("TOTAL", total)]:
+        if stats:
+            print(f"{endpoint:<48}{stats['requests']:>7}{stats['errors']:>5}{stats['throughput_rps']:>8.1f}"
+                  f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+    print(f"{visits} visits in {elapsed:.1f}s; results in {args.out}")
+
+    if args.baseline:
+        found = regressions(endpoints, args.baseline, args.tolerance)
+        if found:
+            print("Regressed:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare response serialization for ORM-heavy endpoints.
+
+"before" is what FastAPI did when handlers returned SQLAlchemy rows:
+jsonable_encoder over every row, then JSONResponse's json.dumps.
+"after" is the explicit row mapping plus FastJSONResponse (orjson).
+
+Usage: python bench_serialization.py [--sizes 1000 10000] [--repeat 5]
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import models
+import serializers
+from serializers import FastJSONResponse
+
+
+def make_lesson_logs(n):
+    now = datetime.utcnow()
+    content = "## Volcanoes 🌋\n\n**Magma** rises through the crust. " * 20
+    return [
+        models.LessonLog(id=i, student_id=i % 7, subject="Science", topic=f"Topic {i % 50}",
+                         content=content, timestamp=now - timedelta(minutes=i))
+        for i in range(n)
+    ]
+
+
+def make_test_results(n):
+    now = datetime.utcnow()
+    return [
+        models.TestResult(id=i, student_id=i % 7, student_name=f"Student {i % 7}", grade=3,
+                          subject="Math", topic=f"Topic {i % 50}", score=i % 6, total_questions=5,
+                          timestamp=now - timedelta(minutes=i))
+        for i in range(n)
+    ]
+
+
+def make_flashcards(n):
+    now = datetime.utcnow()
+    return [
+        models.Flashcard(id=i, student_id=i % 7, topic=f"Topic {i % 50}", front=f"What is {i}?",
+                         back=f"It is {i}.", ease_factor=2.5, interval=i % 10, next_review=now,
+                         review_count=i % 4)
+        for i in range(n)
+    ]
+
+
+PAYLOADS = [
+    ("lesson_logs", make_lesson_logs, serializers.lesson_log_row),
+    ("test_results", make_test_results, serializers.test_result_row),
+    ("flashcards", make_flashcards, serializers.flashcard_row),
+]
+
+
+def before(items):
+    return JSONResponse(jsonable_encoder(items)).body
+
+
+def after(items, mapper):
+    return FastJSONResponse(serializers.rows(mapper, items)).body
+
+
+def best_of(repeat, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    backend = "orjson" if serializers.orjson is not None else "json (orjson not installed)"
+    print(f"Renderer: {backend}, best of {args.repeat}")
+    print(f"{'payload':<14}{'rows':>8}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name, factory, mapper in PAYLOADS:
+        for size in args.sizes:
+            items = factory(size)
+            t_before = best_of(args.repeat, lambda: before(items))
+            t_after = best_of(args.repeat, lambda: after(items, mapper))
+            print(f"{name:<14}{size:>8}{t_before * 1000:>12.1f}{t_after * 1000:>12.1f}{t_before / t_after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cold-boot time: from launching uvicorn to the first 200 from /health.
+
+Each run starts a fresh server process on a free port, polls /health and
+stops the server. Exits non-zero when the median is over the budget, so it
+can gate a deploy.
+
+Usage: python bench_startup.py [--runs 5] [--budget 1.5]
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BUDGET_SECONDS = 1.5
+TIMEOUT_SECONDS = 30.0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def health_ok(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        conn.request("GET", "/health")
+        return conn.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        conn.close()
+
+
+def boot_once():
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < TIMEOUT_SECONDS:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            if health_ok(port):
+                return time.perf_counter() - start
+            time.sleep(0.01)
+        raise RuntimeError(f"/health did not answer within {TIMEOUT_SECONDS}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold boot to /health")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=BUDGET_SECONDS, help="Max median seconds")
+    args = parser.parse_args()
+
+    times = []
+    for run in range(args.runs):
+        seconds = boot_once()
+        times.append(seconds)
+        print(f"run {run + 1}: {seconds * 1000:.0f} ms")
+
+    median = statistics.median(times)
+    print(f"median {median * 1000:.0f} ms, min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms "
+          f"(budget {args.budget * 1000:.0f} ms)")
+    if median > args.budget:
+        print("Over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
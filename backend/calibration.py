@@ -0,0 +1,152 @@
+"""
+Item difficulty and student ability calibration from answer_events.
+
+Fits a Rasch (one-parameter IRT) model, P(correct) = sigmoid(ability -
+difficulty), by L2-regularised joint maximum likelihood. Each iteration is
+a diagonal Newton step computed with np.bincount over the whole event
+matrix, so a full refit is a few dozen vectorised passes.
+
+Writes:
+    quiz_questions.difficulty  (logits; higher is harder)
+    student_abilities          (logits, same scale)
+    topic_mastery              (predicted accuracy on a typical question of each topic)
+
+Usage: python calibration.py [--iterations 40] [--min-answers 3]
+"""
+
+import argparse
+import json
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models
+from database import engine
+
+ITERATIONS = 40
+# Items answered fewer times than this keep a null difficulty
+MIN_ITEM_ANSWERS = 3
+# Pulls estimates towards 0 so items/students with few answers stay moderate
+L2 = 0.5
+
+
+def _require_numpy():
+    try:
+        import numpy as np
+    except ImportError as e:
+        raise RuntimeError("Calibration needs numpy (pip install numpy)") from e
+    return np
+
+
+def fit_rasch(np, student_idx, item_idx, correct, n_students, n_items, iterations=ITERATIONS, l2=L2):
+    """Abilities and difficulties (both in logits) from parallel index/outcome arrays"""
+    theta = np.zeros(n_students)
+    b = np.zeros(n_items)
+    y = correct.astype(float)
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(b[item_idx] - theta[student_idx]))
+        residual = y - p
+        info = p * (1 - p)
+        theta += (np.bincount(student_idx, residual, n_students) - l2 * theta) / (
+            np.bincount(student_idx, info, n_students) + l2)
+
+        p = 1 / (1 + np.exp(b[item_idx] - theta[student_idx]))
+        residual = y - p
+        info = p * (1 - p)
+        b += (-np.bincount(item_idx, residual, n_items) - l2 * b) / (np.bincount(item_idx, info, n_items) + l2)
+    return theta, b
+
+
+def calibrate(iterations=ITERATIONS, min_answers=MIN_ITEM_ANSWERS):
+    """Refit from every answer event and store the estimates; returns a summary"""
+    np = _require_numpy()
+    events = models.AnswerEvent
+    with engine.connect() as conn:
+        rows = conn.execute(select(
+            events.student_id, events.question_hash, events.topic_key, events.subject, events.topic, events.correct
+        )).all()
+    if not rows:
+        return {"events": 0, "students": 0, "items": 0, "topics": 0}
+
+    student_ids, question_hashes, topic_keys, subjects, topics, correct = zip(*rows)
+    students, student_idx = np.unique(np.array(student_ids), return_inverse=True)
+    items, item_idx = np.unique(np.array(question_hashes, dtype=object), return_inverse=True)
+    correct = np.array(correct, dtype=bool)
+
+    theta, b = fit_rasch(np, student_idx, item_idx, correct, len(students), len(items), iterations)
+    item_answers = np.bincount(item_idx, minlength=len(items))
+    student_answers = np.bincount(student_idx, minlength=len(students))
+
+    # Topic mastery: predicted accuracy at the topic's mean item difficulty
+    keys = np.array([k or "" for k in topic_keys], dtype=object)
+    topic_names, topic_idx = np.unique(keys, return_inverse=True)
+    item_topic = np.zeros(len(items), dtype=int)
+    item_topic[item_idx] = topic_idx
+    topic_difficulty = np.bincount(item_topic, b, len(topic_names)) / np.maximum(
+        np.bincount(item_topic, minlength=len(topic_names)), 1)
+    pair = student_idx * len(topic_names) + topic_idx
+    pairs, pair_idx = np.unique(pair, return_inverse=True)
+    pair_answers = np.bincount(pair_idx)
+    pair_correct = np.bincount(pair_idx, correct.astype(float)).astype(int)
+    pair_student, pair_topic = np.divmod(pairs, len(topic_names))
+    mastery = 1 / (1 + np.exp(topic_difficulty[pair_topic] - theta[pair_student]))
+
+    labels = {}
+    for key, subject, topic in zip(keys, subjects, topics):
+        labels.setdefault(key, (subject, topic))
+
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        calibrated = [
+            {"h": items[i], "d": round(float(b[i]), 4)} for i in range(len(items)) if item_answers[i] >= min_answers
+        ]
+        if calibrated:
+            conn.execute(
+                update(models.QuizQuestion).where(models.QuizQuestion.content_hash == bindparam("h"))
+                .values(difficulty=bindparam("d")),
+                calibrated
+            )
+
+        stmt = sqlite_insert(models.StudentAbility)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=["student_id"],
+            set_={"ability": stmt.excluded.ability, "answers": stmt.excluded.answers, "updated_at": stmt.excluded.updated_at}
+        ), [
+            {"student_id": int(students[s]), "ability": round(float(theta[s]), 4),
+             "answers": int(student_answers[s]), "updated_at": now}
+            for s in range(len(students))
+        ])
+
+        stmt = sqlite_insert(models.TopicMastery)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=["student_id", "topic_key"],
+            set_={name: getattr(stmt.excluded, name) for name in ("subject", "topic", "mastery", "answers", "correct", "updated_at")}
+        ), [
+            {"student_id": int(students[pair_student[k]]), "topic_key": topic_names[pair_topic[k]],
+             "subject": labels[topic_names[pair_topic[k]]][0], "topic": labels[topic_names[pair_topic[k]]][1],
+             "mastery": round(float(mastery[k]), 4), "answers": int(pair_answers[k]),
+             "correct": int(pair_correct[k]), "updated_at": now}
+            for k in range(len(pairs))
+        ])
+
+    return {
+        "events": len(rows),
+        "students": len(students),
+        "items": len(items),
+        "items_calibrated": len(calibrated),
+        "topics": len(topic_names),
+        "calibrated_at": now.isoformat(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate question difficulty and student ability")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--min-answers", type=int, default=MIN_ITEM_ANSWERS)
+    args = parser.parse_args()
+    print(json.dumps(calibrate(args.iterations, args.min_answers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Conversation memory and context compression for /api/chat.
+
+Lesson text is stored once per content hash, so the client only ships it
+the first time and then refers to it by `context_id`. Long lessons are
+replaced in the prompt by a summary computed once per lesson plus the
+paragraphs most relevant to the question. The last few turns of the
+student's session for that lesson are included, all under a token budget.
+"""
+
+import hashlib
+import re
+import threading
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from prompts import estimate_tokens
+
+# Prompt budget for lesson material + history, in estimated tokens
+PROMPT_TOKEN_BUDGET = 1200
+# Lessons shorter than this are sent whole; no summary needed
+FULL_CONTEXT_TOKENS = 600
+HISTORY_TURNS = 6
+SUMMARY_WORDS = 120
+
+# One lock per lesson, so a slow summary only holds up chats about that lesson
+_summary_locks = {}
+_summary_locks_guard = threading.Lock()
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "does", "for", "from",
+    "how", "i", "if", "in", "is", "it", "its", "me", "my", "of", "on", "or", "so", "that", "the",
+    "their", "them", "there", "they", "this", "to", "was", "we", "what", "when", "where", "which",
+    "who", "why", "will", "with", "you", "your",
+}
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def terms(text: str):
+    return [w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS]
+
+
+def split_paragraphs(text: str, max_chars: int = 800):
+    """Blank-line separated paragraphs, with very long ones cut at sentence ends"""
+    paragraphs = []
+    for block in re.split(r"\n\s*\n", text or ""):
+        block = block.strip()
+        while len(block) > max_chars:
+            cut = block.rfind(". ", 0, max_chars)
+            cut = cut + 1 if cut > 0 else max_chars
+            paragraphs.append(block[:cut].strip())
+            block = block[cut:].strip()
+        if block:
+            paragraphs.append(block)
+    return paragraphs
+
+
+def rank_paragraphs(paragraphs, question: str):
+    """Paragraph indexes ordered by overlap with the question's terms"""
+    wanted = set(terms(question))
+    if not wanted:
+        return list(range(len(paragraphs)))
+    scores = []
+    for i, paragraph in enumerate(paragraphs):
+        words = terms(paragraph)
+        hits = sum(1 for w in words if w in wanted)
+        # Normalise lightly so long paragraphs don't always win
+        scores.append((hits / (1 + len(words)) ** 0.5, -i))
+    return [-neg_index for _, neg_index in sorted(scores, reverse=True)]
+
+
+def extractive_summary(text: str, words: int = SUMMARY_WORDS) -> str:
+    """Fallback summary: the first sentence of each paragraph, up to `words` words"""
+    sentences = []
+    for paragraph in split_paragraphs(text):
+        first = re.split(r"(?<=[.!?])\s", paragraph, maxsplit=1)[0]
+        sentences.append(first)
+    summary = " ".join(sentences).split()
+    return " ".join(summary[:words])
+
+
+# ==================== STORAGE ====================
+
+def remember_context(db: Session, text: str) -> models.LessonContext:
+    """Store lesson text by hash (no-op if already stored) and return the row"""
+    key = content_hash(text)
+    row = get_context(db, key)
+    if not row:
+        # Two students can open the same lesson at once; the second insert is a no-op
+        db.execute(sqlite_insert(models.LessonContext).values(content_hash=key, content=text)
+                   .on_conflict_do_nothing(index_elements=["content_hash"]))
+        db.commit()
+        row = get_context(db, key)
+    return row
+
+
+def get_context(db: Session, context_id: str):
+    return db.query(models.LessonContext).filter(models.LessonContext.content_hash == context_id).first()
+
+
+def ensure_summary(db: Session, context: models.LessonContext, summarize) -> str:
+    """Summary of a lesson, computed once and cached on the row.
+
+    `summarize(text) -> str` is the LLM call; the extractive summary is used
+    if it fails.
+    """
+    if context.summary:
+        return context.summary
+    key = context.content_hash
+    with _summary_locks_guard:
+        lock = _summary_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            db.refresh(context)
+            if context.summary:
+                return context.summary
+            try:
+                summary = (summarize(context.content) or "").strip()
+            except Exception as e:
+                print(f"Lesson summary failed, using extractive summary: {e}")
+                summary = ""
+            context.summary = summary or extractive_summary(context.content)
+            db.commit()
+    finally:
+        # Later callers find the stored summary, so the lock needn't outlive this call
+        with _summary_locks_guard:
+            if _summary_locks.get(key) is lock:
+                del _summary_locks[key]
+    return context.summary
+
+
+def recent_turns(db: Session, student_id: int, lesson_key: str, limit: int = HISTORY_TURNS):
+    turns = db.query(models.ChatTurn).filter(
+        models.ChatTurn.student_id == student_id,
+        models.ChatTurn.lesson_key == lesson_key
+    ).order_by(models.ChatTurn.id.desc()).limit(limit).all()
+    return list(reversed(turns))
+
+
+def save_exchange(db: Session, student_id: int, lesson_key: str, question: str, reply: str):
+    db.add(models.ChatTurn(student_id=student_id, lesson_key=lesson_key, role="student", content=question))
+    db.add(models.ChatTurn(student_id=student_id, lesson_key=lesson_key, role="tutor", content=reply))
+    db.commit()
+
+
+# ==================== PROMPT ASSEMBLY ====================
+
+def build_context_sections(question: str, lesson_text: str = "", summary: str = "", turns=(),
+                           related=(), budget: int = PROMPT_TOKEN_BUDGET):
+    """Lesson material and history for the prompt, trimmed to `budget` tokens.
+
+    `related` are chunks retrieved from the student's earlier lessons, best
+    first. Returns a dict with "lesson" (full text, or summary + excerpts),
+    "history" (formatted recent turns) and "related" (earlier lesson excerpts).
+    """
+    # History first: keep the newest turns that fit in a third of the budget
+    history_lines = []
+    used = 0
+    for turn in reversed(list(turns)):
+        speaker = "Student" if turn.role == "student" else "Professor Hoot"
+        line = f"{speaker}: {turn.content}"
+        cost = estimate_tokens(line)
+        if used + cost > budget // 3:
+            break
+        history_lines.insert(0, line)
+        used += cost
+    remaining = budget - used
+
+    if estimate_tokens(lesson_text) <= min(FULL_CONTEXT_TOKENS, remaining):
+        lesson = lesson_text
+        remaining -= estimate_tokens(lesson)
+    else:
+        parts = []
+        if summary:
+            parts.append("Lesson Summary:\n" + summary)
+            remaining -= estimate_tokens(summary)
+        paragraphs = split_paragraphs(lesson_text)
+        excerpts = []
+        for i in rank_paragraphs(paragraphs, question):
+            cost = estimate_tokens(paragraphs[i])
+            if cost > remaining:
+                continue
+            excerpts.append(i)
+            remaining -= cost
+        if excerpts:
+            # Keep excerpts in lesson order so they read naturally
+            parts.append("Relevant Lesson Excerpts:\n" + "\n\n".join(paragraphs[i] for i in sorted(excerpts)))
+        lesson = "\n\n".join(parts)
+
+    # Earlier lessons get whatever budget is left
+    related_lines = []
+    for chunk in related:
+        line = f"[{chunk['subject']}: {chunk['topic']}]\n{chunk['text']}"
+        cost = estimate_tokens(line)
+        if cost > remaining:
+            continue
+        related_lines.append(line)
+        remaining -= cost
+
+    return {"lesson": lesson, "history": "\n".join(history_lines), "related": "\n\n".join(related_lines)}
@@ -0,0 +1,270 @@
+"""
+Columnar export and cohort statistics for term reports.
+
+Learning history (test results, lesson logs, flashcards, streaks) is
+streamed out of SQLite in batches straight into Arrow record batches,
+written as Parquet or Arrow IPC files under data/exports, and summarised
+with vectorised NumPy instead of walking ORM rows.
+
+Usage:
+    python exports.py export [--format parquet|arrow] [--out data/exports]
+    python exports.py summary
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import select
+
+import models
+from database import engine
+
+EXPORT_DIR = "./data/exports"
+BATCH_SIZE = 5000
+DEFAULT_SUBJECT = "general"
+
+# Columns exported per table; lesson content is reduced to its length
+EXPORT_TABLES = {
+    "test_results": [
+        models.TestResult.id, models.TestResult.student_id, models.TestResult.grade,
+        models.TestResult.subject, models.TestResult.topic, models.TestResult.score,
+        models.TestResult.total_questions, models.TestResult.timestamp,
+    ],
+    "lesson_logs": [
+        models.LessonLog.id, models.LessonLog.student_id, models.LessonLog.subject,
+        models.LessonLog.topic, models.LessonLog.content, models.LessonLog.timestamp,
+    ],
+    "flashcards": [
+        models.Flashcard.id, models.Flashcard.student_id, models.Flashcard.topic,
+        models.Flashcard.ease_factor, models.Flashcard.interval, models.Flashcard.review_count,
+        models.Flashcard.next_review,
+    ],
+    "student_streaks": [
+        models.StudentStreak.student_id, models.StudentStreak.current_streak,
+        models.StudentStreak.longest_streak, models.StudentStreak.last_activity_date,
+    ],
+}
+
+
+def _require_arrow():
+    try:
+        import numpy as np
+        import pyarrow as pa
+    except ImportError as e:
+        raise RuntimeError("Columnar exports need numpy and pyarrow (pip install numpy pyarrow)") from e
+    return np, pa
+
+
+def _schema(pa, table_name):
+    types = {
+        "id": pa.int64(), "student_id": pa.int64(), "grade": pa.int32(), "score": pa.int32(),
+        "total_questions": pa.int32(), "interval": pa.int32(), "review_count": pa.int32(),
+        "current_streak": pa.int32(), "longest_streak": pa.int32(), "ease_factor": pa.float64(),
+        "content_chars": pa.int64(), "timestamp": pa.timestamp("us"), "next_review": pa.timestamp("us"),
+        "last_activity_date": pa.date32(),
+    }
+    names = [c.key if c.key != "content" else "content_chars" for c in EXPORT_TABLES[table_name]]
+    return pa.schema([(name, types.get(name, pa.string())) for name in names])
+
+
+def iter_record_batches(table_name, batch_size=BATCH_SIZE):
+    """Stream one table as Arrow record batches without materialising ORM objects"""
+    np, pa = _require_arrow()
+    schema = _schema(pa, table_name)
+    columns = EXPORT_TABLES[table_name]
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(select(*columns))
+        for chunk in result.partitions(batch_size):
+            data = list(zip(*chunk))
+            arrays = []
+            for field, values in zip(schema, data):
+                if field.name == "content_chars":
+                    values = [len(v) if v else 0 for v in values]
+                arrays.append(pa.array(values, type=field.type))
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def read_table(table_name):
+    _, pa = _require_arrow()
+    batches = list(iter_record_batches(table_name))
+    return pa.Table.from_batches(batches, schema=_schema(pa, table_name))
+
+
+def export_all(fmt="parquet", out_dir=EXPORT_DIR):
+    """Write every table to out_dir/<stamp>/<table>.<fmt>; returns {table: {path, rows}}"""
+    _, pa = _require_arrow()
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError("format must be 'parquet' or 'arrow'")
+
+    target = os.path.join(out_dir, datetime.utcnow().strftime("%Y%m%dT%H%M%S"))
+    os.makedirs(target, exist_ok=True)
+
+    written = {}
+    for table_name in EXPORT_TABLES:
+        schema = _schema(pa, table_name)
+        path = os.path.join(target, f"{table_name}.{fmt}")
+        rows = 0
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(path, schema)
+        else:
+            writer = pa.ipc.new_file(path, schema)
+        try:
+            for batch in iter_record_batches(table_name):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        finally:
+            writer.close()
+        written[table_name] = {"path": path, "rows": rows}
+    return written
+
+
+# ==================== VECTORISED STATISTICS ====================
+
+def _strings(np, column):
+    return np.array([v if v else DEFAULT_SUBJECT for v in column.to_pylist()], dtype=object)
+
+
+def _numbers(np, column, dtype=float):
+    return column.fill_null(0).to_numpy(zero_copy_only=False).astype(dtype)
+
+
+def topic_difficulty(np, results, limit=20):
+    """Per-topic attempts, mean accuracy and difficulty (1 - accuracy), hardest first"""
+    if results.num_rows == 0:
+        return []
+    score = _numbers(np, results.column("score"))
+    total = _numbers(np, results.column("total_questions"))
+    valid = total > 0
+    accuracy = np.divide(score, total, out=np.zeros_like(score), where=valid)
+
+    topics = _strings(np, results.column("topic"))[valid]
+    subjects = _strings(np, results.column("subject"))[valid]
+    keys = np.array([f"{s}\x1f{t}" for s, t in zip(subjects, topics)], dtype=object)
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    attempts = np.bincount(inverse)
+    mean_acc = np.bincount(inverse, weights=accuracy[valid]) / attempts
+
+    order = np.argsort(mean_acc)[:limit]
+    return [
+        {
+            "subject": uniq[i].split("\x1f")[0],
+            "topic": uniq[i].split("\x1f")[1],
+            "attempts": int(attempts[i]),
+            "mean_accuracy": round(float(mean_acc[i]), 3),
+            "difficulty": round(1 - float(mean_acc[i]), 3),
+        }
+        for i in order
+    ]
+
+
+def score_distribution(np, results, bins=10):
+    """Histogram of quiz percentages overall and per subject"""
+    edges = np.linspace(0, 100, bins + 1)
+    if results.num_rows == 0:
+        return {"bin_edges": edges.tolist(), "overall": [0] * bins, "by_subject": {}}
+    score = _numbers(np, results.column("score"))
+    total = _numbers(np, results.column("total_questions"))
+    valid = total > 0
+    pct = 100 * score[valid] / total[valid]
+    subjects = _strings(np, results.column("subject"))[valid]
+
+    by_subject = {}
+    for subject in np.unique(subjects):
+        counts, _ = np.histogram(pct[subjects == subject], bins=edges)
+        by_subject[str(subject)] = counts.tolist()
+    overall, _ = np.histogram(pct, bins=edges)
+    return {
+        "bin_edges": edges.tolist(),
+        "overall": overall.tolist(),
+        "mean": round(float(pct.mean()), 1) if pct.size else 0,
+        "median": round(float(np.median(pct)), 1) if pct.size else 0,
+        "by_subject": by_subject,
+    }
+
+
+def flashcard_retention(np, cards, max_reviews=10):
+    """Share of cards still recalled (interval > 0) after k reviews, with mean interval"""
+    if cards.num_rows == 0:
+        return []
+    reviews = _numbers(np, cards.column("review_count"), int)
+    interval = _numbers(np, cards.column("interval"))
+    reviews = np.minimum(reviews, max_reviews)
+    counts = np.bincount(reviews, minlength=max_reviews + 1)
+    recalled = np.bincount(reviews, weights=(interval > 0).astype(float), minlength=max_reviews + 1)
+    interval_sum = np.bincount(reviews, weights=interval, minlength=max_reviews + 1)
+    return [
+        {
+            "reviews": k if k < max_reviews else f"{max_reviews}+",
+            "cards": int(counts[k]),
+            "retained": round(float(recalled[k] / counts[k]), 3),
+            "mean_interval_days": round(float(interval_sum[k] / counts[k]), 1),
+        }
+        for k in range(1, max_reviews + 1) if counts[k]
+    ]
+
+
+def streak_survival(np, streaks, days=(1, 2, 3, 5, 7, 14, 30)):
+    """Share of students whose longest streak reached at least d days"""
+    if streaks.num_rows == 0:
+        return []
+    longest = _numbers(np, streaks.column("longest_streak"), int)
+    return [{"days": d, "share": round(float((longest >= d).mean()), 3)} for d in days]
+
+
+def lesson_activity(np, lessons):
+    if lessons.num_rows == 0:
+        return []
+    subjects = _strings(np, lessons.column("subject"))
+    chars = _numbers(np, lessons.column("content_chars"))
+    uniq, inverse = np.unique(subjects, return_inverse=True)
+    counts = np.bincount(inverse)
+    mean_chars = np.bincount(inverse, weights=chars) / counts
+    return [
+        {"subject": str(s), "lessons": int(c), "mean_chars": int(m)}
+        for s, c, m in sorted(zip(uniq, counts, mean_chars), key=lambda x: -x[1])
+    ]
+
+
+def cohort_summary():
+    """Cohort-level statistics across all students, as JSON-ready dicts"""
+    np, _ = _require_arrow()
+    results = read_table("test_results")
+    cards = read_table("flashcards")
+    streaks = read_table("student_streaks")
+    lessons = read_table("lesson_logs")
+    return {
+        "generated_at": datetime.utcnow().isoformat(),
+        "rows": {
+            "test_results": results.num_rows, "lesson_logs": lessons.num_rows,
+            "flashcards": cards.num_rows, "student_streaks": streaks.num_rows,
+        },
+        "topic_difficulty": topic_difficulty(np, results),
+        "score_distribution": score_distribution(np, results),
+        "flashcard_retention": flashcard_retention(np, cards),
+        "streak_survival": streak_survival(np, streaks),
+        "lessons_by_subject": lesson_activity(np, lessons),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export learning history and cohort statistics")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="write tables as Parquet/Arrow files")
+    export_cmd.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    export_cmd.add_argument("--out", default=EXPORT_DIR)
+    sub.add_parser("summary", help="print cohort statistics as JSON")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for table_name, info in export_all(args.format, args.out).items():
+            print(f"{table_name}: {info['rows']} rows -> {info['path']}")
+    else:
+        print(json.dumps(cohort_summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Offline stand-ins for Gemini, Imagen, Ollama, ElevenLabs and Edge TTS.
+
+With FAKE_PROVIDERS=1, providers.py hands these out instead of the real
+clients. They implement the slice of each SDK the app calls, so every
+generation path (prompt accounting, caches, the job queue's retries,
+streaming parsers, podcast mixing) runs exactly as it would against the
+network, just on a laptop without keys.
+
+Outputs are deterministic: the text for a prompt is derived from FAKE_SEED
+and the prompt itself, and has the JSON shape the app expects for that
+prompt template. Latency, 429s and malformed JSON are drawn from a seeded
+generator, so a benchmark run is repeatable.
+
+Settings (environment):
+    FAKE_SEED                  seed for outputs, latency and errors (0)
+    FAKE_LLM_LATENCY_MS        median time to first token (600)
+    FAKE_IMAGE_LATENCY_MS      median image generation time (2500)
+    FAKE_TTS_LATENCY_MS        median time to first audio byte (250)
+    FAKE_LATENCY_SIGMA         log-normal spread of all latencies (0.4; 0 = fixed)
+    FAKE_TOKENS_PER_SECOND     LLM output speed (80)
+    FAKE_TTS_REALTIME_FACTOR   seconds of audio produced per second (8)
+    FAKE_RATE_LIMIT_RATE       fraction of calls failing with a 429 (0)
+    FAKE_MALFORMED_JSON_RATE   fraction of JSON responses cut short (0)
+    FAKE_TIME_SCALE            multiplier for every sleep (1; 0 = instant)
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from types import SimpleNamespace
+
+from prompts import estimate_tokens
+
+SEED = int(os.getenv("FAKE_SEED", "0"))
+LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "600"))
+IMAGE_LATENCY_MS = float(os.getenv("FAKE_IMAGE_LATENCY_MS", "2500"))
+TTS_LATENCY_MS = float(os.getenv("FAKE_TTS_LATENCY_MS", "250"))
+LATENCY_SIGMA = float(os.getenv("FAKE_LATENCY_SIGMA", "0.4"))
+TOKENS_PER_SECOND = float(os.getenv("FAKE_TOKENS_PER_SECOND", "80"))
+TTS_REALTIME_FACTOR = float(os.getenv("FAKE_TTS_REALTIME_FACTOR", "8"))
+RATE_LIMIT_RATE = float(os.getenv("FAKE_RATE_LIMIT_RATE", "0"))
+MALFORMED_JSON_RATE = float(os.getenv("FAKE_MALFORMED_JSON_RATE", "0"))
+TIME_SCALE = float(os.getenv("FAKE_TIME_SCALE", "1"))
+
+STREAM_CHUNK_TOKENS = 6
+SPOKEN_CHARS_PER_SECOND = 15
+
+
+class FakeRateLimitError(Exception):
+    """Raised like the SDKs' quota errors; the message carries 429 so callers classify it the same way"""
+
+    def __init__(self, provider: str):
+        super().__init__(f"429 RESOURCE_EXHAUSTED: {provider} quota exceeded (fake)")
+        self.status_code = 429
+
+
+# ==================== LATENCY AND FAULTS ====================
+
+class Faults:
+    """Seeded latency samples and error decisions, shared by every fake client"""
+
+    def __init__(self, seed: int = SEED):
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def latency(self, median_ms: float) -> float:
+        """Seconds, log-normally distributed around the median"""
+        with self._lock:
+            factor = math.exp(self._rng.gauss(0, LATENCY_SIGMA)) if LATENCY_SIGMA > 0 else 1.0
+        return median_ms / 1000 * factor * TIME_SCALE
+
+    def chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+
+    def call(self, kind: str):
+        """Count a call and raise an injected 429 at the configured rate"""
+        self.counts[kind] += 1
+        if self.chance(RATE_LIMIT_RATE):
+            self.counts[f"{kind}_rate_limited"] += 1
+            raise FakeRateLimitError(kind)
+
+    def malformed(self, text: str) -> str:
+        """Cut a JSON response short at the configured rate"""
+        if not self.chance(MALFORMED_JSON_RATE):
+            return text
+        self.counts["malformed_json"] += 1
+        return text[:max(1, len(text) * 2 // 3)]
+
+
+faults = Faults()
+
+
+def stats():
+    return dict(faults.counts)
+
+
+def _sleep(seconds: float):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+# ==================== TEXT ====================
+
+_WORDS = (
+    "learn discover energy pattern shape number story river forest planet light sound water "
+    "animal plant market family village island ocean mountain season weather machine rhythm "
+    "colour circle friend explore measure compare build change grow notice question answer"
+).split()
+
+
+def _rng_for(prompt: str) -> random.Random:
+    digest = hashlib.sha256(f"{SEED}|{prompt}".encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def _sentence(rng: random.Random, subject: str = "", words: int = 12) -> str:
+    picked = [rng.choice(_WORDS) for _ in range(words)]
+    if subject:
+        picked.insert(rng.randrange(len(picked)), subject)
+    return " ".join(picked).capitalize() + "."
+
+
+def _paragraph(rng, subject="", sentences=4):
+    return " ".join(_sentence(rng, subject, rng.randint(8, 16)) for _ in range(sentences))
+
+
+def _question(rng, topic, number):
+    correct = rng.choice(_WORDS).capitalize()
+    options = [correct] + rng.sample([w.capitalize() for w in _WORDS if w.capitalize() != correct], 3)
+    rng.shuffle(options)
+    return {
+        "id": number,
+        "question": f"Question {number} about {topic}: which word fits best? {rng.choice(['🌟', '🧠', '🔍', '🎯'])}",
+        "options": options,
+        "correct": correct,
+        "explanation": _sentence(rng, topic, 10),
+    }
+
+
+def _number(prompt: str, pattern: str, default: int) -> int:
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+
+def fake_text(prompt, json_mode: bool = False) -> str:
+    """Deterministic output shaped like the real model's answer to this prompt's template"""
+    rng = _rng_for(prompt)
+    template = getattr(prompt, "template", None)
+    name = template.name if template else None
+    values = getattr(prompt, "values", None) or {}
+    topic = str(values.get("subtopic") or values.get("topic") or "today's lesson")
+
+    if name == "greeting":
+        return f"Hoot hoot, {values.get('name', 'friend')}! Ready for a fun learning adventure? 🦉"
+    if name == "greeting_batch":
+        count = int(values.get("count", 5))
+        return json.dumps({"greetings": [f"{_sentence(rng, '{name}', 6)[:-1]}! 🌟" for _ in range(count)]})
+    if name == "lesson_summary":
+        words = str(values.get("text", "")).split()
+        return " ".join(words[:int(values.get("words", 120))])
+    if name == "chat":
+        return f"Great question! {_sentence(rng, topic)} {_sentence(rng)} 🦉"
+    if name == "lesson_plan":
+        return json.dumps({"plan": [f"{topic.title()} part {n}: {rng.choice(_WORDS)}" for n in range(1, rng.randint(3, 5) + 1)]})
+    if name == "lesson_content":
+        sections = [f"## {topic} ✨", _paragraph(rng, f"**{topic}**")]
+        sections += [f"- {_sentence(rng, topic, 8)}" for _ in range(4)]
+        sections += [_paragraph(rng, topic) for _ in range(2)]
+        return "\n\n".join(sections)
+    if name == "lesson_image_decision":
+        needs_image = rng.random() < 0.5
+        return json.dumps({"needs_image": needs_image, "image_prompt": f"A diagram of {topic}" if needs_image else None})
+    if name == "quiz":
+        count = int(values.get("num_questions", 5))
+        return json.dumps({"questions": [_question(rng, topic, n) for n in range(1, count + 1)]})
+    if name == "twi_translate":
+        return json.dumps({"translation": _sentence(rng, words=5), "pronunciation": _sentence(rng, words=5), "notes": ""})
+    if name == "twi_vocab":
+        return json.dumps({"vocab": [
+            {"twi": rng.choice(_WORDS), "english": rng.choice(_WORDS), "pronunciation": rng.choice(_WORDS),
+             "example": _sentence(rng, words=6)}
+            for _ in range(18)
+        ]})
+    if name == "flashcards":
+        count = int(values.get("num_cards", 5))
+        return json.dumps({"flashcards": [{"front": _sentence(rng, words=6)[:-1] + "?", "back": _sentence(rng, words=8)}
+                                          for _ in range(count)]})
+    if name == "podcast_script":
+        lines = int(values.get("lines", 40))
+        chapters = []
+        for number in range(1, 5):
+            chapters.append({"title": f"Part {number}: {rng.choice(_WORDS).title()}", "lines": [
+                {"speaker": "AB"[n % 2], "text": _sentence(rng, topic, rng.randint(8, 18))}
+                for n in range(max(2, lines // 4))
+            ]})
+        return json.dumps({"title": f"All about {topic}", "chapters": chapters})
+
+    # Ad-hoc prompts: guess the shape from the wording
+    if json_mode or "json" in prompt.lower():
+        count = _number(prompt, r"(\d+)-question", 0)
+        if count:
+            return json.dumps({"questions": [_question(rng, topic, n) for n in range(1, count + 1)]})
+        return json.dumps({"text": _sentence(rng)})
+    return _paragraph(rng, sentences=3)
+
+
+def _chunks(text: str):
+    size = STREAM_CHUNK_TOKENS * 4
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _generate(kind: str, prompt, json_mode: bool):
+    """(prompt, text) after the time to first token; callers add the time to write the text"""
+    prompt = prompt if isinstance(prompt, str) else str(prompt)
+    faults.call(kind)
+    _sleep(faults.latency(LLM_LATENCY_MS))
+    text = fake_text(prompt, json_mode)
+    if json_mode:
+        text = faults.malformed(text)
+    return prompt, text
+
+
+def _chunk_seconds(chunk: str) -> float:
+    return estimate_tokens(chunk) / TOKENS_PER_SECOND * TIME_SCALE
+
+
+# ==================== GEMINI / IMAGEN ====================
+
+class _GeminiModels:
+    def generate_content(self, model, contents, config=None):
+        prompt, text = _generate("gemini", contents, _json_mode(config))
+        _sleep(_chunk_seconds(text))
+        return SimpleNamespace(text=text, usage_metadata=_gemini_usage(prompt, text))
+
+    def generate_content_stream(self, model, contents, config=None):
+        prompt, text = _generate("gemini", contents, _json_mode(config))
+        chunks = _chunks(text)
+        for n, chunk in enumerate(chunks):
+            _sleep(_chunk_seconds(chunk))
+            usage = _gemini_usage(prompt, text) if n == len(chunks) - 1 else None
+            yield SimpleNamespace(text=chunk, usage_metadata=usage)
+
+    def generate_images(self, model, prompt, config=None):
+        faults.call("imagen")
+        _sleep(faults.latency(IMAGE_LATENCY_MS))
+        image = SimpleNamespace(image_bytes=fake_png(str(prompt)))
+        return SimpleNamespace(generated_images=[SimpleNamespace(image=image)])
+
+
+def _json_mode(config) -> bool:
+    return getattr(config, "response_mime_type", None) == "application/json"
+
+
+def _gemini_usage(prompt, text):
+    return SimpleNamespace(prompt_token_count=estimate_tokens(prompt), candidates_token_count=estimate_tokens(text))
+
+
+class FakeGeminiClient:
+    def __init__(self):
+        self.models = _GeminiModels()
+
+
+class _Config(SimpleNamespace):
+    """Accepts any keyword arguments, like the SDK's config models"""
+
+
+gemini_types = SimpleNamespace(GenerateContentConfig=_Config, GenerateImagesConfig=_Config)
+
+
+def fake_png(prompt: str, width: int = 160, height: int = 90) -> bytes:
+    """A flat-colour PNG whose colour depends on the prompt"""
+    r, g, b = _rng_for(prompt).randbytes(3)
+    row = b"\x00" + bytes((r, g, b)) * width
+    raw = zlib.compress(row * height)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", raw) + chunk(b"IEND", b""))
+
+
+# ==================== OLLAMA (OPENAI-COMPATIBLE) ====================
+
+class _Completions:
+    def create(self, model, messages, response_format=None, stream=False, stream_options=None, **kwargs):
+        prompt = messages[-1]["content"]
+        json_mode = (response_format or {}).get("type") == "json_object"
+        prompt, text = _generate("local", prompt, json_mode)
+        usage = SimpleNamespace(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(text))
+        if not stream:
+            _sleep(_chunk_seconds(text))
+            message = SimpleNamespace(content=text)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+        return self._stream(text, usage, (stream_options or {}).get("include_usage"))
+
+    def _stream(self, text, usage, include_usage):
+        for chunk in _chunks(text):
+            _sleep(_chunk_seconds(chunk))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))], usage=None)
+        if include_usage:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+
+class FakeOpenAIClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_Completions())
+
+
+# ==================== SPEECH ====================
+
+# A silent MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, joint stereo
+_MP3_HEADER = b"\xff\xfb\x90\x64"
+_MP3_FRAME = _MP3_HEADER + bytes(417 - 4)
+_MP3_FRAME_SECONDS = 1152 / 44100
+_FRAMES_PER_CHUNK = 16
+
+
+def fake_mp3(text: str) -> bytes:
+    """Silence lasting about as long as reading the text aloud"""
+    seconds = max(0.5, len(text) / SPOKEN_CHARS_PER_SECOND)
+    return _MP3_FRAME * math.ceil(seconds / _MP3_FRAME_SECONDS)
+
+
+def _audio_chunks(text: str):
+    audio = fake_mp3(text)
+    size = len(_MP3_FRAME) * _FRAMES_PER_CHUNK
+    return [audio[i:i + size] for i in range(0, len(audio), size)]
+
+
+def _audio_chunk_seconds() -> float:
+    return _FRAMES_PER_CHUNK * _MP3_FRAME_SECONDS / TTS_REALTIME_FACTOR * TIME_SCALE
+
+
+class _TextToSpeech:
+    def stream(self, voice_id, text, model_id=None, output_format=None, **kwargs):
+        faults.call("elevenlabs")
+        return self._stream(text)
+
+    def _stream(self, text):
+        _sleep(faults.latency(TTS_LATENCY_MS))
+        for chunk in _audio_chunks(text):
+            yield chunk
+            _sleep(_audio_chunk_seconds())
+
+
+class _Voices:
+    def get_all(self):
+        return SimpleNamespace(voices=[
+            SimpleNamespace(voice_id="FakeVoiceRachel00001", name="Rachel (fake)"),
+            SimpleNamespace(voice_id="FakeVoiceSarah000002", name="Sarah (fake)"),
+        ])
+
+
+class FakeElevenLabsClient:
+    def __init__(self):
+        self.text_to_speech = _TextToSpeech()
+        self.voices = _Voices()
+
+
+class FakeCommunicate:
+    """edge_tts.Communicate: `async for chunk in Communicate(text, voice).stream()`"""
+
+    def __init__(self, text: str, voice: str):
+        self.text = text
+        self.voice = voice
+
+    async def stream(self):
+        faults.call("edge")
+        await asyncio.sleep(faults.latency(TTS_LATENCY_MS))
+        for chunk in _audio_chunks(self.text):
+            yield {"type": "audio", "data": chunk}
+            await asyncio.sleep(_audio_chunk_seconds())
@@ -0,0 +1,109 @@
+"""
+Atomic XP and streak writes.
+
+Both updates are single set-based statements evaluated by SQLite, so two
+concurrent quiz completions can neither lose XP nor count the same streak day
+twice, and the write transaction only lives for one statement plus commit.
+"""
+
+import bisect
+from datetime import date, timedelta
+
+from sqlalchemy import and_, case, func, or_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import leaderboard
+import models
+
+# Level N is reached once XP goes above LEVEL_THRESHOLDS[N - 1]
+# Level 1: 0-100, Level 2: 101-300, Level 3: 301-600, Level 4: 601-1000, Level 5: 1000+
+LEVEL_THRESHOLDS = [0, 100, 300, 600, 1000]
+
+# Days in a row before a streak freeze is earned
+FREEZE_AFTER_DAYS = 7
+
+
+def level_for_xp(xp: int) -> int:
+    return max(1, bisect.bisect_left(LEVEL_THRESHOLDS, xp))
+
+
+def _level_case(xp_expr):
+    """SQL CASE expression equivalent to level_for_xp"""
+    whens = [
+        (xp_expr > threshold, level)
+        for level, threshold in reversed(list(enumerate(LEVEL_THRESHOLDS, 1)))
+        if level > 1
+    ]
+    return case(*whens, else_=1)
+
+
+def award_xp(db: Session, student_id: int, amount: int):
+    """Add XP with one UPDATE ... RETURNING and append the ledger event.
+
+    Returns (xp, level, leveled_up, event) or None if the student is missing.
+    Does not commit.
+    """
+    new_xp = func.coalesce(models.Student.xp, 0) + amount
+    stmt = (
+        update(models.Student)
+        .where(models.Student.id == student_id)
+        .values(xp=new_xp, level=_level_case(new_xp))
+        .returning(models.Student.xp, models.Student.level)
+        .execution_options(synchronize_session=False)
+    )
+    row = db.execute(stmt).first()
+    if row is None:
+        return None
+
+    event = leaderboard.record_xp_event(db, student_id, amount)
+    leveled_up = row.level > level_for_xp(row.xp - amount)
+    return row.xp, row.level, leveled_up, event
+
+
+def ensure_streak(db: Session, student_id: int):
+    """Create the streak row if missing without racing other requests"""
+    stmt = sqlite_insert(models.StudentStreak).values(student_id=student_id)
+    db.execute(stmt.on_conflict_do_nothing(index_elements=["student_id"]))
+
+
+def record_activity(db: Session, student_id: int, today: date = None):
+    """Advance the student's streak for `today` with a single conditional upsert.
+
+    Returns (current_streak, longest_streak, freeze_available), or None when
+    activity was already logged today. Does not commit.
+    """
+    today = today or date.today()
+    streak = models.StudentStreak
+
+    current = func.coalesce(streak.current_streak, 0)
+    continued = streak.last_activity_date == today - timedelta(days=1)
+    new_streak = case((continued, current + 1), else_=1)
+
+    stmt = sqlite_insert(streak).values(
+        student_id=student_id,
+        current_streak=1,
+        longest_streak=1,
+        last_activity_date=today,
+        freeze_available=False,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["student_id"],
+        set_={
+            "current_streak": new_streak,
+            "longest_streak": func.max(func.coalesce(streak.longest_streak, 0), new_streak),
+            "freeze_available": case(
+                (and_(continued, current + 1 >= FREEZE_AFTER_DAYS), True),
+                (continued, func.coalesce(streak.freeze_available, False)),
+                else_=False,
+            ),
+            "last_activity_date": today,
+        },
+        # Skipping the update when today is already logged keeps a day from counting twice
+        where=or_(streak.last_activity_date.is_(None), streak.last_activity_date != today),
+    ).returning(streak.current_streak, streak.longest_streak, streak.freeze_available)
+
+    row = db.execute(stmt).first()
+    if row is None:
+        return None
+    return row.current_streak, row.longest_streak, bool(row.freeze_available)
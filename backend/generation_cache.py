@@ -0,0 +1,150 @@
+"""
+In-process cache of generated lesson content, with speculative prefetch.
+
+Entries are futures, so a page turn that arrives while its prefetch is
+still running waits for that generation instead of starting a second one.
+Prefetches belong to a lesson session; ending the session cancels the
+ones that haven't started and tells running ones to stop at their next
+checkpoint. Failed generations are evicted so the next request retries.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+import metrics
+
+MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_ENTRIES", "32"))
+TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", "3600"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+
+
+class Cancelled(Exception):
+    """Raised by a prefetch that noticed its session ended"""
+
+
+class GenerationCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: float = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (future, created)
+        self._sessions = {}  # session_id -> {key: threading.Event}
+        self._executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        future, created = entry
+        if time.monotonic() - created > self.ttl or future.cancelled():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return future
+
+    def _store(self, key, future):
+        self._entries[key] = (future, time.monotonic())
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key, future):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] is future:
+                del self._entries[key]
+
+    def get_or_compute(self, key, compute):
+        """Cached or in-flight result for key, else compute() in the caller's thread"""
+        with self._lock:
+            future = self._lookup(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                future.set_running_or_notify_cancel()
+                self._store(key, future)
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.cache_lookup("generation", not owner)
+        if not owner:
+            try:
+                return future.result()
+            except (CancelledError, Cancelled):
+                # Its prefetch was cancelled; generate it here instead
+                self._forget(key, future)
+                return self.get_or_compute(key, compute)
+        try:
+            result = compute()
+        except BaseException as e:
+            self._forget(key, future)
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def prefetch(self, key, compute, session_id=None) -> bool:
+        """Start compute(stop_event) in the background unless key is cached or in flight"""
+        stop = threading.Event()
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+            future = Future()
+            self._store(key, future)
+            if session_id:
+                self._sessions.setdefault(session_id, {})[key] = stop
+            self.prefetches += 1
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                if stop.is_set():
+                    raise Cancelled()
+                future.set_result(compute(stop))
+            except BaseException as e:
+                self._forget(key, future)
+                future.set_exception(e)
+                if not isinstance(e, Cancelled):
+                    print(f"Error prefetching {key}: {e}")
+            finally:
+                if session_id:
+                    with self._lock:
+                        pending = self._sessions.get(session_id)
+                        if pending is not None:
+                            pending.pop(key, None)
+                            # Sessions that never post /end would otherwise linger forever
+                            if not pending:
+                                del self._sessions[session_id]
+
+        self._executor.submit(run)
+        return True
+
+    def cancel_session(self, session_id) -> int:
+        """Stop the session's outstanding prefetches; returns how many were signalled"""
+        with self._lock:
+            pending = self._sessions.pop(session_id, {})
+            for key, stop in pending.items():
+                stop.set()
+                entry = self._entries.get(key)
+                if entry and entry[0].cancel():
+                    del self._entries[key]
+        return len(pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefetches": self.prefetches,
+                "sessions": len(self._sessions),
+            }
+
+
+generation_cache = GenerationCache()
@@ -0,0 +1,225 @@
+"""
+Pre-computed greeting pool for /api/greet.
+
+Greetings are stored as variants with {name}/{grade} placeholders, a few
+dozen per grade band. A background refresher asks the LLM for a fresh batch
+per band every few hours; built-in seeds cover a cold start or a missing
+API key. Picking a greeting is an in-memory lookup that avoids the variants
+a student saw most recently.
+"""
+
+import json
+import os
+import random
+import string
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models
+import prompts
+from database import SessionLocal
+
+BANDS = tuple(band for band, _, _ in prompts.GRADE_BANDS)
+# Grade used when asking the LLM for a band's batch
+BAND_GRADES = {"early": 1, "primary": 4, "secondary": 8}
+BATCH_SIZE = 24
+MAX_LLM_VARIANTS = 120  # per band; oldest are pruned
+REFRESH_SECONDS = int(os.getenv("GREETING_REFRESH_SECONDS", str(6 * 3600)))
+RECENT_PER_STUDENT = 10
+MAX_TRACKED_STUDENTS = 5000
+MAX_GREETING_CHARS = 200
+
+SEED_GREETINGS = {
+    "early": [
+        "Hoot hoot, {name}! 🦉 Are you ready for a fun learning adventure today?",
+        "Hello, {name}! 🌟 Professor Hoot is so happy to see you. Ready to play and learn?",
+        "Welcome back, {name}! 🎈 Shall we go on a learning adventure together?",
+        "Hi {name}! 🦉 My feathers are fluffed and ready. Are you ready to learn something magical?",
+        "Yay, it's {name}! 🌈 Are you ready to discover something amazing today?",
+        "Good to see you, {name}! ⭐ Ready for a fun adventure with Professor Hoot?",
+    ],
+    "primary": [
+        "Welcome back, {name}! 🦉 Let's make today a great learning day!",
+        "Hoot hoot, {name}! 🚀 Ready to power up your Grade {grade} brain?",
+        "Hello {name}! 🌟 Every question you try makes you smarter, so let's go!",
+        "Great to see you, {name}! 📚 Professor Hoot has some exciting lessons waiting.",
+        "Hi {name}! 🧠 Ready to learn something new and amazing today?",
+        "Welcome, {name}! 🎯 Let's see how much you can discover today!",
+    ],
+    "secondary": [
+        "Welcome back, {name}! 🦉 Ready to take on today's challenge?",
+        "Good to see you, {name}! 📖 Let's build on what you learned last time.",
+        "Hello {name}! 🚀 Every session gets you closer to mastering Grade {grade}.",
+        "Hi {name}! 💡 Professor Hoot has some big ideas ready for you today.",
+        "Welcome, {name}! 🎯 Let's sharpen those skills together.",
+        "Great to have you back, {name}! 🌟 Ready to level up?",
+    ],
+}
+
+_FIELDS = {"name", "grade"}
+
+
+def band_for_grade(grade) -> str:
+    band = prompts.grade_band(grade)
+    return band if band in BANDS else "primary"
+
+
+def is_valid_variant(text) -> bool:
+    """One short sentence with a {name} slot and no other placeholders"""
+    if not isinstance(text, str) or not text.strip() or len(text) > MAX_GREETING_CHARS:
+        return False
+    try:
+        parsed = [(name, spec, conversion) for _, name, spec, conversion in string.Formatter().parse(text)
+                  if name is not None]
+    except ValueError:
+        return False
+    # "{name:d}" or "{name!r}" would raise (or print a repr) when the greeting is formatted
+    if any(spec or conversion for _, spec, conversion in parsed):
+        return False
+    fields = {name for name, _, _ in parsed}
+    return "name" in fields and fields <= _FIELDS
+
+
+class GreetingPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._variants = {}
+        self._recent = OrderedDict()
+        self._loaded = False
+        self._refresher = None
+        self._stop_refresh = threading.Event()
+
+    # ---------- storage ----------
+
+    def load(self, db=None):
+        """(Re)load every band from greeting_variants, seeding it on first use"""
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            if not db.query(models.GreetingVariant.id).first():
+                self._insert(db, [(band, text, "seed") for band, texts in SEED_GREETINGS.items() for text in texts])
+            variants = {band: [] for band in BANDS}
+            for band, text in db.query(models.GreetingVariant.band, models.GreetingVariant.text).all():
+                # Skip rows stored before validation caught format specs and conversions
+                if is_valid_variant(text):
+                    variants.setdefault(band, []).append(text)
+        finally:
+            if own_session:
+                db.close()
+        with self._lock:
+            self._variants = variants
+            self._loaded = True
+
+    def _insert(self, db, rows):
+        if not rows:
+            return
+        stmt = sqlite_insert(models.GreetingVariant).values([
+            {"band": band, "text": text, "source": source, "created_at": datetime.utcnow()}
+            for band, text, source in rows
+        ]).on_conflict_do_nothing(index_elements=["band", "text"])
+        db.execute(stmt)
+        db.commit()
+
+    # ---------- serving ----------
+
+    def pick(self, name: str, grade: int, student_key=None) -> str:
+        """A formatted greeting, avoiding the student's recently seen variants"""
+        if not self._loaded:
+            self.load()
+        band = band_for_grade(grade)
+        key = student_key if student_key is not None else name
+        with self._lock:
+            variants = self._variants.get(band) or SEED_GREETINGS[band]
+            recent = self._recent.pop(key, None) or deque(maxlen=RECENT_PER_STUDENT)
+            # Small pools can't avoid every recent pick; skip as many as possible
+            window = min(len(recent), len(variants) - 1)
+            avoid = set(list(recent)[len(recent) - window:]) if window > 0 else set()
+            fresh = [v for v in variants if v not in avoid] or variants
+            choice = random.choice(fresh)
+            recent.append(choice)
+            self._recent[key] = recent
+            if len(self._recent) > MAX_TRACKED_STUDENTS:
+                self._recent.popitem(last=False)
+        return choice.format(name=name, grade=grade)
+
+    # ---------- refreshing ----------
+
+    def refresh_band(self, band: str, generate) -> int:
+        """Ask the LLM for a new batch for one band; returns how many were stored.
+
+        `generate(prompt) -> str` returns the raw model text.
+        """
+        prompt = prompts.render("greeting_batch", grade=BAND_GRADES[band], count=BATCH_SIZE)
+        data = json.loads(generate(prompt))
+        greetings = data.get("greetings", []) if isinstance(data, dict) else data
+        valid = [g.strip() for g in greetings if is_valid_variant(g)]
+
+        db = SessionLocal()
+        try:
+            self._insert(db, [(band, text, "llm") for text in valid])
+            # Keep the newest LLM batches; seeds always stay
+            stale = db.query(models.GreetingVariant.id).filter(
+                models.GreetingVariant.band == band,
+                models.GreetingVariant.source == "llm"
+            ).order_by(models.GreetingVariant.id.desc()).offset(MAX_LLM_VARIANTS).all()
+            if stale:
+                db.query(models.GreetingVariant).filter(
+                    models.GreetingVariant.id.in_([row.id for row in stale])
+                ).delete(synchronize_session=False)
+                db.commit()
+            self.load(db)
+        finally:
+            db.close()
+        return len(valid)
+
+    def bands_due(self):
+        """Bands whose newest LLM batch is missing or older than REFRESH_SECONDS"""
+        cutoff = datetime.utcnow() - timedelta(seconds=REFRESH_SECONDS)
+        db = SessionLocal()
+        try:
+            due = []
+            for band in BANDS:
+                newest = db.query(models.GreetingVariant.created_at).filter(
+                    models.GreetingVariant.band == band,
+                    models.GreetingVariant.source == "llm"
+                ).order_by(models.GreetingVariant.created_at.desc()).first()
+                if not newest or newest[0] < cutoff:
+                    due.append(band)
+            return due
+        finally:
+            db.close()
+
+    def refresh_due(self, generate):
+        for band in self.bands_due():
+            try:
+                count = self.refresh_band(band, generate)
+                print(f"Refreshed {count} greetings for band '{band}'")
+            except Exception as e:
+                print(f"Error refreshing greetings for band '{band}': {e}")
+
+    def start_background_refresh(self, generate, initial_delay: float = 5.0):
+        """Refresh due bands shortly after startup, then every REFRESH_SECONDS"""
+        if self._refresher is not None:
+            return
+
+        # Waiting on an Event rather than time.sleep keeps the thread visibly
+        # idle to the sampling profiler (see profiling._IDLE_FRAMES)
+        def run():
+            if self._stop_refresh.wait(initial_delay):
+                return
+            while True:
+                self.refresh_due(generate)
+                if self._stop_refresh.wait(REFRESH_SECONDS):
+                    return
+
+        self._refresher = threading.Thread(target=run, name="greeting-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop_background_refresh(self):
+        self._stop_refresh.set()
+
+
+greeting_pool = GreetingPool()
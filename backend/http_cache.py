@@ -0,0 +1,333 @@
+"""
+HTTP caching and compression middleware.
+
+Cacheable GET routes get a weak ETag derived from the write versions of the
+tables they read. The versions are bumped after a transaction that wrote to a
+table has committed, so a matching If-None-Match is answered with 304 before the
+handler (and its queries) run at all. Larger buffered responses are then
+compressed with brotli or gzip.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+# ==================== TABLE VERSIONS ====================
+
+class TableVersions:
+    """Per-table write counters, bumped when a writing transaction commits"""
+
+    ALL = "*"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        # Distinguishes ETags across restarts, since counters start from zero
+        self.boot_id = format(int(time.time() * 1000), "x")
+
+    def bump(self, tables):
+        with self._lock:
+            if self.ALL in tables:
+                tables = set(tables) | set(self._versions) | {self.ALL}
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def get(self, tables):
+        with self._lock:
+            star = self._versions.get(self.ALL, 0)
+            return [self._versions.get(table, 0) + star for table in tables]
+
+    def attach(self, engine):
+        """Track INSERT/UPDATE/DELETE statements on every connection of `engine`"""
+
+        @event.listens_for(engine, "after_execute")
+        def _after_execute(conn, clauseelement, multiparams, params, execution_options, result):
+            tables = _written_tables(clauseelement)
+            if tables:
+                conn.info.setdefault("written_tables", set()).update(tables)
+
+        # The "commit" event fires before the DBAPI COMMIT, so bumping there would
+        # let a GET read old rows under the new ETag. Park the tables until the
+        # commit has returned: the next transaction on the connection, or its
+        # return to the pool (Session.commit releases it straight away).
+        @event.listens_for(engine, "commit")
+        def _on_commit(conn):
+            tables = conn.info.pop("written_tables", None)
+            if tables:
+                conn.info.setdefault("committed_tables", set()).update(tables)
+
+        @event.listens_for(engine, "rollback")
+        def _on_rollback(conn):
+            conn.info.pop("written_tables", None)
+
+        @event.listens_for(engine, "begin")
+        def _on_begin(conn):
+            self._apply_committed(conn.info)
+
+        @event.listens_for(engine, "checkin")
+        def _on_checkin(dbapi_connection, connection_record):
+            if connection_record is not None:
+                self._apply_committed(connection_record.info)
+
+    def _apply_committed(self, info):
+        tables = info.pop("committed_tables", None)
+        if tables:
+            self.bump(tables)
+
+
+_WRITE_SQL = re.compile(r"^\s*(insert|update|delete|replace|alter|drop|create)\b", re.IGNORECASE)
+
+
+def _written_tables(clauseelement):
+    if isinstance(clauseelement, UpdateBase):
+        table = getattr(clauseelement, "table", None)
+        name = getattr(table, "name", None)
+        return {name} if name else {TableVersions.ALL}
+    text = getattr(clauseelement, "text", None)
+    if isinstance(text, str) and _WRITE_SQL.match(text):
+        # Raw SQL: we can't tell which table, so invalidate everything
+        return {TableVersions.ALL}
+    return None
+
+
+table_versions = TableVersions()
+
+
+# ==================== CACHE POLICIES ====================
+
+@dataclass
+class CachePolicy:
+    path: str
+    tables: tuple
+    cache_control: str = "private, no-cache"
+    # Time-windowed responses (weekly leaderboards) also change at midnight
+    daily: bool = False
+
+    def __post_init__(self):
+        pattern = re.sub(r"\{[^/]+\}", r"[^/]+", self.path)
+        self.regex = re.compile("^" + pattern + "$")
+
+
+CACHE_POLICIES = [
+    CachePolicy("/api/badges", ("badges",), "private, max-age=300"),
+    CachePolicy("/api/students", ("students",)),
+    CachePolicy("/api/leaderboard", ("students", "xp_events"), daily=True),
+    CachePolicy("/api/leaderboard/rank/{student_id}", ("students", "xp_events"), daily=True),
+    CachePolicy("/api/students/{student_id}/badges", ("badges", "student_badges", "test_results", "student_streaks")),
+    CachePolicy("/api/students/{student_id}/lesson-logs", ("lesson_logs",)),
+    CachePolicy("/api/students/{student_id}/saved-quizzes", ("saved_quizzes",)),
+    CachePolicy("/api/students/{student_id}/results", ("test_results",)),
+    CachePolicy("/api/students/{student_id}/flashcards", ("flashcards",)),
+    CachePolicy("/api/analytics/{view}", ("analytics_daily", "xp_rollups", "students"), daily=True),
+]
+
+
+def configure_cache_policy(path: str, tables=None, cache_control: str = None, daily: bool = None):
+    """Add or change the caching policy of one route"""
+    for policy in CACHE_POLICIES:
+        if policy.path == path:
+            if tables is not None:
+                policy.tables = tuple(tables)
+            if cache_control is not None:
+                policy.cache_control = cache_control
+            if daily is not None:
+                policy.daily = daily
+            return policy
+    if tables is None:
+        raise ValueError(f"New cache policy for {path} needs the tables it depends on")
+    policy = CachePolicy(path, tuple(tables), cache_control or "private, no-cache", bool(daily))
+    CACHE_POLICIES.append(policy)
+    return policy
+
+
+def _load_env_overrides():
+    """HTTP_CACHE_CONTROL='{"/api/badges": "public, max-age=3600"}' overrides Cache-Control per route"""
+    raw = os.getenv("HTTP_CACHE_CONTROL")
+    if not raw:
+        return
+    try:
+        for path, cache_control in json.loads(raw).items():
+            for policy in CACHE_POLICIES:
+                if policy.path == path:
+                    policy.cache_control = cache_control
+    except Exception as e:
+        print(f"Ignoring invalid HTTP_CACHE_CONTROL: {e}")
+
+
+_load_env_overrides()
+
+
+def match_policy(path: str):
+    for policy in CACHE_POLICIES:
+        if policy.regex.match(path):
+            return policy
+    return None
+
+
+def _header(scope, name: bytes):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def compute_etag(policy: CachePolicy, path: str, query: str) -> str:
+    parts = [table_versions.boot_id, path, query]
+    parts += [str(v) for v in table_versions.get(policy.tables)]
+    if policy.daily:
+        parts.append(date.today().isoformat())
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: ignore the W/ prefix on either side
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+class HTTPCacheMiddleware:
+    """Adds ETag/Cache-Control to cacheable GETs and answers If-None-Match with 304"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        policy = match_policy(scope["path"])
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Versions are read before the handler runs; a write committing meanwhile
+        # bumps them, so the next request can never reuse a stale tag
+        etag = compute_etag(policy, scope["path"], scope.get("query_string", b"").decode("latin-1"))
+        cache_headers = [
+            (b"etag", etag.encode("latin-1")),
+            (b"cache-control", policy.cache_control.encode("latin-1")),
+        ]
+
+        if_none_match = _header(scope, b"if-none-match")
+        if if_none_match:
+            metrics.cache_lookup("http_etag", etag_matches(if_none_match, etag))
+        if etag_matches(if_none_match, etag):
+            await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message["headers"] = list(message.get("headers", [])) + cache_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+# ==================== COMPRESSION ====================
+
+# Audio and images are already compressed
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/x-ndjson")
+
+
+class CompressionMiddleware:
+    """Brotli/gzip for buffered responses above `minimum_size` bytes.
+
+    Streaming responses (more_body=True) are passed through untouched so
+    token/audio streams keep flowing chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _choose_encoding(self, scope):
+        accept = (_header(scope, b"accept-encoding") or "").lower()
+        if brotli is not None and "br" in accept:
+            return "br"
+        if "gzip" in accept:
+            return "gzip"
+        return None
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        encoding = self._choose_encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            headers = list(start_message.get("headers", []))
+            header_names = {key.lower() for key, _ in headers}
+            content_type = next((v.decode("latin-1") for k, v in headers if k.lower() == b"content-type"), "")
+            body = message.get("body", b"")
+
+            if (
+                message.get("more_body", False)
+                or b"content-encoding" in header_names
+                or len(body) < self.minimum_size
+                or not content_type.startswith(_COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = self._compress(body, encoding)
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(compressed)).encode("latin-1")),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            start_message["headers"] = headers
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
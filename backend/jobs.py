@@ -0,0 +1,254 @@
+"""
+In-process background job queue persisted in SQLite.
+
+Jobs are rows in the jobs table, so queued work survives a restart: jobs
+that were running when the process stopped are queued again at startup.
+Each kind of job belongs to a worker pool (llm, image, audio) with its own
+thread count, so a burst of audio work can't starve lesson generation.
+Workers claim the highest-priority queued job with a single UPDATE, so two
+workers never run the same job.
+
+Enqueueing is idempotent by content: the same kind and payload return the
+existing queued, running or recently finished job instead of doing the
+work twice. Failures are retried with exponential backoff.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import models
+from database import engine
+
+POOL_SIZES = {
+    "llm": int(os.getenv("JOB_WORKERS_LLM", "2")),
+    "image": int(os.getenv("JOB_WORKERS_IMAGE", "1")),
+    "audio": int(os.getenv("JOB_WORKERS_AUDIO", "2")),
+}
+DEFAULT_PRIORITY = 5
+MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 2
+# A finished job is reused for an identical request for this long
+DEDUPE_SECONDS = int(os.getenv("JOB_DEDUPE_SECONDS", str(24 * 3600)))
+POLL_SECONDS = 1.0
+# Writing a job's outcome is retried this many times ("database is locked" under load)
+FINISH_ATTEMPTS = 5
+ARTIFACT_DIR = "./data/job_artifacts"
+
+
+class JobContext:
+    """Passed to handlers to report progress and store binary results"""
+
+    def __init__(self, queue, job_id: int):
+        self.queue = queue
+        self.job_id = job_id
+
+    def progress(self, fraction: float, message: str = None):
+        with engine.begin() as conn:
+            conn.execute(update(models.Job).where(models.Job.id == self.job_id).values(
+                progress=max(0.0, min(1.0, fraction)), progress_message=message
+            ))
+
+    def save_artifact(self, data: bytes, extension: str) -> str:
+        """Write bytes for GET /api/jobs/{id}/artifact; returns the file name"""
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        name = f"{self.job_id}.{extension}"
+        with open(os.path.join(ARTIFACT_DIR, name), "wb") as f:
+            f.write(data)
+        return name
+
+    def enqueue(self, kind: str, payload: dict, priority: int = None):
+        """Queue a follow-up job (e.g. an image for generated text); returns its id"""
+        return self.queue.enqueue(kind, payload, priority)["id"]
+
+
+def dedupe_key(kind: str, payload) -> str:
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{kind}|{canonical}".encode("utf-8")).hexdigest()[:32]
+
+
+def job_row(job: models.Job):
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "priority": job.priority,
+        "progress": job.progress,
+        "progress_message": job.progress_message,
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+class JobQueue:
+    def __init__(self, pool_sizes=POOL_SIZES):
+        self.pool_sizes = dict(pool_sizes)
+        self._handlers = {}
+        self._wakeups = {pool: threading.Condition() for pool in self.pool_sizes}
+        self._workers = []
+
+    def register(self, kind: str, pool: str, payload_model=None, max_attempts: int = MAX_ATTEMPTS):
+        """Decorator for `handler(payload: dict, ctx: JobContext) -> JSON-serialisable result`.
+
+        With a Pydantic `payload_model`, payloads are validated and normalised on enqueue.
+        """
+        if pool not in self.pool_sizes:
+            raise ValueError(f"Unknown job pool: {pool}")
+
+        def decorator(fn):
+            self._handlers[kind] = {"fn": fn, "pool": pool, "model": payload_model, "max_attempts": max_attempts}
+            return fn
+        return decorator
+
+    def kinds(self):
+        return {kind: h["pool"] for kind, h in self._handlers.items()}
+
+    # ---------- enqueue / status ----------
+
+    def enqueue(self, kind: str, payload: dict, priority: int = None):
+        """Queue a job, or return the existing one for the same kind and payload"""
+        handler = self._handlers.get(kind)
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if handler["model"] is not None:
+            payload = handler["model"](**payload).model_dump()
+        key = dedupe_key(kind, payload)
+        now = datetime.utcnow()
+
+        try:
+            job_id, created = self._insert_once(kind, payload, priority, handler, key, now)
+        except IntegrityError:
+            # An identical enqueue inserted between our SELECT and INSERT
+            # (ix_jobs_active_dedupe); the second look finds its row
+            job_id, created = self._insert_once(kind, payload, priority, handler, key, now)
+
+        if created:
+            wakeup = self._wakeups[handler["pool"]]
+            with wakeup:
+                wakeup.notify()
+        return {"id": job_id, "created": created}
+
+    def _insert_once(self, kind, payload, priority, handler, key, now):
+        with engine.begin() as conn:
+            existing = conn.execute(
+                select(models.Job.id, models.Job.status, models.Job.finished_at)
+                .where(models.Job.dedupe_key == key, models.Job.status != "failed")
+                .order_by(models.Job.id.desc()).limit(1)
+            ).first()
+            if existing and (existing.status != "succeeded"
+                             or existing.finished_at > now - timedelta(seconds=DEDUPE_SECONDS)):
+                return existing.id, False
+            job_id = conn.execute(models.Job.__table__.insert().values(
+                kind=kind, pool=handler["pool"], dedupe_key=key,
+                priority=DEFAULT_PRIORITY if priority is None else priority,
+                status="queued", payload=payload, progress=0.0, attempts=0,
+                max_attempts=handler["max_attempts"], run_after=now, created_at=now
+            )).inserted_primary_key[0]
+            return job_id, True
+
+    def get(self, job_id: int):
+        with engine.connect() as conn:
+            row = conn.execute(select(models.Job).where(models.Job.id == job_id)).first()
+        return job_row(row) if row else None
+
+    # ---------- workers ----------
+
+    def start(self):
+        """Requeue jobs interrupted by a restart and start the worker threads"""
+        if self._workers:
+            return
+        with engine.begin() as conn:
+            conn.execute(update(models.Job).where(models.Job.status == "running").values(status="queued"))
+        for pool, size in self.pool_sizes.items():
+            for n in range(size):
+                worker = threading.Thread(target=self._work, args=(pool,), name=f"jobs-{pool}-{n}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _claim(self, pool: str):
+        now = datetime.utcnow()
+        jobs = models.Job
+        next_job = select(jobs.id).where(
+            jobs.pool == pool, jobs.status == "queued", jobs.run_after <= now
+        ).order_by(jobs.priority, jobs.id).limit(1).scalar_subquery()
+        with engine.begin() as conn:
+            return conn.execute(
+                update(jobs).where(jobs.id == next_job, jobs.status == "queued")
+                .values(status="running", started_at=now, attempts=jobs.attempts + 1)
+                .returning(jobs.id, jobs.kind, jobs.payload, jobs.attempts, jobs.max_attempts)
+            ).first()
+
+    def _work(self, pool: str):
+        wakeup = self._wakeups[pool]
+        while True:
+            try:
+                job = self._claim(pool)
+            except Exception as e:
+                print(f"Error claiming {pool} job: {e}")
+                job = None
+            if job is None:
+                with wakeup:
+                    wakeup.wait(POLL_SECONDS)
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                # The outcome couldn't be written; queue the job again rather than leave it "running"
+                print(f"Error finishing job {job.id} ({job.kind}): {e}")
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(update(models.Job).where(
+                            models.Job.id == job.id, models.Job.status == "running"
+                        ).values(status="queued", error=str(e)))
+                except Exception as requeue_error:
+                    print(f"Error requeueing job {job.id}: {requeue_error}; it is requeued at the next restart")
+
+    def _run(self, job):
+        handler = self._handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for job kind {job.kind}")
+            result = handler["fn"](job.payload, JobContext(self, job.id))
+        except Exception as e:
+            # Client errors (bad input) won't succeed on a retry; rate limits and outages might
+            retryable = not (isinstance(e, HTTPException) and 400 <= e.status_code < 500 and e.status_code != 429)
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}: {error}")
+            values = {"error": str(error)}
+            if retryable and job.attempts < job.max_attempts:
+                values.update(status="queued", run_after=datetime.utcnow() + timedelta(
+                    seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)))
+            else:
+                values.update(status="failed", finished_at=datetime.utcnow())
+            self._finish(job.id, values)
+            return
+
+        self._finish(job.id, {
+            "status": "succeeded", "result": result, "error": None, "progress": 1.0, "finished_at": datetime.utcnow()
+        })
+
+    def _finish(self, job_id: int, values):
+        for attempt in range(FINISH_ATTEMPTS):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(update(models.Job).where(models.Job.id == job_id).values(**values))
+                return
+            except OperationalError as e:
+                if attempt + 1 == FINISH_ATTEMPTS:
+                    raise
+                print(f"Error saving job {job_id} outcome, retrying: {e}")
+                time.sleep(RETRY_BASE_SECONDS * 2 ** attempt / 10)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,179 @@
+"""
+Leaderboard rank index backed by the XP event ledger.
+
+Every XP award is appended to xp_events and folded into per-day and per-week
+rollups in the same transaction. The RankIndex keeps one sorted ranking per
+period in memory, so top-N and "my rank" lookups are a bisect instead of a
+scan of the students table.
+"""
+
+import bisect
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+
+PERIODS = ("all_time", "weekly", "monthly")
+
+
+def week_start(day: date) -> date:
+    """Monday of the week containing `day`"""
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def window_start(period: str, today: date):
+    """First day counted by a period, or None for all_time"""
+    if period == "weekly":
+        return week_start(today)
+    if period == "monthly":
+        return month_start(today)
+    return None
+
+
+def record_xp_event(db: Session, student_id: int, amount: int, when: datetime = None):
+    """Append an XP award to the ledger and bump its day/week rollups.
+
+    Flushes but does not commit, so the caller controls the transaction.
+    """
+    when = when or datetime.utcnow()
+    event = models.XPEvent(student_id=student_id, amount=amount, created_at=when)
+    db.add(event)
+    db.flush()
+
+    for bucket, start in (("day", when.date()), ("week", week_start(when.date()))):
+        stmt = sqlite_insert(models.XPRollup).values(
+            student_id=student_id, bucket=bucket, bucket_start=start, xp=amount
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["student_id", "bucket", "bucket_start"],
+            set_={"xp": models.XPRollup.xp + stmt.excluded.xp},
+        )
+        db.execute(stmt)
+
+    return event
+
+
+class _Ranking:
+    """Sorted (-xp, student_id) keys plus a student -> xp map for one period"""
+
+    def __init__(self, start, last_event_id, rows):
+        self.start = start
+        self.last_event_id = last_event_id
+        self.xp = {student_id: xp or 0 for student_id, xp in rows}
+        self.keys = sorted((-xp, student_id) for student_id, xp in self.xp.items())
+
+    def _discard(self, student_id):
+        old = self.xp.pop(student_id, None)
+        if old is not None:
+            i = bisect.bisect_left(self.keys, (-old, student_id))
+            del self.keys[i]
+
+    def add(self, student_id, amount):
+        total = self.xp.get(student_id, 0) + amount
+        self._discard(student_id)
+        self.xp[student_id] = total
+        bisect.insort(self.keys, (-total, student_id))
+
+    def remove(self, student_id):
+        self._discard(student_id)
+
+    def top(self, limit):
+        return [(student_id, -neg_xp) for neg_xp, student_id in self.keys[:limit]]
+
+    def rank(self, student_id):
+        xp = self.xp.get(student_id)
+        if xp is None:
+            return None, 0
+        return bisect.bisect_left(self.keys, (-xp, student_id)) + 1, xp
+
+
+class RankIndex:
+    """In-memory rankings for each leaderboard period.
+
+    Rankings are loaded lazily from the database and then kept current by
+    `record()` after each committed XP award. Weekly and monthly rankings are
+    rebuilt from the rollups when their window rolls over.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rankings = {}
+
+    def _load(self, db: Session, period: str, start):
+        # The ledger high-water mark and the totals come from one SELECT, so they
+        # share a snapshot: an award committed meanwhile is either in both (and
+        # skipped by record()) or in neither (and applied by record())
+        high = db.query(func.coalesce(func.max(models.XPEvent.id), 0).label("last_event_id")).subquery()
+        if period == "all_time":
+            rows = db.query(high.c.last_event_id, models.Student.id, models.Student.xp) \
+                .select_from(high).outerjoin(models.Student, true()).all()
+        elif period == "weekly":
+            rows = db.query(high.c.last_event_id, models.XPRollup.student_id, models.XPRollup.xp) \
+                .select_from(high).outerjoin(models.XPRollup, and_(
+                    models.XPRollup.bucket == "week",
+                    models.XPRollup.bucket_start == start
+                )).all()
+        else:
+            rows = db.query(
+                high.c.last_event_id, models.XPRollup.student_id, func.sum(models.XPRollup.xp)
+            ).select_from(high).outerjoin(models.XPRollup, and_(
+                models.XPRollup.bucket == "day",
+                models.XPRollup.bucket_start >= start
+            )).group_by(high.c.last_event_id, models.XPRollup.student_id).all()
+
+        # The outer join yields one all-NULL row when nobody qualifies
+        last_event_id = rows[0][0]
+        return _Ranking(start, last_event_id, [(sid, xp) for _, sid, xp in rows if sid is not None])
+
+    def _get(self, db: Session, period: str) -> _Ranking:
+        start = window_start(period, datetime.utcnow().date())
+        ranking = self._rankings.get(period)
+        if ranking is None or ranking.start != start:
+            ranking = self._load(db, period, start)
+            self._rankings[period] = ranking
+        return ranking
+
+    def top(self, db: Session, period: str, limit: int):
+        with self._lock:
+            return self._get(db, period).top(limit)
+
+    def rank(self, db: Session, period: str, student_id: int):
+        """Return (rank, xp, ranked_count); rank is None if the student has no XP in the period"""
+        with self._lock:
+            ranking = self._get(db, period)
+            rank, xp = ranking.rank(student_id)
+            return rank, xp, len(ranking.keys)
+
+    def record(self, event: models.XPEvent):
+        """Apply a committed ledger event to the rankings that are loaded"""
+        day = event.created_at.date()
+        with self._lock:
+            for period, ranking in self._rankings.items():
+                if event.id <= ranking.last_event_id:
+                    continue  # already counted when the ranking was loaded
+                if ranking.start is not None and day < ranking.start:
+                    continue
+                ranking.add(event.student_id, event.amount)
+
+    def add_student(self, student_id: int):
+        """New students appear on the all-time board with 0 XP"""
+        with self._lock:
+            ranking = self._rankings.get("all_time")
+            if ranking is not None and student_id not in ranking.xp:
+                ranking.add(student_id, 0)
+
+    def remove_student(self, student_id: int):
+        with self._lock:
+            for ranking in self._rankings.values():
+                ranking.remove(student_id)
+
+
+rank_index = RankIndex()
@@ -1,32 +1,88 @@
 import os
 import json
+import time
+import hashlib
+import hmac
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import Response
+from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from google import genai
-from elevenlabs.client import ElevenLabs
-from google.genai import types
+from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, func, case, inspect
 import models
 from database import SessionLocal, engine
+from leaderboard import rank_index
+import leaderboard
+import gamification
+import http_cache
+import serializers
+import analytics
+import chat_memory
+import question_bank
+import quiz_stream
+import podcast
+import prompts
+import providers
+from providers import voice_directory
+import jobs
+import metrics
+import profiling
+from jobs import job_queue
+from tts import tts_service, BudgetExceeded
+from retrieval import retriever
+from greetings import greeting_pool
+from adaptive_quiz import adaptive_quizzes
+from generation_cache import generation_cache, Cancelled as PrefetchCancelled
+from twi import lexicon as twi_lexicon
+from serializers import FastJSONResponse
 
 load_dotenv()
 
 models.Base.metadata.create_all(bind=engine)
 
 # Graceful DB Migration to add PIN column
-try:
+if "pin" not in {column["name"] for column in inspect(engine).get_columns("students")}:
     with engine.begin() as conn:
         conn.execute(text("ALTER TABLE students ADD COLUMN pin VARCHAR(6)"))
-except Exception as e:
-    pass # Column likely already exists
-
-app = FastAPI(title="Y&E Smart Tutor API")
 
+# Unique indexes added after their tables first shipped: one chunk per lesson
+# position (dropping duplicates left by concurrent backfills) and one active job
+# per dedupe key
+if "uq_lesson_chunks_position" not in {i["name"] for i in inspect(engine).get_indexes("lesson_chunks")}:
+    with engine.begin() as conn:
+        conn.execute(text(
+            "DELETE FROM lesson_chunks WHERE id NOT IN "
+            "(SELECT MIN(id) FROM lesson_chunks GROUP BY lesson_log_id, position)"
+        ))
+for index in [*models.LessonChunk.__table__.indexes, *models.Job.__table__.indexes]:
+    try:
+        index.create(bind=engine, checkfirst=True)
+    except Exception as e:
+        print(f"Could not create index {index.name}: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background threads start with the server rather than on import, so scripts and
+    # benchmarks that import main neither spawn workers nor requeue running jobs
+    if api_key or llm_provider == "local":
+        greeting_pool.start_background_refresh(generate_greeting_batch)
+    job_queue.start()
+    yield
+    greeting_pool.stop_background_refresh()
+
+app = FastAPI(title="Y&E Smart Tutor API", default_response_class=FastJSONResponse, lifespan=lifespan)
+
+# Conditional GETs and compression sit inside CORS so 304s still carry CORS headers
+http_cache.table_versions.attach(engine)
+metrics.instrument_engine(engine)
+profiling.n_plus_one.instrument(engine)
+app.add_middleware(http_cache.HTTPCacheMiddleware)
+app.add_middleware(http_cache.CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")))
 app.add_middleware(
     CORSMiddleware,
     allow_origin_regex='https?://.*',
@@ -34,30 +90,46 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so request timings include compression and CORS
+app.add_middleware(metrics.MetricsMiddleware)
 
-# Configure Gemini
-api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-client = None
-if api_key:
-    client = genai.Client(api_key=api_key)
-
-# Configure Local LLM (Ollama)
-from openai import OpenAI
-llm_provider = os.getenv("LLM_PROVIDER", "gemini") # 'gemini' or 'local'
-local_llm_url = os.getenv("LOCAL_LLM_URL", "http://localhost:11434/v1")
-local_client = None
-local_model = os.getenv("LOCAL_LLM_MODEL", "llama3")
-ollama_api_key = os.getenv("OLLAMA_API_KEY", "ollama")  # real key for cloud, dummy for local
-
-if llm_provider == "local":
-    print(f"Using Local LLM Provider at {local_llm_url} with model {local_model}")
-    local_client = OpenAI(
-        base_url=local_llm_url,
-        api_key=ollama_api_key,  # used as Bearer token for Ollama Cloud API
-    )
+# Provider clients are created on first use (see providers.py)
+api_key = providers.GEMINI_API_KEY
+llm_provider = providers.LLM_PROVIDER # 'gemini' or 'local'
+local_model = providers.LOCAL_LLM_MODEL
+
+def _active_provider():
+    if llm_provider == "local" and providers.local_client():
+        return "local"
+    if llm_provider == "gemini" and providers.gemini_client():
+        return "gemini"
+    return "none"
 
 def app_generate_content(prompt, model_name=None, response_mime_type=None):
-    if llm_provider == "local" and local_client:
+    """Call the configured LLM; tokens and latency are recorded per prompt template"""
+    provider = _active_provider()
+    model = local_model if provider == "local" else (model_name or 'gemini-1.5-flash')
+    start = time.perf_counter()
+    response = None
+    error = None
+    try:
+        response = _provider_generate_content(prompt, model_name, response_mime_type)
+        return response
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        metrics.record_stage(_llm_stage(prompt), time.perf_counter() - start)
+        prompts.prompt_stats.record(prompt, response, provider, model, time.perf_counter() - start, error)
+
+def _llm_stage(prompt):
+    template = getattr(prompt, "template", None)
+    return f"llm.{template.name if template else 'adhoc'}"
+
+def _provider_generate_content(prompt, model_name=None, response_mime_type=None):
+    local_client = providers.local_client() if llm_provider == "local" else None
+    client = providers.gemini_client() if llm_provider == "gemini" else None
+    if local_client:
         try:
             messages = [{"role": "user", "content": prompt}]
             
@@ -74,20 +146,21 @@ def app_generate_content(prompt, model_name=None, response_mime_type=None):
             
             # Mimic Gemini response object structure for compatibility
             class MockResponse:
-                def __init__(self, text):
+                def __init__(self, text, usage=None):
                     self.text = text
+                    self.usage = usage
             
-            return MockResponse(response.choices[0].message.content)
+            return MockResponse(response.choices[0].message.content, getattr(response, "usage", None))
         except Exception as e:
             print(f"Local LLM Error: {e}")
             raise HTTPException(status_code=500, detail=f"Local LLM Error: {str(e)}")
 
-    elif llm_provider == "gemini" and client:
+    elif client:
         # Default to flash if not specified
         target_model = model_name or 'gemini-1.5-flash'
         config = None
         if response_mime_type:
-            config = types.GenerateContentConfig(response_mime_type=response_mime_type)
+            config = providers.gemini_types().GenerateContentConfig(response_mime_type=response_mime_type)
             
         return client.models.generate_content(
             model=target_model,
@@ -101,27 +174,58 @@ def app_generate_content(prompt, model_name=None, response_mime_type=None):
                 self.text = text
         return MockResponse("Error: No LLM provider configured")
 
-# Configure ElevenLabs
-# Configure ElevenLabs
-elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
-elevenlabs_client = None
-DEFAULT_VOICE_ID = "21m00Tcm4TlvDq8ikWAM" # Default to Rachel
-
-if elevenlabs_api_key:
-    print(f"ElevenLabs API Key found: {elevenlabs_api_key[:4]}...{elevenlabs_api_key[-4:]}")
-    elevenlabs_client = ElevenLabs(api_key=elevenlabs_api_key)
+class StreamedResponse:
+    """The joined text and final usage of a streamed call, for prompt accounting"""
+    def __init__(self, text, usage=None, usage_metadata=None):
+        self.text = text
+        self.usage = usage
+        self.usage_metadata = usage_metadata
+
+def app_generate_content_stream(prompt, model_name=None, response_mime_type=None):
+    """Like app_generate_content, but yields text chunks as the provider produces them"""
+    provider = _active_provider()
+    model = local_model if provider == "local" else (model_name or 'gemini-1.5-flash')
+    start = time.perf_counter()
+    parts = []
+    usage = None
+    usage_metadata = None
+    error = None
     try:
-        # Pick the first available voice
-        response = elevenlabs_client.voices.get_all()
-        # Handle different response structures (list or object with voices attr)
-        voices_list = response.voices if hasattr(response, 'voices') else response
-        
-        if voices_list:
-            DEFAULT_VOICE_ID = voices_list[0].voice_id
-            print(f"Selected voice: {voices_list[0].name} ({DEFAULT_VOICE_ID})")
-            
+        if provider == "local":
+            stream = providers.local_client().chat.completions.create(
+                model=local_model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"} if response_mime_type == 'application/json' else None,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield parts[-1]
+        elif provider == "gemini":
+            config = providers.gemini_types().GenerateContentConfig(response_mime_type=response_mime_type) if response_mime_type else None
+            for chunk in providers.gemini_client().models.generate_content_stream(model=model, contents=prompt, config=config):
+                usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield chunk.text
     except Exception as e:
-        print(f"Error listing voices: {e}")
+        error = e
+        raise
+    finally:
+        metrics.record_stage(_llm_stage(prompt), time.perf_counter() - start)
+        prompts.prompt_stats.record(
+            prompt, StreamedResponse("".join(parts), usage, usage_metadata), provider, model,
+            time.perf_counter() - start, error
+        )
+
+# Configure ElevenLabs
+# Voice discovery runs in the background and is cached on disk
+if providers.ELEVENLABS_API_KEY:
+    print(f"ElevenLabs API Key found: {providers.ELEVENLABS_API_KEY[:4]}...{providers.ELEVENLABS_API_KEY[-4:]}")
+    voice_directory.start_background_discovery()
 
 # Dependency
 def get_db():
@@ -131,9 +235,24 @@ def get_db():
     finally:
         db.close()
 
+def current_parent_pin(db: Session) -> str:
+    setting = db.query(models.Settings).filter(models.Settings.key == "parent_pin").first()
+    # Default to 1234 if not set (though migration should have set it)
+    return setting.value if setting else "1234"
+
+def require_admin(x_admin_pin: str | None = Header(None), db: Session = Depends(get_db)):
+    """Admin-only endpoints take the parent PIN in an X-Admin-Pin header"""
+    if not x_admin_pin:
+        raise HTTPException(status_code=401, detail="X-Admin-Pin header required")
+    if not hmac.compare_digest(x_admin_pin.encode("utf-8"), current_parent_pin(db).encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Incorrect PIN")
+
 class GreetingRequest(BaseModel):
     name: str
     grade: int
+    student_id: int | None = None
+    # Skip the pre-generated pool and ask the LLM for a brand-new greeting
+    refresh: bool = False
 
 @app.get("/")
 def read_root():
@@ -143,57 +262,113 @@ def read_root():
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition (see metrics.py)"""
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def generate_greeting_batch(prompt) -> str:
+    return app_generate_content(prompt, model_name='gemini-2.0-flash', response_mime_type='application/json').text
+
 @app.post("/api/greet")
 def generate_greeting(request: GreetingRequest):
-    # Fallback if no key
-    if not api_key and llm_provider != "local":
-        return {"message": f"Hello {request.name}! Welcome to your learning hub! (AI Key missing)"}
+    # Served from the pre-generated pool unless a live greeting is requested
+    if not request.refresh or (not api_key and llm_provider != "local"):
+        return {"message": greeting_pool.pick(request.name, request.grade, request.student_id), "source": "pool"}
 
-    prompt = ""
-    if request.grade <= 2:
-        prompt = f"You are Professor Hoot, a wise and magical owl tutor. Enthusiastically say hello to {request.name}, a Grade {request.grade} student, and ask if they are ready for a fun learning adventure! Use an emoji and keep it to one short sentence."
-    else:
-        prompt = f"You are Professor Hoot, a wise and magical owl tutor. Enthusiastically greet {request.name}, a Grade {request.grade} student. Be encouraging, keep it to one short sentence, and use an emoji."
+    prompt = prompts.render("greeting", grade=request.grade, name=request.name)
     try:
         response = app_generate_content(prompt)
-        return {"message": response.text}
+        return {"message": response.text, "source": "live"}
     except Exception as e:
         print(f"Error: {e}")
-        return {"message": f"Hello {request.name}! Ready to learn?"}
+        return {"message": greeting_pool.pick(request.name, request.grade, request.student_id), "source": "pool"}
 
 class ChatRequest(BaseModel):
     message: str
-    context: str
+    context: str = ""
     student_grade: int
+    # Optional session fields: with them the tutor remembers earlier turns and
+    # the client can send `context_id` instead of re-sending the lesson text
+    student_id: int | None = None
+    lesson_key: str | None = None
+    context_id: str | None = None
+
+def summarize_lesson(text: str) -> str:
+    prompt = prompts.render("lesson_summary", words=chat_memory.SUMMARY_WORDS, text=text)
+    return app_generate_content(prompt, model_name='gemini-2.0-flash').text
 
 @app.post("/api/chat")
-def chat_with_tutor(request: ChatRequest):
+def chat_with_tutor(request: ChatRequest, db: Session = Depends(get_db)):
     if not api_key and llm_provider != "local":
         return {"reply": "I'm sorry, I can't chat right now because my brain (API Key) is missing!"}
 
-    prompt = f"""You are a friendly, encouraging tutor named "Professor Hoot" helping a Grade {request.student_grade} student.
-    
-    Current Lesson Context:
-    {request.context}
-    
-    Student Question:
-    {request.message}
-    
-    Instructions:
-    1. Answer the question simply and clearly, using language appropriate for a Grade {request.student_grade} student.
-    2. Be encouraging and positive. Use emojis occasionally.
-    3. If the question is about the lesson, use the context provided.
-    4. If the question is off-topic, gently guide them back to learning.
-    5. Keep your answer concise (under 3 sentences unless a detailed explanation is needed).
+    # Lesson text is stored once; later messages refer to it by context_id
+    context_row = None
+    if request.context:
+        context_row = chat_memory.remember_context(db, request.context)
+    elif request.context_id:
+        context_row = chat_memory.get_context(db, request.context_id)
+        if context_row is None:
+            # Unknown id: ask the client for the lesson text rather than answer without it
+            return {"reply": None, "context_id": None, "resend_context": True}
+    lesson_text = context_row.content if context_row else ""
+
+    summary = ""
+    if context_row and chat_memory.estimate_tokens(lesson_text) > chat_memory.FULL_CONTEXT_TOKENS:
+        summary = chat_memory.ensure_summary(db, context_row, summarize_lesson)
+
+    lesson_key = request.lesson_key or (context_row.content_hash if context_row else "general")
+    turns, related = [], []
+    if request.student_id:
+        turns = chat_memory.recent_turns(db, request.student_id, lesson_key)
+        # Ground follow-ups about earlier lessons in what the student actually read
+        try:
+            related = retriever.search(db, request.student_id, request.message, exclude_text=lesson_text)
+        except Exception as e:
+            print(f"Error searching past lessons: {e}")
+
+    sections = chat_memory.build_context_sections(request.message, lesson_text, summary, turns, related)
+    history = ""
+    if sections["related"]:
+        history += f"""
+    From Earlier Lessons:
+    {sections["related"]}
     """
+    if sections["history"]:
+        history += f"""
+    Conversation So Far:
+    {sections["history"]}
+    """
+
+    prompt = prompts.render(
+        "chat",
+        grade=request.student_grade,
+        lesson=sections["lesson"] or "General learning context",
+        history=history,
+        message=request.message
+    )
 
     try:
         response = app_generate_content(prompt, model_name='gemini-2.0-flash')
-        return {"reply": response.text}
+        reply = response.text
     except Exception as e:
         print(f"Error in chat: {e}")
         return {"reply": "Oops! I got a little confused. Can you ask that again?"}
 
+    if request.student_id:
+        chat_memory.save_exchange(db, request.student_id, lesson_key, request.message, reply)
+    return {"reply": reply, "context_id": context_row.content_hash if context_row else None}
+
+@app.get("/api/chat/history")
+def get_chat_history(student_id: int, lesson_key: str, limit: int = 50, db: Session = Depends(get_db)):
+    """Earlier turns of a student's chat session for one lesson"""
+    turns = chat_memory.recent_turns(db, student_id, lesson_key, limit)
+    return [
+        {"role": t.role, "text": t.content, "created_at": t.created_at.isoformat() if t.created_at else None}
+        for t in turns
+    ]
+
 class LessonPlanRequest(BaseModel):
     subject: str
     topic: str
@@ -204,23 +379,24 @@ class LessonContentRequest(BaseModel):
     topic: str
     subtopic: str
     grade: int
+    # With the lesson plan, the next subtopic and this subtopic's quiz are prefetched
+    plan: list[str] | None = None
+    session_id: str | None = None
 
 class QuizRequest(BaseModel):
     subject: str
     topic: str
     grade: int
     num_questions: int = 5
+    # Lets the question bank avoid questions this student has already seen
+    student_id: int | None = None
 
 @app.post("/api/lesson/plan")
 def generate_lesson_plan(request: LessonPlanRequest):
     if not api_key and llm_provider != "local":
         return {"plan": ["Introduction to " + request.topic, "Key Concepts", "Examples", "Summary"]}
 
-    prompt = f"""
-    Create a short lesson plan with 3 to 5 distinct sub-topics for teaching '{request.topic}' in '{request.subject}' to a Grade {request.grade} student.
-    Return ONLY valid JSON with a key 'plan' containing a list of strings (the sub-topic titles).
-    Example: {{ "plan": ["What is a Volcano?", "Types of Volcanoes", "Why do they Erupt?"] }}
-    """
+    prompt = prompts.render("lesson_plan", grade=request.grade, topic=request.topic, subject=request.subject)
     try:
         response = app_generate_content(
             prompt,
@@ -237,96 +413,217 @@ def generate_lesson_content(request: LessonContentRequest):
     if not api_key and llm_provider != "local":
         return {"content": f"Simulation: Content for {request.subtopic} (Grade {request.grade})"}
 
+    try:
+        result = generation_cache.get_or_compute(
+            _lesson_content_key(request.subject, request.topic, request.subtopic, request.grade),
+            lambda: build_lesson_content(request.subject, request.topic, request.subtopic, request.grade)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if request.plan:
+        prefetch_lesson_step(request)
+    return result
+
+def _lesson_content_key(subject: str, topic: str, subtopic: str, grade: int):
+    return ("lesson_content", subject, topic, subtopic, grade)
+
+def prefetch_lesson_step(request: LessonContentRequest):
+    """Start generating the next subtopic and this subtopic's quiz questions in the background"""
+    if request.subtopic in request.plan:
+        step = request.plan.index(request.subtopic)
+        if step + 1 < len(request.plan):
+            subtopic = request.plan[step + 1]
+            generation_cache.prefetch(
+                _lesson_content_key(request.subject, request.topic, subtopic, request.grade),
+                lambda stop: build_lesson_content(request.subject, request.topic, subtopic, request.grade, stop),
+                request.session_id
+            )
+
+    # LessonView quizzes each subtopic as "topic: subtopic"; fill that pool in the question bank
+    quiz_topic = f"{request.topic}: {request.subtopic}"
+    generation_cache.prefetch(
+        ("quiz_pool", question_bank.topic_key(request.subject, quiz_topic), request.grade),
+        lambda stop: prefetch_quiz_pool(request.subject, quiz_topic, request.grade, stop),
+        request.session_id
+    )
+
+def prefetch_quiz_pool(subject: str, topic: str, grade: int, stop):
+    db = SessionLocal()
+    try:
+        if question_bank.pool_size(db, subject, topic, grade) >= question_bank.TOPUP_BATCH:
+            return 0
+        generated = generate_quiz_questions(subject, topic, grade, question_bank.TOPUP_BATCH)
+        if stop.is_set():
+            raise PrefetchCancelled()
+        added = question_bank.add_questions(db, subject, topic, grade, generated)
+        adaptive_quizzes.invalidate(subject, topic, grade)
+        return added
+    finally:
+        db.close()
+
+def build_lesson_content(subject: str, topic: str, subtopic: str, grade: int, stop=None):
+    """Lesson text plus an optional illustration. A prefetch passes `stop`, an Event
+    that is set when its lesson session ends; it is checked before each model call."""
+    def check_stop():
+        if stop is not None and stop.is_set():
+            raise PrefetchCancelled()
+
+    content, image_prompt = build_lesson_text(subject, topic, subtopic, grade, check_stop)
+    image_url = None
+    if image_prompt:
+        check_stop()
+        image_url = generate_lesson_image(grade, image_prompt, subtopic)
+    return {
+        "content": content,
+        "image_url": image_url
+    }
+
+def build_lesson_text(subject: str, topic: str, subtopic: str, grade: int, check_stop=lambda: None):
+    """(lesson text, image prompt or None when no illustration is needed)"""
     # Generate the text content
-    content_prompt = f"""
-    You are Professor Hoot, an engaging and magical tutor for a Grade {request.grade} student.
-    Subject: {request.subject}
-    Main Topic: {request.topic}
-    Current Sub-topic: {request.subtopic}
-
-    Write a clear, exciting, and age-appropriate explanation for this specific sub-topic. 
-    Crucially, you MUST format your response beautifully using Markdown! Use **bolding** for important key words, create bulleted lists for clarity, and sprinkle in relevant emojis to make it visually engaging and less intimidating for a kid.
-    Use fun analogies if helpful. Keep it focused on '{request.subtopic}'.
-    """
-    
+    content_prompt = prompts.render(
+        "lesson_content",
+        grade=grade,
+        subject=subject,
+        topic=topic,
+        subtopic=subtopic
+    )
+
+    check_stop()
     try:
+        response = app_generate_content(content_prompt, model_name='gemini-2.0-flash')
+        content = response.text
+    except Exception as e:
+        error_str = str(e).lower()
+        if "429" in error_str or "quota" in error_str or "exhausted" in error_str:
+            raise HTTPException(status_code=429, detail="Professor Hoot needs a quick nap! You hit the free-tier quota. Wait 60 seconds and try again. 🦉💤")
+        raise e
+
+    # Decide if an image would be helpful
+    decision_data = {}
+    if llm_provider != "local":
+        check_stop()
         try:
-            response = app_generate_content(content_prompt, model_name='gemini-2.0-flash')
-            content = response.text
-        except Exception as e:
-            error_str = str(e).lower()
-            if "429" in error_str or "quota" in error_str or "exhausted" in error_str:
-                raise HTTPException(status_code=429, detail="Professor Hoot needs a quick nap! You hit the free-tier quota. Wait 60 seconds and try again. 🦉💤")
-            raise e
-        
-        # Decide if an image would be helpful
-        decision_data = {}
-        if llm_provider != "local":
-            try:
-                image_decision_prompt = f"""
-                Topic: {request.subtopic}
-                Subject: {request.subject}
-                Grade: {request.grade}
-                
-                Would a visual diagram, illustration, or educational image significantly help a Grade {request.grade} student understand "{request.subtopic}"?
-                Consider: diagrams for processes, scientific concepts, historical events, geography, anatomy, chemistry, physics, etc.
-                
-                Respond with JSON:
-                {{
-                    "needs_image": true/false,
-                    "image_prompt": "A detailed prompt for generating an educational illustration" (only if needs_image is true)
-                }}
-                """
-                
-                image_decision = app_generate_content(
-                    image_decision_prompt,
-                    model_name='gemini-2.0-flash',
-                    response_mime_type='application/json'
-                )
-                
+            image_decision_prompt = prompts.render(
+                "lesson_image_decision",
+                grade=grade,
+                subject=subject,
+                subtopic=subtopic
+            )
+
+            image_decision = app_generate_content(
+                image_decision_prompt,
+                model_name='gemini-2.0-flash',
+                response_mime_type='application/json'
+            )
+
+            with metrics.span("json_parse"):
                 decision_data = json.loads(image_decision.text)
-                if isinstance(decision_data, list):
-                    decision_data = decision_data[0] if decision_data else {}
-            except Exception as img_dec_error:
-                print(f"Safe ignoring image decision error to salvage lesson text: {img_dec_error}")
-            
-        image_url = None
-        
-        if llm_provider == "gemini" and decision_data.get("needs_image", False) and decision_data.get("image_prompt"):
-            # Generate image using fast Imagen model
-            try:
-                image_prompt = f"Educational illustration for Grade {request.grade} students: {decision_data['image_prompt']}. Clear, colorful, age-appropriate, diagram style. No text or labels."
-                
-                image_response = client.models.generate_images(
-                    model='models/imagen-4.0-fast-generate-001',
+            if isinstance(decision_data, list):
+                decision_data = decision_data[0] if decision_data else {}
+        except Exception as img_dec_error:
+            print(f"Safe ignoring image decision error to salvage lesson text: {img_dec_error}")
+
+    if llm_provider == "gemini" and decision_data.get("needs_image", False) and decision_data.get("image_prompt"):
+        return content, decision_data["image_prompt"]
+    return content, None
+
+IMAGE_MODEL = 'models/imagen-4.0-fast-generate-001'
+
+def generate_lesson_image(grade: int, image_prompt: str, subtopic: str = ""):
+    """A data: URL for an Imagen illustration, or None"""
+    image_url = None
+    # Generate image using fast Imagen model
+    try:
+        image_prompt = prompts.render("lesson_image", grade=grade, image_prompt=image_prompt)
+
+        start = time.perf_counter()
+        error = None
+        try:
+            with metrics.span("image"):
+                image_response = providers.gemini_client().models.generate_images(
+                    model=IMAGE_MODEL,
                     prompt=image_prompt,
-                    config=types.GenerateImagesConfig(
+                    config=providers.gemini_types().GenerateImagesConfig(
                         aspect_ratio="16:9"
                     )
                 )
-                
-                # Get the generated image
-                if image_response.generated_images and len(image_response.generated_images) > 0:
-                    import base64
-                    image_data = image_response.generated_images[0].image.image_bytes
-                    image_base64 = base64.b64encode(image_data).decode('utf-8')
-                    image_url = f"data:image/png;base64,{image_base64}"
-                    print(f"Successfully generated image for: {request.subtopic}")
-            except Exception as img_error:
-                print(f"Error generating image: {img_error}")
-        
-        return {
-            "content": content,
-            "image_url": image_url
-        }
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            metrics.observe_provider("image", "gemini", IMAGE_MODEL, image_prompt.template.key,
+                                     time.perf_counter() - start, error)
+
+        # Get the generated image
+        if image_response.generated_images and len(image_response.generated_images) > 0:
+            import base64
+            image_data = image_response.generated_images[0].image.image_bytes
+            image_base64 = base64.b64encode(image_data).decode('utf-8')
+            image_url = f"data:image/png;base64,{image_base64}"
+            print(f"Successfully generated image for: {subtopic}")
+    except Exception as img_error:
+        print(f"Error generating image: {img_error}")
+    return image_url
+
+@app.post("/api/lesson/session/{session_id}/end")
+def end_lesson_session(session_id: str):
+    """Cancel the lesson's outstanding prefetches (the student left the lesson)"""
+    return {"cancelled": generation_cache.cancel_session(session_id)}
+
+@app.get("/api/admin/generation-cache", dependencies=[Depends(require_admin)])
+def get_generation_cache_stats():
+    return generation_cache.stats()
+
+def generate_quiz_questions(subject: str, topic: str, grade: int, num_questions: int):
+    """Ask the LLM for new questions (a list of question dicts)"""
+    user_prompt = prompts.render(
+        "quiz",
+        grade=grade,
+        num_questions=num_questions,
+        topic=topic,
+        subject=subject
+    )
+    response = app_generate_content(
+        user_prompt,
+        model_name='gemini-2.0-flash',
+        response_mime_type='application/json'
+    )
+    with metrics.span("json_parse"):
+        data = json.loads(response.text)
+    return data.get("questions", []) if isinstance(data, dict) else data
 
 @app.post("/api/quiz")
-def generate_quiz(request: QuizRequest):
-    if not api_key and llm_provider != "local":
+def generate_quiz(request: QuizRequest, db: Session = Depends(get_db)):
+    """Assemble a quiz from the question bank, generating only when the bank is short"""
+    llm_ready = bool(api_key) or llm_provider == "local"
+    questions, repeats = question_bank.assemble(
+        db, request.subject, request.topic, request.grade, request.num_questions, request.student_id
+    )
+    metrics.cache_lookup("question_bank", len(questions) >= request.num_questions)
+
+    if len(questions) < request.num_questions and llm_ready:
+        try:
+            generated = generate_quiz_questions(request.subject, request.topic, request.grade, request.num_questions)
+        except Exception as e:
+            print(f"Error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        question_bank.add_questions(db, request.subject, request.topic, request.grade, generated)
+        questions, repeats = question_bank.assemble(
+            db, request.subject, request.topic, request.grade, request.num_questions, request.student_id
+        )
+
+    if questions:
+        if llm_ready:
+            question_bank.top_up_if_low(db, request.subject, request.topic, request.grade, repeats, generate_quiz_questions)
+        question_bank.record_exposures(db, request.student_id, [q.id for q in questions])
+        return {"questions": [question_bank.question_row(q) for q in questions]}
+
+    if not llm_ready:
         return {
             "questions": [
                 {
@@ -337,32 +634,156 @@ def generate_quiz(request: QuizRequest):
                 } for i in range(1, request.num_questions + 1)
             ]
         }
+    raise HTTPException(status_code=502, detail="The quiz came back malformed. Please try again.")
 
-    system_prompt = f"You are a tutor for a Grade {request.grade} student."
-    
-    user_prompt = f"""
-    {system_prompt}
-    Create a {request.num_questions}-question multiple choice quiz about '{request.topic}' in {request.subject}.
-    The output must be a JSON object with a key 'questions'.
-    Make sure to include a relevant emoji in every single 'question' string to make the quiz feel like a fun game!
-    Each question object should have: 
-    - 'id'
-    - 'question' (e.g., "What is the capital of France? 🇫🇷")
-    - 'options' (list of 4 strings)
-    - 'correct' (the string of the correct answer)
-    - 'explanation' (a short sentence explaining why the correct answer is right and why others might be wrong)
-    """
+@app.post("/api/quiz/stream")
+def stream_quiz(request: QuizRequest):
+    """The same quiz as /api/quiz as NDJSON: one {"type": "question"} line per question as soon
+    as it exists (bank questions first, then generated ones as the model writes them), then
+    {"type": "done"} or {"type": "error"}"""
+    llm_ready = bool(api_key) or llm_provider == "local"
+
+    def line(event):
+        return json.dumps(event) + "\n"
+
+    def events():
+        db = SessionLocal()
+        try:
+            questions, repeats = question_bank.assemble(
+                db, request.subject, request.topic, request.grade, request.num_questions, request.student_id
+            )
+            metrics.cache_lookup("question_bank", len(questions) >= request.num_questions)
+            if questions:
+                question_bank.record_exposures(db, request.student_id, [q.id for q in questions])
+            for question in questions:
+                yield line({"type": "question", "question": question_bank.question_row(question)})
+            sent = len(questions)
+            seen = {question_bank.normalize(q.question) for q in questions}
+
+            if sent < request.num_questions and not llm_ready:
+                for i in range(sent + 1, request.num_questions + 1):
+                    yield line({"type": "question", "question": {
+                        "id": i,
+                        "question": f"Question {i} about {request.topic}",
+                        "options": ["A", "B", "C", "D"],
+                        "correct": "A"
+                    }})
+                sent = request.num_questions
+
+            if sent < request.num_questions:
+                user_prompt = prompts.render(
+                    "quiz",
+                    grade=request.grade,
+                    num_questions=request.num_questions,
+                    topic=request.topic,
+                    subject=request.subject
+                )
+                parser = quiz_stream.QuestionStreamParser()
+                generated = []
+                served = []
+                for chunk in app_generate_content_stream(user_prompt, model_name='gemini-2.0-flash',
+                                                         response_mime_type='application/json'):
+                    for question in question_bank.validate_questions(parser.feed(chunk)):
+                        generated.append(question)
+                        key = question_bank.normalize(question["question"])
+                        if sent < request.num_questions and key not in seen:
+                            seen.add(key)
+                            sent += 1
+                            served.append(question["question"])
+                            # Not in the bank yet; answers are matched to it by question text
+                            yield line({"type": "question", "question": dict(question, id=None, difficulty=None)})
+                question_bank.add_questions(db, request.subject, request.topic, request.grade, generated)
+                key = question_bank.topic_key(request.subject, request.topic)
+                served_ids = [qid for (qid,) in db.query(models.QuizQuestion.id).filter(
+                    models.QuizQuestion.content_hash.in_(
+                        [question_bank.question_hash(key, request.grade, q) for q in served])
+                ).all()]
+                question_bank.record_exposures(db, request.student_id, served_ids)
+
+            if llm_ready:
+                question_bank.top_up_if_low(db, request.subject, request.topic, request.grade, repeats, generate_quiz_questions)
+            if sent:
+                yield line({"type": "done", "count": sent})
+            else:
+                yield line({"type": "error", "detail": "The quiz came back malformed. Please try again."})
+        except Exception as e:
+            print(f"Error streaming quiz: {e}")
+            yield line({"type": "error", "detail": str(e)})
+        finally:
+            db.close()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+class AdaptiveQuizRequest(BaseModel):
+    subject: str
+    topic: str
+    grade: int
+    student_id: int | None = None
+    max_questions: int = 10
+
+class AdaptiveAnswerRequest(BaseModel):
+    question_id: int
+    chosen: str
+    latency_ms: int | None = None
+
+def _public_question(question):
+    """A bank question without its answer, for adaptive sessions that score server-side"""
+    if question is None:
+        return None
+    return {key: question[key] for key in ("id", "question", "options")}
+
+@app.post("/api/quiz/adaptive/start")
+def start_adaptive_quiz(request: AdaptiveQuizRequest, db: Session = Depends(get_db)):
+    """Start a session that picks each question to match the student's running ability"""
+    llm_ready = bool(api_key) or llm_provider == "local"
+    if llm_ready and question_bank.pool_size(db, request.subject, request.topic, request.grade) < request.max_questions:
+        try:
+            generated = generate_quiz_questions(request.subject, request.topic, request.grade, request.max_questions)
+        except Exception as e:
+            print(f"Error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        if question_bank.add_questions(db, request.subject, request.topic, request.grade, generated):
+            adaptive_quizzes.invalidate(request.subject, request.topic, request.grade)
 
+    session = adaptive_quizzes.start(
+        db, request.subject, request.topic, request.grade, request.student_id, request.max_questions
+    )
+    if session is None:
+        raise HTTPException(status_code=503, detail="No questions are available for this topic yet.")
+    if llm_ready:
+        question_bank.top_up_if_low(db, request.subject, request.topic, request.grade, False, generate_quiz_questions)
+    question = session.index.questions[session.current]
+    question_bank.record_exposures(db, request.student_id, [question["id"]])
+    return {**session.state(), "question": _public_question(question)}
+
+@app.post("/api/quiz/adaptive/{session_id}/answer")
+def answer_adaptive_quiz(session_id: str, request: AdaptiveAnswerRequest, db: Session = Depends(get_db)):
+    """Score an answer, update the ability estimate and return the next question (or done)"""
+    session = adaptive_quizzes.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Quiz session not found or expired")
     try:
-        response = app_generate_content(
-            user_prompt,
-            model_name='gemini-2.0-flash',
-            response_mime_type='application/json'
-        )
-        return json.loads(response.text)
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        result = session.answer(request.question_id, request.chosen, request.latency_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if result["next_question"]:
+        question_bank.record_exposures(db, session.student_id, [result["next_question"]["id"]])
+    result["next_question"] = _public_question(result["next_question"])
+    return result
+
+@app.get("/api/quiz/adaptive/{session_id}")
+def get_adaptive_quiz(session_id: str):
+    session = adaptive_quizzes.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Quiz session not found or expired")
+    return {**session.state(), "history": session.history}
+
+class AnswerIn(BaseModel):
+    question_id: int | None = None  # question bank id, when the quiz came from the bank
+    question: str | None = None
+    chosen: str | None = None
+    correct: bool
+    latency_ms: int | None = None
 
 class ResultRequest(BaseModel):
     student_name: str
@@ -371,10 +792,21 @@ class ResultRequest(BaseModel):
     topic: str
     score: int
     total_questions: int
+    student_id: int | None = None
+    duration_seconds: int | None = None
+    answers: list[AnswerIn] = []
 
 @app.post("/api/results")
 def save_result(result: ResultRequest, db: Session = Depends(get_db)):
+    analytics.ensure_backfilled(db)
+    
+    # Older clients only send the name; link the result to the student when we can
+    student_id = result.student_id
+    if student_id is None:
+        student_id = db.query(models.Student.id).filter(models.Student.name == result.student_name).scalar()
+    
     db_result = models.TestResult(
+        student_id=student_id,
         student_name=result.student_name,
         grade=result.grade,
         subject=result.subject,
@@ -383,6 +815,14 @@ def save_result(result: ResultRequest, db: Session = Depends(get_db)):
         total_questions=result.total_questions
     )
     db.add(db_result)
+    if student_id is not None:
+        analytics.record_quiz(db, student_id, result.subject, result.score, result.total_questions, result.duration_seconds)
+        if result.answers:
+            db.flush()
+            question_bank.log_answers(
+                db, student_id, result.subject, result.topic, result.grade,
+                [a.model_dump() for a in result.answers], test_result_id=db_result.id
+            )
     db.commit()
     db.refresh(db_result)
     return {"status": "success", "id": db_result.id}
@@ -394,7 +834,12 @@ class TwiTranslateRequest(BaseModel):
     text: str
 
 @app.post("/api/twi/translate")
-def translate_to_twi(request: TwiTranslateRequest):
+def translate_to_twi(request: TwiTranslateRequest, db: Session = Depends(get_db)):
+    # Common words and phrases come straight from the lexicon
+    cached = twi_lexicon.lookup(db, request.text)
+    if cached:
+        return cached
+
     if not api_key and llm_provider != "local":
         return {
             "translation": "Simulation: " + request.text,
@@ -402,22 +847,7 @@ def translate_to_twi(request: TwiTranslateRequest):
             "notes": "API Key missing"
         }
 
-    prompt = f"""
-    You are an expert Twi language translator (Asante Twi).
-    Translate the following text into natural, idiomatic Twi: "{request.text}"
-    
-    Format the output as a JSON object with these keys:
-    - 'translation': The Twi translation.
-    - 'pronunciation': A phonetic guide for the Twi text.
-    - 'notes': Brief notes on context or literal meaning if helpful (optional).
-    
-    Example:
-    {{
-      "translation": "Mema wo ahyia",
-      "pronunciation": "Meh-ma wo a-shia",
-      "notes": "Formal greeting used when meeting someone."
-    }}
-    """
+    prompt = prompts.render("twi_translate", text=request.text)
     
     try:
         response = app_generate_content(
@@ -425,34 +855,26 @@ def translate_to_twi(request: TwiTranslateRequest):
             model_name='gemini-2.0-flash',
             response_mime_type='application/json'
         )
-        return json.loads(response.text)
+        result = twi_lexicon.remember_translation(db, request.text, json.loads(response.text))
+        if result is None:
+            raise HTTPException(status_code=502, detail="The translation came back malformed. Please try again.")
+        return {**result, "source": "llm"}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/twi/vocab")
-def generate_twi_vocab(request: TwiRequest):
+def generate_twi_vocab(request: TwiRequest, db: Session = Depends(get_db)):
+    deck = twi_lexicon.get_deck(db, request.topic)
+    if deck:
+        return {"vocab": deck, "source": "deck"}
+
     if not api_key and llm_provider != "local":
         return {"content": "Simulation: Twi vocab for " + request.topic}
 
-    prompt = f"""
-    You are an expert Twi language teacher (Asante Twi).
-    Create a comprehensive list of 18 common Twi words and phrases related to '{request.topic}'.
-    Include a diverse mix of nouns, verbs, adjectives, and useful phrases.
-    Format the output as a JSON object with a key 'vocab'.
-    Each item should have: 'twi' (the word/phrase), 'english' (translation), 'pronunciation' (phonetic guide), and 'example' (a simple sentence using the word in Twi with English translation).
-    Example:
-    {{
-      "vocab": [
-        {{
-          "twi": "Maakye",
-          "english": "Good morning",
-          "pronunciation": "Ma-chi",
-          "example": "Maakye, Papa. (Good morning, Father.)"
-        }}
-      ]
-    }}
-    """
+    prompt = prompts.render("twi_vocab", topic=request.topic)
     
     try:
         response = app_generate_content(
@@ -460,7 +882,13 @@ def generate_twi_vocab(request: TwiRequest):
             model_name='gemini-1.5-flash',
             response_mime_type='application/json'
         )
-        return json.loads(response.text)
+        data = json.loads(response.text)
+        vocab = twi_lexicon.store_deck(db, request.topic, data.get("vocab") if isinstance(data, dict) else data)
+        if not vocab:
+            raise HTTPException(status_code=502, detail="The vocabulary list came back malformed. Please try again.")
+        return {"vocab": vocab, "source": "llm"}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -499,6 +927,7 @@ def get_or_create_student(student: StudentCreate, db: Session = Depends(get_db))
         db.add(db_student)
         db.commit()
         db.refresh(db_student)
+        rank_index.add_student(db_student.id)
     return db_student
 
 class StudentUpdate(BaseModel):
@@ -559,9 +988,20 @@ def delete_student(student_id: int, db: Session = Depends(get_db)):
     try:
         # Delete associated results
         db.query(models.TestResult).filter(models.TestResult.student_id == student_id).delete()
+        # Drop the student's XP ledger so they leave every leaderboard period
+        db.query(models.XPEvent).filter(models.XPEvent.student_id == student_id).delete()
+        db.query(models.XPRollup).filter(models.XPRollup.student_id == student_id).delete()
+        db.query(models.LessonChunk).filter(models.LessonChunk.student_id == student_id).delete()
+        db.query(models.ChatTurn).filter(models.ChatTurn.student_id == student_id).delete()
+        db.query(models.AnswerEvent).filter(models.AnswerEvent.student_id == student_id).delete()
+        db.query(models.QuestionExposure).filter(models.QuestionExposure.student_id == student_id).delete()
+        db.query(models.StudentAbility).filter(models.StudentAbility.student_id == student_id).delete()
+        db.query(models.TopicMastery).filter(models.TopicMastery.student_id == student_id).delete()
         
         db.delete(db_student)
         db.commit()
+        rank_index.remove_student(student_id)
+        retriever.remove_student(student_id)
         return {"message": "Student deleted successfully"}
     except Exception as e:
         print(f"Error deleting student: {e}")
@@ -575,10 +1015,7 @@ class PinUpdate(BaseModel):
 def verify_pin(pin_data: dict, db: Session = Depends(get_db)):
     pin = pin_data.get("pin")
     print(f"Verifying PIN: {pin}")
-    setting = db.query(models.Settings).filter(models.Settings.key == "parent_pin").first()
-    
-    # Default to 1234 if not set (though migration should have set it)
-    current_pin = setting.value if setting else "1234"
+    current_pin = current_parent_pin(db)
     
     if pin == current_pin:
         return {"valid": True}
@@ -662,33 +1099,16 @@ def recover_pin(recover: RecoverPin, db: Session = Depends(get_db)):
 
 @app.post("/api/students/xp")
 def add_xp(update: XPUpdate, db: Session = Depends(get_db)):
-    db_student = db.query(models.Student).filter(models.Student.id == update.student_id).first()
-    if not db_student:
+    # XP and level are updated in one statement (see gamification.LEVEL_THRESHOLDS)
+    awarded = gamification.award_xp(db, update.student_id, update.xp_amount)
+    if awarded is None:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    db_student.xp += update.xp_amount
-    
-    # Simple Leveling Logic
-    # Level 1: 0-100, Level 2: 101-300, Level 3: 301-600, Level 4: 601-1000, Level 5: 1000+
-    new_level = db_student.level
-    if db_student.xp > 1000:
-        new_level = 5
-    elif db_student.xp > 600:
-        new_level = 4
-    elif db_student.xp > 300:
-        new_level = 3
-    elif db_student.xp > 100:
-        new_level = 2
-    else:
-        new_level = 1
-        
-    leveled_up = new_level > db_student.level
-    db_student.level = new_level
-    
+    xp, level, leveled_up, event = awarded
     db.commit()
-    db.refresh(db_student)
+    rank_index.record(event)
     
-    return {"xp": db_student.xp, "level": db_student.level, "leveled_up": leveled_up}
+    return {"xp": xp, "level": level, "leveled_up": leveled_up}
 
 @app.get("/api/review/recommendations/{student_id}")
 def get_review_recommendations(student_id: int, db: Session = Depends(get_db)):
@@ -698,7 +1118,15 @@ def get_review_recommendations(student_id: int, db: Session = Depends(get_db)):
     # This is a simplified query. In a real app, we might want more complex logic.
     # We'll fetch all results for the student and process in python for simplicity with SQLite
     results = db.query(models.TestResult).filter(models.TestResult.student_id == student_id).all()
-    
+    mastery = db.query(models.TopicMastery).filter(models.TopicMastery.student_id == student_id).all()
+    return build_review_recommendations(results, mastery)
+
+MASTERY_REVIEW_BELOW = 0.6
+MASTERY_MIN_ANSWERS = 5
+
+def build_review_recommendations(results, mastery=()):
+    """Weak topics (latest score < 60%) from a student's test results,
+    plus topics whose calibrated mastery is low"""
     recommendations = {}
     
     for r in results:
@@ -716,67 +1144,68 @@ def get_review_recommendations(student_id: int, db: Session = Depends(get_db)):
             # If they passed it recently, remove from recommendations
             if r.topic in recommendations:
                 del recommendations[r.topic]
+    
+    # Calibrated mastery weighs question difficulty, so it can flag a topic
+    # whose raw scores look fine (easy questions) or confirm a weak one
+    for m in mastery:
+        if m.answers < MASTERY_MIN_ANSWERS:
+            continue
+        if m.topic in recommendations:
+            recommendations[m.topic]["mastery"] = int(m.mastery * 100)
+        elif m.mastery < MASTERY_REVIEW_BELOW:
+            recommendations[m.topic] = {
+                "subject": m.subject,
+                "topic": m.topic,
+                "last_score": int(100 * m.correct / m.answers),
+                "mastery": int(m.mastery * 100)
+            }
                 
     return list(recommendations.values())
 
 
-@app.get("/api/results")
-def get_results(db: Session = Depends(get_db)):
-    return db.query(models.TestResult).order_by(models.TestResult.timestamp.desc()).all()
+class TestResultOut(BaseModel):
+    id: int
+    student_id: int | None = None
+    student_name: str | None = None
+    grade: int | None = None
+    subject: str | None = None
+    topic: str | None = None
+    score: int | None = None
+    total_questions: int | None = None
+    timestamp: datetime | None = None
+
+@app.get("/api/results", response_model=list[TestResultOut])
+def get_results(limit: int | None = None, db: Session = Depends(get_db)):
+    query = db.query(models.TestResult).order_by(models.TestResult.timestamp.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    results = query.all()
+    return FastJSONResponse(serializers.rows(serializers.test_result_row, results))
 
 class TTSRequest(BaseModel):
     text: str
-    voice_id: str = DEFAULT_VOICE_ID # Default voice
+    # Edge voice name or ElevenLabs voice id; defaults to Edge's Jenny
+    voice_id: str | None = None
 
 @app.post("/api/tts")
 async def generate_speech(request: TTSRequest):
+    """MP3 streamed as it is synthesized; replays come from the audio cache.
+    Edge voice names go to Edge TTS and ElevenLabs voice ids to ElevenLabs."""
     try:
-        import edge_tts
-        import asyncio
-        from io import BytesIO
-        
-        import re
-        
-        # Use a friendly female voice (Jenny is clear and pleasant)
-        # You can also try: en-US-AriaNeural, en-US-SaraNeural
-        voice = "en-US-JennyNeural"
-        
-        # Clean text for TTS (remove markdown asterisks and emojis)
-        clean_text = request.text.replace("*", "").replace("#", "")
-        
-        # Regex to strip out common emoji ranges so the TTS engine doesn't read them out
-        emoji_pattern = re.compile(
-            r'['
-            r'\U0001f600-\U0001f64f'  # emoticons
-            r'\U0001f300-\U0001f5ff'  # symbols & pictographs
-            r'\U0001f680-\U0001f6ff'  # transport & map symbols
-            r'\U0001f1e0-\U0001f1ff'  # flags
-            r'\u2600-\u27bf'          # misc symbols and dingbats
-            r'\U0001f900-\U0001f9ff'  # supplemental symbols
-            r'\U0001fa70-\U0001faff'  # symbols and pictographs ext-a
-            r']+', flags=re.UNICODE)
-        clean_text = emoji_pattern.sub(r'', clean_text)
-        
-        # Generate speech using Edge TTS
-        communicate = edge_tts.Communicate(clean_text, voice)
-        
-        # Collect audio chunks
-        audio_data = BytesIO()
-        async for chunk in communicate.stream():
-            if chunk["type"] == "audio":
-                audio_data.write(chunk["data"])
-        
-        audio_bytes = audio_data.getvalue()
-        
-        if not audio_bytes:
-            raise HTTPException(status_code=500, detail="No audio generated")
-        
-        return Response(content=audio_bytes, media_type="audio/mpeg")
-        
+        speech = await tts_service.stream(request.text, request.voice_id)
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         error_msg = str(e)
         print(f"Error generating speech: {error_msg}")
         raise HTTPException(status_code=500, detail=f"Failed to generate speech: {error_msg}")
+    return StreamingResponse(speech.chunks, media_type="audio/mpeg", headers=speech.headers())
+
+@app.get("/api/admin/tts-usage", dependencies=[Depends(require_admin)])
+def get_tts_usage():
+    return tts_service.budget.snapshot()
 
 # ==================== GAMIFICATION ENDPOINTS ====================
 
@@ -809,11 +1238,17 @@ def get_student_badges(student_id: int, db: Session = Depends(get_db)):
         models.StudentBadge.student_id == student_id
     ).all()
     
-    earned_badge_ids = {sb.badge_id for sb in earned}
-    
     # Get all badges
     all_badges = db.query(models.Badge).all()
     
+    # Progress counts are gathered once instead of one query per badge
+    stats = get_badge_stats(db, student_id)
+    return build_student_badges(all_badges, earned, stats)
+
+def build_student_badges(all_badges, earned, stats):
+    """Badge list with earned details and progress toward unearned badges"""
+    earned_by_id = {sb.badge_id: sb for sb in earned}
+    
     # Calculate progress
     result = []
     for badge in all_badges:
@@ -823,53 +1258,57 @@ def get_student_badges(student_id: int, db: Session = Depends(get_db)):
             "description": badge.description,
             "icon": badge.icon,
             "tier": badge.tier,
-            "earned": badge.id in earned_badge_ids,
+            "earned": badge.id in earned_by_id,
             "progress": 0,
             "is_new": False
         }
         
         # If earned, get details
-        if badge.id in earned_badge_ids:
-            sb = next(sb for sb in earned if sb.badge_id == badge.id)
+        sb = earned_by_id.get(badge.id)
+        if sb:
             badge_data["earned_at"] = sb.earned_at.isoformat()
             badge_data["is_new"] = sb.is_new
         else:
             # Calculate progress toward badge
-            badge_data["progress"] = calculate_badge_progress(db, student_id, badge)
+            badge_data["progress"] = calculate_badge_progress(stats, badge)
         
         result.append(badge_data)
     
     return result
 
-def calculate_badge_progress(db: Session, student_id: int, badge: models.Badge):
+def get_badge_stats(db: Session, student_id: int):
+    """Counts behind badge progress, read with one aggregate query"""
+    lesson_count, perfect_count, subject_count = db.query(
+        func.count(models.TestResult.id),
+        func.sum(case((models.TestResult.score == models.TestResult.total_questions, 1), else_=0)),
+        func.count(func.distinct(models.TestResult.subject))
+    ).filter(models.TestResult.student_id == student_id).one()
+    
+    streak = db.query(models.StudentStreak).filter(
+        models.StudentStreak.student_id == student_id
+    ).first()
+    
+    return {
+        "lesson_count": lesson_count or 0,
+        "perfect_score": perfect_count or 0,
+        "subject_count": subject_count or 0,
+        "streak": (streak.current_streak or 0) if streak else 0
+    }
+
+def badge_stats_from_rows(results, streak):
+    """Same counts as get_badge_stats, from rows the caller already loaded"""
+    return {
+        "lesson_count": len(results),
+        "perfect_score": sum(1 for r in results if r.score == r.total_questions),
+        "subject_count": len({r.subject for r in results if r.subject is not None}),
+        "streak": (streak.current_streak or 0) if streak else 0
+    }
+
+def calculate_badge_progress(stats: dict, badge: models.Badge):
     """Calculate progress toward earning a badge (0-100%)"""
     try:
-        if badge.criteria_type == "lesson_count":
-            count = db.query(models.TestResult).filter(
-                models.TestResult.student_id == student_id
-            ).count()
-            return min(100, int((count / badge.criteria_value) * 100))
-        
-        elif badge.criteria_type == "perfect_score":
-            count = db.query(models.TestResult).filter(
-                models.TestResult.student_id == student_id,
-                models.TestResult.score == models.TestResult.total_questions
-            ).count()
-            return min(100, int((count / badge.criteria_value) * 100))
-        
-        elif badge.criteria_type == "streak":
-            streak = db.query(models.StudentStreak).filter(
-                models.StudentStreak.student_id == student_id
-            ).first()
-            if not streak:
-                return 0
-            return min(100, int((streak.current_streak / badge.criteria_value) * 100))
-        
-        elif badge.criteria_type == "subject_count":
-            subjects = db.query(models.TestResult.subject).filter(
-                models.TestResult.student_id == student_id
-            ).distinct().count()
-            return min(100, int((subjects / badge.criteria_value) * 100))
+        if badge.criteria_type in ("lesson_count", "perfect_score", "streak", "subject_count"):
+            return min(100, int((stats[badge.criteria_type] / badge.criteria_value) * 100))
         
         return 0
     except:
@@ -995,10 +1434,11 @@ def get_student_streak(student_id: int, db: Session = Depends(get_db)):
     
     if not streak:
         # Create new streak record
-        streak = models.StudentStreak(student_id=student_id)
-        db.add(streak)
+        gamification.ensure_streak(db, student_id)
         db.commit()
-        db.refresh(streak)
+        streak = db.query(models.StudentStreak).filter(
+            models.StudentStreak.student_id == student_id
+        ).first()
     
     return {
         "current_streak": streak.current_streak,
@@ -1010,78 +1450,73 @@ def get_student_streak(student_id: int, db: Session = Depends(get_db)):
 @app.post("/api/students/{student_id}/activity")
 def log_activity(student_id: int, db: Session = Depends(get_db)):
     """Update streak based on activity"""
-    streak = db.query(models.StudentStreak).filter(
-        models.StudentStreak.student_id == student_id
-    ).first()
-    
-    if not streak:
-        streak = models.StudentStreak(student_id=student_id)
-        db.add(streak)
-    
-    today = date.today()
+    # Continue, reset or start the streak in one conditional upsert
+    updated = gamification.record_activity(db, student_id)
+    db.commit()
     
     # Check if already logged today
-    if streak.last_activity_date == today:
+    if updated is None:
+        streak = db.query(models.StudentStreak).filter(
+            models.StudentStreak.student_id == student_id
+        ).first()
         return {"streak": streak.current_streak, "message": "Already logged today"}
     
-    # Check if streak continues
-    if streak.last_activity_date:
-        days_since = (today - streak.last_activity_date).days
-        
-        if days_since == 1:
-            # Continue streak
-            streak.current_streak += 1
-            if streak.current_streak > streak.longest_streak:
-                streak.longest_streak = streak.current_streak
-            
-            # Award freeze after 7 days
-            if streak.current_streak >= 7 and not streak.freeze_available:
-                streak.freeze_available = True
-        
-        elif days_since > 1:
-            # Streak broken - reset
-            streak.current_streak = 1
-            streak.freeze_available = False
-    else:
-        # First activity
-        streak.current_streak = 1
-    
-    streak.last_activity_date = today
-    db.commit()
+    current_streak, longest_streak, freeze_available = updated
     
     # Check for streak-based badges
     check_and_award_badges(student_id, db)
     
     return {
-        "current_streak": streak.current_streak,
-        "longest_streak": streak.longest_streak,
-        "freeze_available": streak.freeze_available
+        "current_streak": current_streak,
+        "longest_streak": longest_streak,
+        "freeze_available": freeze_available
     }
 
 # ==================== LEADERBOARD ENDPOINTS ====================
 
+def _check_period(period: str):
+    if period not in leaderboard.PERIODS:
+        raise HTTPException(status_code=400, detail=f"Unknown period '{period}'. Use one of: {', '.join(leaderboard.PERIODS)}")
+
 @app.get("/api/leaderboard")
 def get_leaderboard(period: str = "all_time", limit: int = 10, db: Session = Depends(get_db)):
-    """Get leaderboard rankings"""
-    # For now, we only track all-time XP. 
-    # Future: Implement weekly XP tracking in a separate table or reset logic.
+    """Get leaderboard rankings for all_time, weekly or monthly XP"""
+    _check_period(period)
+    return build_leaderboard(db, period, limit)
+
+def build_leaderboard(db: Session, period: str, limit: int):
+    ranked = rank_index.top(db, period, limit)
     
-    students = db.query(models.Student).order_by(models.Student.xp.desc()).limit(limit).all()
+    # Only the students on the board are loaded, never the whole table
+    student_ids = [student_id for student_id, _ in ranked]
+    students = {
+        s.id: s for s in db.query(models.Student).filter(models.Student.id.in_(student_ids)).all()
+    }
     
-    leaderboard = []
-    for rank, student in enumerate(students, 1):
+    entries = []
+    for rank, (student_id, xp) in enumerate(ranked, 1):
+        student = students.get(student_id)
+        if not student:
+            continue
         display_name = student.name if student.is_public_profile else f"Student #{student.id}"
-        leaderboard.append({
+        entries.append({
             "rank": rank,
             "id": student.id,
             "name": display_name,
-            "xp": student.xp,
+            "xp": xp,
             "level": student.level,
             "avatar": student.avatar if student.is_public_profile else "👤",
             "is_public": student.is_public_profile
         })
         
-    return leaderboard
+    return entries
+
+@app.get("/api/leaderboard/rank/{student_id}")
+def get_my_rank(student_id: int, period: str = "all_time", db: Session = Depends(get_db)):
+    """Get a single student's position on the leaderboard"""
+    _check_period(period)
+    rank, xp, ranked_count = rank_index.rank(db, period, student_id)
+    return {"period": period, "rank": rank, "xp": xp, "total_ranked": ranked_count}
 
 @app.put("/api/students/{student_id}/privacy")
 def update_privacy(student_id: int, privacy_data: dict, db: Session = Depends(get_db)):
@@ -1106,14 +1541,7 @@ def generate_flashcards(request: FlashcardGenerateRequest):
     if not api_key and llm_provider != "local":
         return {"flashcards": []}
 
-    prompt = f"""
-    Create {request.num_cards} flashcards from the following text.
-    Return a JSON object with a key 'flashcards' containing a list of objects.
-    Each object must have 'front' (question) and 'back' (answer).
-    Keep questions concise and answers clear.
-    
-    Text: {request.text[:2000]}
-    """
+    prompt = prompts.render("flashcards", num_cards=request.num_cards, text=request.text[:2000])
 
     try:
         response = app_generate_content(
@@ -1132,7 +1560,18 @@ class FlashcardCreateRequest(BaseModel):
     front: str
     back: str
 
-@app.post("/api/students/{student_id}/flashcards")
+class FlashcardOut(BaseModel):
+    id: int
+    student_id: int | None = None
+    topic: str | None = None
+    front: str | None = None
+    back: str | None = None
+    ease_factor: float | None = None
+    interval: int | None = None
+    next_review: datetime | None = None
+    review_count: int | None = None
+
+@app.post("/api/students/{student_id}/flashcards", response_model=FlashcardOut)
 def create_flashcard(student_id: int, card: FlashcardCreateRequest, db: Session = Depends(get_db)):
     db_card = models.Flashcard(
         student_id=student_id,
@@ -1144,16 +1583,16 @@ def create_flashcard(student_id: int, card: FlashcardCreateRequest, db: Session
     db.add(db_card)
     db.commit()
     db.refresh(db_card)
-    return db_card
+    return FastJSONResponse(serializers.flashcard_row(db_card))
 
-@app.get("/api/students/{student_id}/flashcards/due")
+@app.get("/api/students/{student_id}/flashcards/due", response_model=list[FlashcardOut])
 def get_due_flashcards(student_id: int, db: Session = Depends(get_db)):
     now = datetime.utcnow()
     cards = db.query(models.Flashcard).filter(
         models.Flashcard.student_id == student_id,
         models.Flashcard.next_review <= now
     ).all()
-    return cards
+    return FastJSONResponse(serializers.rows(serializers.flashcard_row, cards))
 
 class FlashcardReviewRequest(BaseModel):
     rating: str # "easy", "medium", "hard"
@@ -1185,10 +1624,10 @@ def review_flashcard(card_id: int, review: FlashcardReviewRequest, db: Session =
     db.commit()
     return {"status": "success", "next_review": card.next_review, "interval": card.interval}
 
-@app.get("/api/students/{student_id}/flashcards")
+@app.get("/api/students/{student_id}/flashcards", response_model=list[FlashcardOut])
 def get_all_flashcards(student_id: int, db: Session = Depends(get_db)):
     cards = db.query(models.Flashcard).filter(models.Flashcard.student_id == student_id).all()
-    return cards
+    return FastJSONResponse(serializers.rows(serializers.flashcard_row, cards))
 
 @app.delete("/api/flashcards/{card_id}")
 def delete_flashcard(card_id: int, db: Session = Depends(get_db)):
@@ -1200,10 +1639,10 @@ def delete_flashcard(card_id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"status": "success", "message": "Flashcard deleted"}
 
-@app.get("/api/students/{student_id}/results")
+@app.get("/api/students/{student_id}/results", response_model=list[TestResultOut])
 def get_student_results(student_id: int, db: Session = Depends(get_db)):
     results = db.query(models.TestResult).filter(models.TestResult.student_id == student_id).order_by(models.TestResult.timestamp.desc()).all()
-    return results
+    return FastJSONResponse(serializers.rows(serializers.test_result_row, results))
 
 # ==================== LESSON LOG ENDPOINTS ====================
 
@@ -1211,9 +1650,19 @@ class LessonLogCreate(BaseModel):
     subject: str
     topic: str
     content: str
+    duration_seconds: int | None = None
+
+class LessonLogOut(BaseModel):
+    id: int
+    student_id: int | None = None
+    subject: str | None = None
+    topic: str | None = None
+    content: str | None = None
+    timestamp: datetime | None = None
 
-@app.post("/api/students/{student_id}/lesson-log")
+@app.post("/api/students/{student_id}/lesson-log", response_model=LessonLogOut)
 def log_lesson(student_id: int, log: LessonLogCreate, db: Session = Depends(get_db)):
+    analytics.ensure_backfilled(db)
     db_log = models.LessonLog(
         student_id=student_id,
         subject=log.subject,
@@ -1222,14 +1671,23 @@ def log_lesson(student_id: int, log: LessonLogCreate, db: Session = Depends(get_
         timestamp=datetime.utcnow()
     )
     db.add(db_log)
+    analytics.record_lesson(db, student_id, log.subject, log.duration_seconds, when=db_log.timestamp)
+    db.flush()
+    # Chunks commit with the log, so a concurrent first search never sees the log without them
+    chunks = retriever.chunk_lesson(db, db_log)
     db.commit()
     db.refresh(db_log)
-    return db_log
+    try:
+        retriever.add_lesson(db_log, chunks)
+    except Exception as e:
+        # The chunks are stored; the index picks them up the next time it loads
+        print(f"Error indexing lesson for retrieval: {e}")
+    return FastJSONResponse(serializers.lesson_log_row(db_log))
 
-@app.get("/api/students/{student_id}/lesson-logs")
+@app.get("/api/students/{student_id}/lesson-logs", response_model=list[LessonLogOut])
 def get_lesson_logs(student_id: int, db: Session = Depends(get_db)):
     logs = db.query(models.LessonLog).filter(models.LessonLog.student_id == student_id).order_by(models.LessonLog.timestamp.desc()).all()
-    return logs
+    return FastJSONResponse(serializers.rows(serializers.lesson_log_row, logs))
 
 # ==================== SAVED QUIZ ENDPOINTS ====================
 
@@ -1239,7 +1697,15 @@ class SavedQuizCreate(BaseModel):
     topic: str
     questions: list
 
-@app.post("/api/saved-quizzes")
+class SavedQuizOut(BaseModel):
+    id: int
+    student_id: int | None = None
+    subject: str | None = None
+    topic: str | None = None
+    questions: list | None = None
+    created_at: datetime | None = None
+
+@app.post("/api/saved-quizzes", response_model=SavedQuizOut)
 def save_quiz(quiz: SavedQuizCreate, db: Session = Depends(get_db)):
     db_quiz = models.SavedQuiz(
         student_id=quiz.student_id,
@@ -1251,12 +1717,12 @@ def save_quiz(quiz: SavedQuizCreate, db: Session = Depends(get_db)):
     db.add(db_quiz)
     db.commit()
     db.refresh(db_quiz)
-    return db_quiz
+    return FastJSONResponse(serializers.saved_quiz_row(db_quiz))
 
-@app.get("/api/students/{student_id}/saved-quizzes")
+@app.get("/api/students/{student_id}/saved-quizzes", response_model=list[SavedQuizOut])
 def get_saved_quizzes(student_id: int, db: Session = Depends(get_db)):
     quizzes = db.query(models.SavedQuiz).filter(models.SavedQuiz.student_id == student_id).order_by(models.SavedQuiz.created_at.desc()).all()
-    return quizzes
+    return FastJSONResponse(serializers.rows(serializers.saved_quiz_row, quizzes))
 
 @app.delete("/api/saved-quizzes/{quiz_id}")
 def delete_saved_quiz(quiz_id: int, db: Session = Depends(get_db)):
@@ -1267,3 +1733,349 @@ def delete_saved_quiz(quiz_id: int, db: Session = Depends(get_db)):
     db.delete(quiz)
     db.commit()
     return {"status": "success", "message": "Quiz deleted"}
+
+# ==================== ANALYTICS ENDPOINTS ====================
+
+def _check_granularity(granularity: str):
+    if granularity not in analytics.GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown granularity '{granularity}'. Use one of: {', '.join(analytics.GRANULARITIES)}")
+
+@app.get("/api/analytics/xp")
+def get_xp_over_time(student_id: int | None = None, granularity: str = "day", days: int = 90, db: Session = Depends(get_db)):
+    """XP earned per day/week/month, with running totals for a single student"""
+    _check_granularity(granularity)
+    return analytics.xp_series(db, student_id, granularity, days)
+
+@app.get("/api/analytics/scores")
+def get_scores_by_subject(student_id: int | None = None, days: int = 90, db: Session = Depends(get_db)):
+    """Quiz accuracy per subject"""
+    analytics.ensure_backfilled(db)
+    return analytics.scores_by_subject(db, student_id, days)
+
+@app.get("/api/analytics/heatmap")
+def get_activity_heatmap(student_id: int | None = None, days: int = 365, db: Session = Depends(get_db)):
+    """Quizzes + lessons per active day"""
+    analytics.ensure_backfilled(db)
+    return analytics.activity_heatmap(db, student_id, days)
+
+@app.get("/api/analytics/time-on-subject")
+def get_time_on_subject(student_id: int | None = None, granularity: str = "week", days: int = 90, db: Session = Depends(get_db)):
+    """Active learning seconds per subject"""
+    _check_granularity(granularity)
+    analytics.ensure_backfilled(db)
+    return analytics.time_on_subject(db, student_id, granularity, days)
+
+@app.get("/api/analytics/overview")
+def get_analytics_overview(student_id: int | None = None, granularity: str = "week", days: int = 90, db: Session = Depends(get_db)):
+    """All dashboard series in one response"""
+    _check_granularity(granularity)
+    analytics.ensure_backfilled(db)
+    return {
+        "xp": analytics.xp_series(db, student_id, granularity, days),
+        "scores": analytics.scores_by_subject(db, student_id, days),
+        "heatmap": analytics.activity_heatmap(db, student_id, max(days, 365)),
+        "time_on_subject": analytics.time_on_subject(db, student_id, granularity, days)
+    }
+
+class ExportRequest(BaseModel):
+    format: str = "parquet"
+
+@app.get("/api/admin/analytics/cohort", dependencies=[Depends(require_admin)])
+def get_cohort_summary():
+    """Cohort statistics (topic difficulty, score distribution, retention) for term reports"""
+    import exports
+    try:
+        return exports.cohort_summary()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.post("/api/admin/exports", dependencies=[Depends(require_admin)])
+def export_learning_history(request: ExportRequest):
+    """Write learning history as Parquet/Arrow files under data/exports"""
+    import exports
+    try:
+        return {"files": exports.export_all(request.format)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.post("/api/admin/calibrate", dependencies=[Depends(require_admin)])
+def calibrate_questions():
+    """Refit question difficulty, student ability and topic mastery from answer events"""
+    import calibration
+    try:
+        summary = calibration.calibrate()
+        adaptive_quizzes.invalidate()
+        return summary
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/api/admin/prompt-stats", dependencies=[Depends(require_admin)])
+def get_prompt_stats(reset: bool = False):
+    """Per-template LLM calls, input/output tokens and latency since startup (or the last reset)"""
+    stats = prompts.prompt_stats.snapshot()
+    if reset:
+        prompts.prompt_stats.reset()
+    return {"templates": prompts.templates(), "stats": stats}
+
+# ==================== PROFILING ====================
+
+class ProfilerStartRequest(BaseModel):
+    interval_ms: float = profiling.PROFILE_INTERVAL_MS
+    seconds: float = 30.0
+    # Also count threads parked in waits and the idle event loop
+    include_idle: bool = False
+
+@app.post("/api/admin/profiler/start", dependencies=[Depends(require_admin)])
+def start_profiler(request: ProfilerStartRequest):
+    if not profiling.profiler.start(request.interval_ms, request.seconds, request.include_idle):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return profiling.profiler.status()
+
+@app.post("/api/admin/profiler/stop", dependencies=[Depends(require_admin)])
+def stop_profiler():
+    """Folded stacks ("frame;frame;frame count" lines) for flamegraph.pl, speedscope or inferno"""
+    folded = profiling.profiler.stop()
+    return Response(folded, media_type="text/plain; charset=utf-8",
+                    headers={"X-Profile-Samples": str(profiling.profiler.samples)})
+
+@app.get("/api/admin/profiler", dependencies=[Depends(require_admin)])
+def get_profiler_status():
+    return profiling.profiler.status()
+
+@app.get("/api/admin/slow-requests", dependencies=[Depends(require_admin)])
+def get_slow_requests(reset: bool = False):
+    """Requests over SLOW_REQUEST_SECONDS with their stages, SQL and provider calls, newest first"""
+    entries = profiling.slow_requests.snapshot()
+    if reset:
+        profiling.slow_requests.reset()
+    return {"threshold_seconds": profiling.slow_requests.threshold, "requests": entries}
+
+@app.get("/api/admin/n-plus-one", dependencies=[Depends(require_admin)])
+def get_n_plus_one(reset: bool = False):
+    """SELECTs that one request ran N_PLUS_ONE_THRESHOLD or more times, with the code that ran them"""
+    findings = profiling.n_plus_one.snapshot()
+    if reset:
+        profiling.n_plus_one.reset()
+    return {"threshold": profiling.n_plus_one.threshold, "findings": findings}
+
+# ==================== BACKGROUND JOBS ====================
+
+class LessonTextJob(BaseModel):
+    subject: str
+    topic: str
+    subtopic: str
+    grade: int
+
+class LessonImageJob(BaseModel):
+    grade: int
+    image_prompt: str
+    subtopic: str = ""
+
+class QuizQuestionsJob(BaseModel):
+    subject: str
+    topic: str
+    grade: int
+    count: int = question_bank.TOPUP_BATCH
+
+class SpeechJob(BaseModel):
+    text: str
+    voice_id: str | None = None
+
+@job_queue.register("lesson_content", pool="llm", payload_model=LessonTextJob)
+def run_lesson_content_job(payload, ctx):
+    """Lesson text now; the illustration, if any, follows as its own image job"""
+    if not api_key and llm_provider != "local":
+        return {"content": f"Simulation: Content for {payload['subtopic']} (Grade {payload['grade']})", "image_url": None}
+    content, image_prompt = build_lesson_text(payload["subject"], payload["topic"], payload["subtopic"], payload["grade"])
+    result = {"content": content, "image_url": None}
+    if image_prompt:
+        result["image_job_id"] = ctx.enqueue(
+            "lesson_image", {"grade": payload["grade"], "image_prompt": image_prompt, "subtopic": payload["subtopic"]}
+        )
+    return result
+
+@job_queue.register("lesson_image", pool="image", payload_model=LessonImageJob)
+def run_lesson_image_job(payload, ctx):
+    return {"image_url": generate_lesson_image(payload["grade"], payload["image_prompt"], payload["subtopic"])}
+
+@job_queue.register("quiz_questions", pool="llm", payload_model=QuizQuestionsJob)
+def run_quiz_questions_job(payload, ctx):
+    """Add newly generated questions to the question bank"""
+    if not api_key and llm_provider != "local":
+        return {"added": 0}
+    generated = generate_quiz_questions(payload["subject"], payload["topic"], payload["grade"], payload["count"])
+    db = SessionLocal()
+    try:
+        added = question_bank.add_questions(db, payload["subject"], payload["topic"], payload["grade"], generated)
+    finally:
+        db.close()
+    adaptive_quizzes.invalidate(payload["subject"], payload["topic"], payload["grade"])
+    return {"added": added}
+
+@job_queue.register("tts", pool="audio", payload_model=SpeechJob)
+def run_speech_job(payload, ctx):
+    import asyncio
+    audio_bytes = asyncio.run(tts_service.synthesize(payload["text"], payload["voice_id"]))
+    return {"artifact": ctx.save_artifact(audio_bytes, "mp3"), "media_type": "audio/mpeg"}
+
+class PodcastJob(BaseModel):
+    lesson_log_id: int
+
+@job_queue.register("podcast", pool="audio", payload_model=PodcastJob)
+def run_podcast_job(payload, ctx):
+    """Two-host MP3 episode of a saved lesson, with a chapter index"""
+    db = SessionLocal()
+    try:
+        log = db.query(models.LessonLog).filter(models.LessonLog.id == payload["lesson_log_id"]).first()
+        if not log:
+            raise HTTPException(status_code=404, detail="Lesson not found")
+        grade = db.query(models.Student.grade).filter(models.Student.id == log.student_id).scalar() or 3
+    finally:
+        db.close()
+
+    def generate(prompt):
+        return app_generate_content(prompt, model_name='gemini-2.0-flash', response_mime_type='application/json').text
+
+    mp3, episode = podcast.build_episode(log, grade, generate, ctx.progress)
+    return {"artifact": ctx.save_artifact(mp3, "mp3"), "media_type": "audio/mpeg",
+            "lesson_log_id": log.id, **episode}
+
+class JobRequest(BaseModel):
+    kind: str
+    payload: dict
+    priority: int | None = None  # lower runs sooner
+
+@app.post("/api/jobs", status_code=202)
+def enqueue_job(request: JobRequest):
+    """Queue slow work and poll /api/jobs/{id}; identical requests share one job"""
+    try:
+        job = job_queue.enqueue(request.kind, request.payload, request.priority)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**job, **job_queue.get(job["id"])}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: int):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/artifact")
+def get_job_artifact(job_id: int):
+    job = job_queue.get(job_id)
+    if not job or job["status"] != "succeeded" or not (job["result"] or {}).get("artifact"):
+        raise HTTPException(status_code=404, detail="No artifact for this job")
+    return FileResponse(os.path.join(jobs.ARTIFACT_DIR, job["result"]["artifact"]), media_type=job["result"]["media_type"])
+
+@app.post("/api/lesson-logs/{log_id}/podcast", status_code=202)
+def create_podcast(log_id: int, db: Session = Depends(get_db)):
+    """Start rendering a podcast of a saved lesson; poll /api/jobs/{id}, then play its artifact"""
+    if not api_key and llm_provider != "local":
+        raise HTTPException(status_code=503, detail="Podcasts need an LLM provider")
+    if not db.query(models.LessonLog.id).filter(models.LessonLog.id == log_id).first():
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    job = job_queue.enqueue("podcast", {"lesson_log_id": log_id})
+    return {**job, **job_queue.get(job["id"])}
+
+# ==================== SESSION BOOTSTRAP ====================
+
+BOOTSTRAP_SECTIONS = ("greeting", "streak", "badges", "recommendations", "leaderboard", "flashcards_due")
+
+def section_etag(payload) -> str:
+    """Weak ETag over the canonical JSON of one bootstrap section"""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"), default=str)
+    return 'W/"' + hashlib.sha1(body.encode("utf-8")).hexdigest()[:16] + '"'
+
+def load_dashboard_sections(student_id: int):
+    """Every DB-backed dashboard section, built from one session and shared reads"""
+    db = SessionLocal()
+    try:
+        results = db.query(models.TestResult).filter(models.TestResult.student_id == student_id).all()
+        streak = db.query(models.StudentStreak).filter(
+            models.StudentStreak.student_id == student_id
+        ).first()
+        earned = db.query(models.StudentBadge).filter(
+            models.StudentBadge.student_id == student_id
+        ).all()
+        all_badges = db.query(models.Badge).all()
+        
+        stats = badge_stats_from_rows(results, streak)
+        mastery = db.query(models.TopicMastery).filter(models.TopicMastery.student_id == student_id).all()
+        rank, xp, ranked_count = rank_index.rank(db, "all_time", student_id)
+        due = db.query(models.Flashcard).filter(
+            models.Flashcard.student_id == student_id,
+            models.Flashcard.next_review <= datetime.utcnow()
+        ).all()
+        
+        return {
+            "streak": {
+                "current_streak": streak.current_streak if streak else 0,
+                "longest_streak": streak.longest_streak if streak else 0,
+                "last_activity": streak.last_activity_date.isoformat() if streak and streak.last_activity_date else None,
+                "freeze_available": streak.freeze_available if streak else False
+            },
+            "badges": build_student_badges(all_badges, earned, stats),
+            "recommendations": build_review_recommendations(results, mastery),
+            "leaderboard": {
+                "entries": build_leaderboard(db, "all_time", 10),
+                "my_rank": {"rank": rank, "xp": xp, "total_ranked": ranked_count}
+            },
+            "flashcards_due": serializers.rows(serializers.flashcard_row, due)
+        }
+    finally:
+        db.close()
+
+@app.get("/api/students/{student_id}/bootstrap")
+async def get_session_bootstrap(student_id: int, known: str = ""):
+    """Everything the dashboard needs after profile selection, in one round-trip.
+
+    `known` is an optional comma-separated list of `section:etag` pairs the
+    client already holds; matching sections come back as null and are listed
+    under "unchanged".
+    """
+    def load_student():
+        db = SessionLocal()
+        try:
+            return db.query(models.Student).filter(models.Student.id == student_id).first()
+        finally:
+            db.close()
+    
+    student = await run_in_threadpool(load_student)
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    sections = await run_in_threadpool(load_dashboard_sections, student_id)
+    sections["greeting"] = generate_greeting(
+        GreetingRequest(name=student.name, grade=student.grade, student_id=student.id)
+    )
+    
+    known_etags = {}
+    for pair in known.split(","):
+        name, _, etag = pair.partition(":")
+        if etag:
+            known_etags[name.strip()] = etag.strip()
+    
+    payload = {
+        "student": {
+            "id": student.id, "name": student.name, "grade": student.grade, "avatar": student.avatar,
+            "xp": student.xp, "level": student.level, "is_public_profile": student.is_public_profile,
+            "has_pin": student.has_pin
+        },
+        "etags": {},
+        "unchanged": []
+    }
+    for name in BOOTSTRAP_SECTIONS:
+        etag = section_etag(sections[name])
+        payload["etags"][name] = etag
+        if known_etags.get(name) == etag:
+            payload[name] = None
+            payload["unchanged"].append(name)
+        else:
+            payload[name] = sections[name]
+    
+    return payload
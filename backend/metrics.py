@@ -0,0 +1,406 @@
+"""
+Prometheus metrics and per-request stage timing.
+
+GET /metrics serves the text exposition format, with no client library
+needed:
+
+- request counts and latency per route template
+- DB queries per request, and query latency
+- LLM, image and TTS calls by provider, model and prompt template, and tokens
+- cache lookups by cache and result (hit/miss)
+- event-loop lag and threadpool occupancy
+
+`span(stage)` times one stage of the current request (an LLM call, JSON
+parsing, image generation, TTS). Stages and DB time are also added to the
+response as a Server-Timing header, so the browser's network panel breaks
+one slow /api/lesson/content call down by stage.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+LOOP_SAMPLE_SECONDS = 0.5
+# Per-request detail kept for the slow-request log (see profiling.py)
+MAX_TRACE_STATEMENTS = 200
+MAX_TRACE_CALLS = 100
+
+
+# ==================== METRIC TYPES ====================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._samples(items)
+        return lines
+
+    def _samples(self, items):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register `fn()` to refresh gauges just before each scrape"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+request_seconds = registry.histogram("http_request_duration_seconds", "Time to the response headers", ("method", "route"))
+requests_in_progress = registry.gauge("http_requests_in_progress", "Requests being handled")
+request_queries = registry.histogram("http_request_db_queries", "DB queries per request", ("route",), COUNT_BUCKETS)
+db_queries_total = registry.counter("db_queries_total", "DB statements executed")
+db_query_seconds = registry.histogram("db_query_duration_seconds", "DB statement latency", buckets=QUERY_BUCKETS)
+provider_seconds = registry.histogram(
+    "provider_call_duration_seconds", "LLM, image and TTS calls", ("kind", "provider", "model", "template", "outcome")
+)
+provider_tokens = registry.counter(
+    "provider_tokens_total", "LLM tokens by direction (input/output)", ("provider", "model", "template", "direction")
+)
+cache_lookups = registry.counter("cache_lookups_total", "Cache lookups", ("cache", "result"))
+stage_seconds = registry.histogram("stage_duration_seconds", "Time in named stages of request handling", ("stage",))
+loop_lag = registry.gauge("event_loop_lag_seconds", "How late the last event-loop wakeup was")
+loop_lag_seconds = registry.histogram("event_loop_lag_duration_seconds", "Event-loop wakeup lateness", buckets=QUERY_BUCKETS)
+threadpool_busy = registry.gauge("threadpool_busy_threads", "Threads running sync endpoints and blocking calls")
+threadpool_size = registry.gauge("threadpool_max_threads", "Threadpool capacity")
+threadpool_waiting = registry.gauge("threadpool_waiting_tasks", "Calls waiting for a free thread")
+
+
+# ==================== REQUEST TRACES ====================
+
+class RequestTrace:
+    """Stage timings, SQL and provider calls for one request"""
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.start = time.perf_counter()
+        self.stages = {}  # stage -> [seconds, calls]
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.statements = {}  # SQL text -> [executions, seconds]
+        self.provider_calls = []
+        self._lock = threading.Lock()
+
+    def route(self) -> str:
+        """The matched route template (known once routing has run)"""
+        route = (self.scope or {}).get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_query(self, seconds: float, statement: str = None):
+        """Returns how many times this request has now run the statement"""
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+            entry = self.statements.get(statement)
+            if entry is None:
+                if len(self.statements) >= MAX_TRACE_STATEMENTS:
+                    return 1
+                entry = self.statements[statement] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            return entry[0]
+
+    def add_provider_call(self, call: dict):
+        with self._lock:
+            if len(self.provider_calls) < MAX_TRACE_CALLS:
+                self.provider_calls.append(call)
+
+    def details(self):
+        """Copies of (stages, statements, provider calls)"""
+        with self._lock:
+            stages = {stage: list(entry) for stage, entry in self.stages.items()}
+            statements = {sql: list(entry) for sql, entry in self.statements.items()}
+            return stages, statements, list(self.provider_calls)
+
+    def server_timing(self) -> str:
+        with self._lock:
+            parts = [f'db;dur={self.db_seconds * 1000:.1f};desc="{self.db_queries} queries"']
+            parts += [
+                f'{stage};dur={seconds * 1000:.1f}' + (f';desc="{calls} calls"' if calls > 1 else "")
+                for stage, (seconds, calls) in self.stages.items()
+            ]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace():
+    return _trace.get()
+
+
+def record_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage; it shows up in stage_duration_seconds and the request's Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def observe_provider(kind: str, provider: str, model: str, template: str, seconds: float,
+                     error=None, input_tokens: int = None, output_tokens: int = None):
+    provider_seconds.observe(seconds, kind=kind, provider=provider, model=model, template=template,
+                             outcome="error" if error else "ok")
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_provider_call({
+            "kind": kind, "provider": provider, "model": model, "template": template,
+            "ms": round(seconds * 1000, 1), "error": str(error) if error else None,
+            "input_tokens": input_tokens, "output_tokens": output_tokens,
+        })
+    if input_tokens:
+        provider_tokens.inc(input_tokens, provider=provider, model=model, template=template, direction="input")
+    if output_tokens:
+        provider_tokens.inc(output_tokens, provider=provider, model=model, template=template, direction="output")
+
+
+def cache_lookup(cache: str, hit: bool):
+    cache_lookups.inc(cache=cache, result="hit" if hit else "miss")
+
+
+_request_listeners = []
+
+
+def on_request_finished(fn):
+    """Register `fn(trace, method, path, status, seconds)`, called after every response"""
+    _request_listeners.append(fn)
+    return fn
+
+
+# ==================== DATABASE ====================
+
+def instrument_engine(engine):
+    """Count and time every statement, attributing it to the current request"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries_total.inc()
+        db_query_seconds.observe(seconds)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add_query(seconds, statement)
+
+
+# ==================== EVENT LOOP AND THREADPOOL ====================
+
+class LoopMonitor:
+    """Samples event-loop lag and threadpool use from a task on the server's loop"""
+
+    def __init__(self, interval: float = LOOP_SAMPLE_SECONDS):
+        self.interval = interval
+        self._task = None
+
+    def ensure_started(self):
+        """Called from the middleware, i.e. on the running loop; starts the sampler once"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        import anyio.to_thread
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            loop_lag.set(lag)
+            loop_lag_seconds.observe(lag)
+            limiter = anyio.to_thread.current_default_thread_limiter()
+            threadpool_busy.set(limiter.borrowed_tokens)
+            threadpool_size.set(limiter.total_tokens)
+            threadpool_waiting.set(limiter.statistics().tasks_waiting)
+
+
+loop_monitor = LoopMonitor()
+
+
+# ==================== MIDDLEWARE ====================
+
+class MetricsMiddleware:
+    """Per-route request metrics and the Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        loop_monitor.ensure_started()
+
+        trace = RequestTrace(scope)
+        token = _trace.set(trace)
+        status = None
+        requests_in_progress.inc()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                request_seconds.observe(time.perf_counter() - trace.start, method=scope["method"], route=trace.route())
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", trace.server_timing().encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            requests_in_progress.dec()
+            route = trace.route()
+            if status is None:  # unhandled error; the 500 is sent further out
+                status = 500
+                request_seconds.observe(time.perf_counter() - trace.start, method=scope["method"], route=route)
+            elif status == 304 and route == "unmatched":
+                route = "conditional_get"  # answered from the ETag before routing
+            requests_total.inc(method=scope["method"], route=route, status=status)
+            request_queries.observe(trace.db_queries, route=route)
+            _trace.reset(token)
+            seconds = time.perf_counter() - trace.start
+            for listener in _request_listeners:
+                try:
+                    listener(trace, scope["method"], scope["path"], status, seconds)
+                except Exception as e:
+                    print(f"Error in request listener: {e}")
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Date, ForeignKey, Float, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Date, ForeignKey, Float, JSON, Index, UniqueConstraint, text
 from database import Base
 import datetime
 
@@ -102,3 +102,246 @@ class StudentStreak(Base):
     longest_streak = Column(Integer, default=0)
     last_activity_date = Column(Date)
     freeze_available = Column(Boolean, default=False)
+
+# Leaderboard Models
+
+class XPEvent(Base):
+    __tablename__ = "xp_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False, index=True)
+    amount = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class XPRollup(Base):
+    __tablename__ = "xp_rollups"
+    __table_args__ = (
+        UniqueConstraint("student_id", "bucket", "bucket_start"),
+        Index("ix_xp_rollups_bucket_start", "bucket", "bucket_start"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    bucket = Column(String, nullable=False)  # "day" or "week"
+    bucket_start = Column(Date, nullable=False)
+    xp = Column(Integer, default=0)
+
+# Analytics Models
+
+class DailyActivity(Base):
+    """Per (student, subject, day) rollup maintained incrementally for analytics"""
+    __tablename__ = "analytics_daily"
+    __table_args__ = (
+        UniqueConstraint("student_id", "subject", "day"),
+        Index("ix_analytics_daily_day", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    subject = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    quizzes = Column(Integer, default=0)
+    questions = Column(Integer, default=0)
+    correct = Column(Integer, default=0)
+    lessons = Column(Integer, default=0)
+    active_seconds = Column(Integer, default=0)
+
+# Chat Models
+
+class LessonContext(Base):
+    """Lesson text the chat has seen, stored once by content hash with its summary"""
+    __tablename__ = "lesson_contexts"
+
+    content_hash = Column(String, primary_key=True, index=True)
+    content = Column(String)
+    summary = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ChatTurn(Base):
+    __tablename__ = "chat_turns"
+    __table_args__ = (
+        Index("ix_chat_turns_session", "student_id", "lesson_key", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    lesson_key = Column(String, nullable=False)
+    role = Column(String, nullable=False)  # "student" or "tutor"
+    content = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class LessonChunk(Base):
+    """Paragraph-sized piece of a lesson log, indexed for chat retrieval"""
+    __tablename__ = "lesson_chunks"
+    __table_args__ = (
+        Index("ix_lesson_chunks_student", "student_id", "id"),
+        # One row per chunk position, even if two loads backfill the same log at once
+        Index("uq_lesson_chunks_position", "lesson_log_id", "position", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    lesson_log_id = Column(Integer, ForeignKey("lesson_logs.id"), nullable=False, index=True)
+    subject = Column(String)
+    topic = Column(String)
+    position = Column(Integer, default=0)
+    content = Column(String)
+
+# Greeting Models
+
+class GreetingVariant(Base):
+    """Pre-generated greeting with {name}/{grade} placeholders, per grade band"""
+    __tablename__ = "greeting_variants"
+    __table_args__ = (
+        UniqueConstraint("band", "text", name="uq_greeting_band_text"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    band = Column(String, nullable=False, index=True)
+    text = Column(String, nullable=False)
+    source = Column(String, default="llm")  # "seed" or "llm"
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Twi Models
+
+class TwiEntry(Base):
+    """English word or phrase with its Asante Twi translation"""
+    __tablename__ = "twi_lexicon"
+
+    id = Column(Integer, primary_key=True, index=True)
+    english_norm = Column(String, nullable=False, unique=True, index=True)
+    english = Column(String, nullable=False)
+    twi = Column(String, nullable=False)
+    pronunciation = Column(String, nullable=True)
+    example = Column(String, nullable=True)
+    notes = Column(String, nullable=True)
+    source = Column(String, default="llm")  # "seed" or "llm"
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class TwiDeck(Base):
+    """Stored vocabulary list for a topic"""
+    __tablename__ = "twi_vocab_decks"
+
+    topic_norm = Column(String, primary_key=True, index=True)
+    topic = Column(String)
+    vocab = Column(JSON)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Question Bank Models
+
+class QuizQuestion(Base):
+    """One multiple-choice question, reusable across quizzes for its topic and grade"""
+    __tablename__ = "quiz_questions"
+    __table_args__ = (
+        Index("ix_quiz_questions_topic", "topic_key", "grade"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, nullable=False, unique=True)
+    topic_key = Column(String, nullable=False)  # normalized "subject|topic"
+    subject = Column(String)
+    topic = Column(String)
+    grade = Column(Integer)
+    question = Column(String, nullable=False)
+    options = Column(JSON)
+    correct = Column(String, nullable=False)
+    explanation = Column(String, nullable=True)
+    difficulty = Column(Float, nullable=True)  # measured from answers; null until calibrated
+    times_served = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class QuestionExposure(Base):
+    """A question shown to a student, so quizzes avoid recent repeats"""
+    __tablename__ = "question_exposures"
+    __table_args__ = (
+        Index("ix_question_exposures_student", "student_id", "question_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    question_id = Column(Integer, ForeignKey("quiz_questions.id"), nullable=False)
+    served_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Answer Calibration Models
+
+class AnswerEvent(Base):
+    """One answered quiz question, logged at quiz submit"""
+    __tablename__ = "answer_events"
+    __table_args__ = (
+        Index("ix_answer_events_student", "student_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    test_result_id = Column(Integer, ForeignKey("test_results.id"), nullable=True)
+    question_id = Column(Integer, ForeignKey("quiz_questions.id"), nullable=True)
+    question_hash = Column(String, nullable=False, index=True)
+    topic_key = Column(String)
+    subject = Column(String)
+    topic = Column(String)
+    chosen = Column(String, nullable=True)
+    correct = Column(Boolean, nullable=False)
+    latency_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class StudentAbility(Base):
+    """Calibrated ability (logit scale, same as question difficulty)"""
+    __tablename__ = "student_abilities"
+
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    ability = Column(Float, default=0.0)
+    answers = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class TopicMastery(Base):
+    """Predicted chance a student answers a typical question of a topic correctly"""
+    __tablename__ = "topic_mastery"
+
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    topic_key = Column(String, primary_key=True)
+    subject = Column(String)
+    topic = Column(String)
+    mastery = Column(Float)
+    answers = Column(Integer, default=0)
+    correct = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Background Job Models
+
+class Job(Base):
+    """A unit of slow work (generation, images, audio) run by the in-process job queue"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_claim", "pool", "status", "priority", "id"),
+        # At most one queued or running job per dedupe key, even for concurrent enqueues
+        Index("ix_jobs_active_dedupe", "dedupe_key", unique=True,
+              sqlite_where=text("status IN ('queued', 'running')")),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    pool = Column(String, nullable=False)
+    dedupe_key = Column(String, nullable=False, index=True)
+    priority = Column(Integer, default=5)  # lower runs first
+    status = Column(String, default="queued")  # queued, running, succeeded, failed
+    payload = Column(JSON)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    progress = Column(Float, default=0.0)
+    progress_message = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+# Text-to-Speech Models
+
+class TTSUsage(Base):
+    """Characters synthesized per provider per day (cache hits are free and not counted)"""
+    __tablename__ = "tts_usage"
+
+    provider = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    characters = Column(Integer, default=0)
@@ -0,0 +1,297 @@
+"""
+Two-host lesson podcasts.
+
+A LessonLog becomes a dialogue script (Professor Hoot and co-host Ama) via
+the LLM, every line is synthesized in parallel through the TTS service,
+whose audio cache makes re-renders of unchanged lines free, and the
+segments are joined into one MP3. A whole episode is recorded by one
+provider: the script's characters are reserved from the ElevenLabs budget
+up front, and if that fails (or ElevenLabs errors mid-episode) the episode
+is recorded again with each host's Edge voice, so hosts never swap voices
+and the MP3 never mixes sample rates. Joining strips each segment's ID3 tags
+and Xing/Info frame, then writes a single Xing header with a seek table
+so players can seek accurately. Segment durations come from the MP3 frame
+headers and give each chapter and line its start time.
+
+Runs as a "podcast" job; see the job handler in main.py.
+"""
+
+import asyncio
+import json
+import os
+import struct
+
+import prompts
+from tts import tts_service, clean_text, BudgetExceeded
+
+TARGET_LINES = 40  # about five minutes of speech
+MAX_LINES = 120
+MAX_LINE_CHARS = 400
+MAX_LESSON_CHARS = 6000
+CONCURRENCY = int(os.getenv("PODCAST_TTS_CONCURRENCY", "6"))
+
+ELEVENLABS_VOICES = {"A": "EXAVITQu4vr4xnSDxMaL", "B": "FGY2WhTYpPnrIDTdsKH5"}  # Sarah, Laura
+EDGE_VOICES = {"A": "en-US-GuyNeural", "B": "en-US-AnaNeural"}
+SPEAKER_NAMES = {"A": "Professor Hoot", "B": "Ama"}
+
+
+# ==================== SCRIPT ====================
+
+def script_prompt(subject: str, topic: str, grade: int, lesson: str, lines: int = TARGET_LINES):
+    return prompts.render("podcast_script", grade=grade, subject=subject, topic=topic,
+                          lines=lines, lesson=lesson[:MAX_LESSON_CHARS])
+
+
+def validate_script(data):
+    """{'title', 'chapters': [{'title', 'lines': [{'speaker', 'text'}]}]} from LLM output, or None"""
+    if isinstance(data, list):
+        data = {"chapters": data}
+    if not isinstance(data, dict):
+        return None
+    chapters = data.get("chapters")
+    if chapters is None and isinstance(data.get("lines"), list):
+        chapters = [{"title": data.get("title") or "Episode", "lines": data["lines"]}]
+    valid = []
+    total = 0
+    for number, chapter in enumerate(chapters if isinstance(chapters, list) else [], start=1):
+        if not isinstance(chapter, dict):
+            continue
+        lines = []
+        for line in chapter.get("lines") or []:
+            if not isinstance(line, dict) or total >= MAX_LINES:
+                continue
+            speaker = str(line.get("speaker", "")).strip().upper()[:1]
+            text = line.get("text")
+            # Judge the text as TTS will see it: a line of only emoji or markdown says nothing
+            text = clean_text(text)[:MAX_LINE_CHARS] if isinstance(text, str) else ""
+            if speaker not in SPEAKER_NAMES or not text:
+                continue
+            lines.append({"speaker": speaker, "text": text})
+            total += 1
+        if lines:
+            title = chapter.get("title")
+            valid.append({"title": title.strip() if isinstance(title, str) and title.strip() else f"Part {number}",
+                          "lines": lines})
+    if not valid:
+        return None
+    title = data.get("title")
+    return {"title": title.strip() if isinstance(title, str) and title.strip() else "Lesson Podcast", "chapters": valid}
+
+
+# ==================== MP3 ====================
+
+_BITRATES = {  # Layer III, kbps by bitrate index
+    "1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _parse_header(data: bytes, pos: int):
+    """(frame length, samples, sample rate, version, mono) for a Layer III frame at pos, or None"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 0x03
+    layer = (data[pos + 1] >> 1) & 0x03
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    padding = (data[pos + 2] >> 1) & 0x01
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    bitrate = _BITRATES["1" if version == 3 else "2"][bitrate_index] * 1000
+    samples = 1152 if version == 3 else 576
+    length = (samples // 8) * bitrate // sample_rate + padding
+    mono = (data[pos + 3] >> 6) == 3
+    return length, samples, sample_rate, version, mono
+
+
+def _side_info_size(version: int, mono: bool) -> int:
+    if version == 3:
+        return 17 if mono else 32
+    return 9 if mono else 17
+
+
+def strip_tags(data: bytes) -> bytes:
+    """Drop ID3v2 (leading) and ID3v1 (trailing) tags"""
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer:]
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+    return data
+
+
+def audio_frames(data: bytes):
+    """(offset, length, seconds, header) for each audio frame, skipping junk and Xing/Info frames"""
+    pos = 0
+    while pos < len(data):
+        header = _parse_header(data, pos)
+        if header is None or pos + header[0] > len(data):
+            pos += 1
+            continue
+        length, samples, sample_rate, version, mono = header
+        tag_at = pos + 4 + _side_info_size(version, mono)
+        if data[tag_at:tag_at + 4] not in (b"Xing", b"Info"):
+            yield pos, length, samples / sample_rate, header
+        pos += length
+
+
+def _xing_frame(first_frame: bytes, header, frame_count: int, audio_bytes: int, frame_times, frame_offsets, duration):
+    """A silent first frame carrying frame/byte counts and a 100-point seek table"""
+    _, _, sample_rate, version, mono = header
+    tag_at = 4 + _side_info_size(version, mono)
+    needed = tag_at + 4 + 4 + 4 + 4 + 100
+    bitrates = _BITRATES["1" if version == 3 else "2"]
+    samples = 1152 if version == 3 else 576
+    for bitrate_index in range(1, 15):
+        length = (samples // 8) * bitrates[bitrate_index] * 1000 // sample_rate
+        if length >= needed:
+            break
+    frame = bytearray(length)
+    frame[0] = 0xFF
+    frame[1] = (first_frame[1] & 0xFE) | 0x01  # keep version/layer, no CRC
+    frame[2] = (bitrate_index << 4) | (first_frame[2] & 0x0C)  # same sample rate, no padding
+    frame[3] = first_frame[3]
+    total_bytes = audio_bytes + length
+
+    toc = bytearray(100)
+    j = 0
+    for i in range(100):
+        target = duration * i / 100
+        while j + 1 < len(frame_times) and frame_times[j + 1] <= target:
+            j += 1
+        position = (length + frame_offsets[j]) if frame_offsets else 0
+        toc[i] = min(255, position * 256 // total_bytes)
+    frame[tag_at:tag_at + 16] = b"Xing" + struct.pack(">III", 0x07, frame_count, total_bytes)
+    frame[tag_at + 16:tag_at + 116] = toc
+    return bytes(frame)
+
+
+def concatenate(segments):
+    """Join MP3 segments into one seekable file; returns (mp3 bytes, duration of each segment)"""
+    body = bytearray()
+    durations = []
+    frame_times, frame_offsets = [], []
+    elapsed = 0.0
+    first = None
+    for segment in segments:
+        data = strip_tags(segment)
+        seconds = 0.0
+        for offset, length, frame_seconds, header in audio_frames(data):
+            if first is None:
+                first = (data[offset:offset + 4], header)
+            elif header[2:] != first[1][2:]:
+                # One Xing header can't describe frames of another sample rate or channel layout
+                raise ValueError("Podcast segments have mixed MP3 formats")
+            frame_times.append(elapsed)
+            frame_offsets.append(len(body))
+            body += data[offset:offset + length]
+            seconds += frame_seconds
+            elapsed += frame_seconds
+        durations.append(seconds)
+    if first is None:
+        return bytes(body), durations
+    xing = _xing_frame(first[0], first[1], len(frame_times), len(body), frame_times, frame_offsets, elapsed)
+    return xing + bytes(body), durations
+
+
+# ==================== RENDERING ====================
+
+async def synthesize_lines(lines, voices, on_done=None, spent=None):
+    """MP3 bytes for each line, synthesized concurrently (cached lines return immediately).
+
+    No per-line budget checks or Edge fallback: the caller reserved the
+    characters and picks the provider for the whole episode. Synthesized
+    (uncached) characters are added to `spent[0]`.
+    """
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    finished = 0
+
+    async def one(line):
+        nonlocal finished
+        async with semaphore:
+            speech = await tts_service.stream(line["text"], voices[line["speaker"]], fallback=False, budgeted=False)
+            if spent is not None and not speech.cached:
+                spent[0] += len(clean_text(line["text"]))
+            audio = b"".join([chunk async for chunk in speech.chunks])
+        finished += 1
+        if on_done:
+            on_done(finished, len(lines))
+        return audio
+
+    return await asyncio.gather(*(one(line) for line in lines))
+
+
+def record(lines, voices, on_done=None):
+    """Segments for every line with one provider's voices, or None to retry with Edge.
+
+    Raises if Edge itself is over budget or fails.
+    """
+    provider, _ = tts_service.route(voices["A"])
+    reserved = tts_service.pending_characters((line["text"], voices[line["speaker"]]) for line in lines)
+    if not tts_service.budget.reserve(provider.name, reserved):
+        if provider is tts_service.edge:
+            raise BudgetExceeded("Today's speech budget can't cover this podcast. Please try again tomorrow.")
+        print(f"Podcast needs {reserved} characters, more than the {provider.name} budget has left; using Edge voices")
+        return None
+    spent = [0]
+    try:
+        return asyncio.run(synthesize_lines(lines, voices, on_done, spent))
+    except Exception as e:
+        if provider is tts_service.edge:
+            raise
+        print(f"Error from {provider.name} TTS mid-podcast, recording again with Edge voices: {e}")
+        return None
+    finally:
+        # Duplicate lines and lines cached meanwhile cost less than reserved
+        if reserved > spent[0]:
+            tts_service.budget.refund(provider.name, reserved - spent[0])
+
+
+def render(script, progress=None):
+    """Synthesize and join a validated script. Returns (mp3 bytes, chapter index, duration)."""
+    lines = [line for chapter in script["chapters"] for line in chapter["lines"]]
+
+    def on_done(done, total):
+        if progress:
+            progress(0.1 + 0.8 * done / total, f"Recording line {done} of {total}")
+
+    segments = None
+    if tts_service.elevenlabs.configured():
+        segments = record(lines, ELEVENLABS_VOICES, on_done)
+    if segments is None:
+        segments = record(lines, EDGE_VOICES, on_done)
+    if progress:
+        progress(0.95, "Mixing the episode")
+    mp3, durations = concatenate(segments)
+
+    chapters = []
+    elapsed = 0.0
+    index = 0
+    for chapter in script["chapters"]:
+        entry = {"title": chapter["title"], "start_seconds": round(elapsed, 2), "lines": []}
+        for line in chapter["lines"]:
+            entry["lines"].append({
+                "speaker": SPEAKER_NAMES[line["speaker"]], "text": line["text"], "start_seconds": round(elapsed, 2)
+            })
+            elapsed += durations[index]
+            index += 1
+        chapters.append(entry)
+    return mp3, chapters, round(elapsed, 2)
+
+
+def build_episode(log, grade: int, generate, progress=None):
+    """Script, audio and chapter index for a LessonLog.
+
+    `generate(prompt) -> str` returns the raw JSON text from the model.
+    Returns (mp3 bytes, metadata dict).
+    """
+    if progress:
+        progress(0.02, "Writing the script")
+    script = validate_script(json.loads(generate(script_prompt(log.subject, log.topic, grade, log.content or ""))))
+    if script is None:
+        raise ValueError("The podcast script came back malformed")
+    mp3, chapters, duration = render(script, progress)
+    return mp3, {"title": script["title"], "duration_seconds": duration, "chapters": chapters}
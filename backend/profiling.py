@@ -0,0 +1,264 @@
+"""
+On-demand profiling, slow-request capture and N+1 query detection.
+
+- SamplingProfiler reads every thread's stack (sys._current_frames) at a
+  fixed interval while it runs and returns folded stacks, one
+  "thread;outer;...;inner count" line per distinct stack, which
+  flamegraph.pl, speedscope and inferno all read. The event loop runs on
+  MainThread, so a handler blocking the loop shows up there.
+- SlowRequestLog keeps requests slower than SLOW_REQUEST_SECONDS with their
+  stages, SQL statements (grouped, with counts and time) and provider
+  calls, in memory and optionally as JSONL at SLOW_REQUEST_LOG_PATH.
+- NPlusOneDetector watches statements as they execute. A SELECT that one
+  request runs N_PLUS_ONE_THRESHOLD times is flagged with the app code
+  that issued it, which is usually a query inside a loop over rows.
+
+The admin endpoints in main.py expose all three.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+
+from sqlalchemy import event
+
+import metrics
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "2"))
+SLOW_REQUEST_LOG_PATH = os.getenv("SLOW_REQUEST_LOG_PATH")  # optional JSONL file
+SLOW_REQUEST_KEEP = 50
+SLOW_REQUEST_STATEMENTS = 20
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+PROFILE_INTERVAL_MS = 5.0
+PROFILE_MAX_SECONDS = 300.0
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Leaf frames of threads that are parked, not working. Only Python-level waits
+# are recognised: a thread blocked inside a C call such as time.sleep shows its
+# calling frame and counts as busy, so background loops wait on Events instead.
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+n_plus_one_total = metrics.registry.counter(
+    "db_n_plus_one_total", "Requests that repeated one SELECT past the N+1 threshold", ("route",)
+)
+
+
+# ==================== SAMPLING PROFILER ====================
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._labels = {}
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = PROFILE_INTERVAL_MS / 1000
+        self.include_idle = False
+        self.started_at = None
+        self.stopped_at = None
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float = PROFILE_INTERVAL_MS, seconds: float = 30.0, include_idle: bool = False) -> bool:
+        """Start sampling for at most `seconds`; False if a profile is already running"""
+        with self._lock:
+            if self.running():
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = max(1.0, interval_ms) / 1000
+            self.include_idle = include_idle
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+            deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+            self._thread = threading.Thread(target=self._run, args=(deadline,), name="profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling (if running) and return the folded stacks"""
+        thread = self._thread
+        self._stop.set()
+        if thread is not None:
+            thread.join()
+        return self.folded()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+            self._labels[code] = label
+        return label
+
+    def _run(self, deadline):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                leaf = codes[0]
+                if not self.include_idle and (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = ";".join([names.get(ident, str(ident))] + [self._label(code) for code in reversed(codes)])
+                self.stacks[stack] += 1
+            self.samples += 1
+        self.stopped_at = time.time()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def status(self):
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running(),
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            "seconds": round(end - self.started_at, 1) if self.started_at else 0,
+            "interval_ms": self.interval * 1000,
+            "include_idle": self.include_idle,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+        }
+
+
+profiler = SamplingProfiler()
+
+
+# ==================== SLOW REQUESTS ====================
+
+class SlowRequestLog:
+    def __init__(self, threshold: float = SLOW_REQUEST_SECONDS, keep: int = SLOW_REQUEST_KEEP,
+                 log_path: str = SLOW_REQUEST_LOG_PATH):
+        self.threshold = threshold
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=keep)
+
+    def record(self, trace, method: str, path: str, status: int, seconds: float):
+        if seconds < self.threshold:
+            return
+        stages, statements, calls = trace.details()
+        statements = sorted(statements.items(), key=lambda item: item[1][1], reverse=True)
+        entry = {
+            "at": datetime.utcnow().isoformat(),
+            "method": method,
+            "path": path,
+            "route": trace.route(),
+            "status": status,
+            "duration_ms": round(seconds * 1000, 1),
+            "db_queries": trace.db_queries,
+            "db_ms": round(trace.db_seconds * 1000, 1),
+            "stages": {stage: round(total * 1000, 1) for stage, (total, _) in stages.items()},
+            "statements": [
+                {"sql": " ".join(sql.split())[:500], "count": count, "ms": round(total * 1000, 1)}
+                for sql, (count, total) in statements[:SLOW_REQUEST_STATEMENTS]
+            ],
+            "provider_calls": calls,
+        }
+        with self._lock:
+            self._entries.append(entry)
+        print(f"Slow request: {method} {path} took {entry['duration_ms']:.0f} ms "
+              f"({trace.db_queries} queries, {len(calls)} provider calls)")
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                print(f"Error writing slow request log: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_requests = SlowRequestLog()
+
+
+# ==================== N+1 QUERIES ====================
+
+def _issuing_code():
+    """'file:line in function' for the innermost app frame (outside SQLAlchemy and this module)"""
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(APP_DIR) and os.path.basename(frame.filename) not in ("profiling.py", "metrics.py"):
+            return f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+    return None
+
+
+class NPlusOneDetector:
+    def __init__(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._findings = {}  # (route, statement) -> finding
+
+    def instrument(self, engine):
+        """Listen after metrics.instrument_engine, which counts statements per request"""
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            trace = metrics.current_trace()
+            if trace is None or executemany or not statement.lstrip().upper().startswith("SELECT"):
+                return
+            entry = trace.statements.get(statement)
+            if entry is not None and entry[0] == self.threshold:
+                self._flag(trace.route(), statement, _issuing_code())
+
+    def _flag(self, route, statement, location):
+        key = (route, statement)
+        with self._lock:
+            finding = self._findings.get(key)
+            first = finding is None
+            if first:
+                finding = self._findings[key] = {
+                    "route": route, "sql": " ".join(statement.split())[:500], "location": location,
+                    "requests": 0, "max_executions": 0, "last_seen": None,
+                }
+            finding["requests"] += 1
+            finding["last_seen"] = datetime.utcnow().isoformat()
+        n_plus_one_total.inc(route=route)
+        if first:
+            print(f"Possible N+1 query in {route} at {location}: {finding['sql'][:120]}")
+
+    def record(self, trace, method, path, status, seconds):
+        """Once the request is over, note how many times each flagged statement ran"""
+        route = trace.route()
+        with self._lock:
+            for statement, (count, _) in trace.details()[1].items():
+                finding = self._findings.get((route, statement))
+                if finding is not None and count > finding["max_executions"]:
+                    finding["max_executions"] = count
+
+    def snapshot(self):
+        with self._lock:
+            return sorted((dict(f) for f in self._findings.values()), key=lambda f: -f["requests"])
+
+    def reset(self):
+        with self._lock:
+            self._findings.clear()
+
+
+n_plus_one = NPlusOneDetector()
+
+metrics.on_request_finished(slow_requests.record)
+metrics.on_request_finished(n_plus_one.record)
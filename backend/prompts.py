@@ -0,0 +1,373 @@
+"""
+Prompt template registry and per-call LLM accounting.
+
+Every prompt the API sends is a named, versioned template here, optionally
+with grade-band variants (e.g. a simpler greeting for K-2). Templates are
+parsed once at import; render() fills them in and returns a Prompt (a str
+that remembers which template produced it), so app_generate_content can
+attribute input/output tokens and latency to the template.
+
+Change a template's text by registering it again with a higher version;
+stats are kept per name@version, so a regression in cost or latency shows
+up side by side with the previous version.
+"""
+
+import json
+import os
+import string
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import metrics
+
+DEFAULT_BAND = "default"
+# (band, lowest grade, highest grade); grades outside every band use "default"
+GRADE_BANDS = (
+    ("early", 0, 2),
+    ("primary", 3, 6),
+    ("secondary", 7, 12),
+)
+LATENCY_SAMPLES = 500
+PROMPT_LOG_PATH = os.getenv("PROMPT_LOG_PATH")  # optional JSONL file, one line per LLM call
+
+
+def grade_band(grade) -> str:
+    if grade is None:
+        return DEFAULT_BAND
+    for band, low, high in GRADE_BANDS:
+        if low <= grade <= high:
+            return band
+    return DEFAULT_BAND
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English)"""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class Prompt(str):
+    """Rendered prompt text tagged with the template and values it came from"""
+    template = None
+    values = None
+
+
+@dataclass
+class PromptTemplate:
+    name: str
+    version: int
+    text: str
+    band: str = DEFAULT_BAND
+    parts: list = field(init=False, repr=False)
+    fields: tuple = field(init=False)
+    static_tokens: int = field(init=False)
+
+    def __post_init__(self):
+        # Precompile: split once into literal text and field names
+        self.parts = [(literal, name) for literal, name, _, _ in string.Formatter().parse(self.text)]
+        self.fields = tuple(sorted({name for _, name in self.parts if name}))
+        self.static_tokens = estimate_tokens("".join(literal for literal, _ in self.parts))
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, /, **values) -> Prompt:
+        missing = [name for name in self.fields if name not in values]
+        if missing:
+            raise KeyError(f"Prompt '{self.key}' is missing values for: {', '.join(missing)}")
+        prompt = Prompt("".join(
+            literal + (str(values[name]) if name else "") for literal, name in self.parts
+        ))
+        prompt.template = self
+        prompt.values = values
+        return prompt
+
+    def estimate(self, /, **values) -> int:
+        """Estimated input tokens without rendering"""
+        return self.static_tokens + sum(estimate_tokens(str(values.get(name, ""))) for name in self.fields)
+
+
+_registry = {}
+
+
+def register(name: str, version: int, text: str, band: str = DEFAULT_BAND) -> PromptTemplate:
+    template = PromptTemplate(name, version, text, band)
+    _registry.setdefault(name, {})[(version, band)] = template
+    return template
+
+
+def get(name: str, grade=None, version: int = None) -> PromptTemplate:
+    """Latest (or the given) version of a template, in the grade's band if it has one"""
+    variants = _registry.get(name)
+    if not variants:
+        raise KeyError(f"Unknown prompt template '{name}'")
+    if version is None:
+        version = max(v for v, _ in variants)
+    template = variants.get((version, grade_band(grade))) or variants.get((version, DEFAULT_BAND))
+    if template is None:
+        raise KeyError(f"Prompt template '{name}' has no version {version}")
+    return template
+
+
+def render(template_name: str, /, grade=None, version: int = None, **values) -> Prompt:
+    if grade is not None:
+        values.setdefault("grade", grade)
+    return get(template_name, grade, version).render(**values)
+
+
+def templates():
+    return [
+        {"name": t.name, "version": t.version, "band": t.band, "fields": list(t.fields), "static_tokens": t.static_tokens}
+        for variants in _registry.values() for t in variants.values()
+    ]
+
+
+# ==================== ACCOUNTING ====================
+
+def usage_from_response(response):
+    """(input_tokens, output_tokens) reported by the provider, or (None, None)"""
+    usage = getattr(response, "usage_metadata", None)  # Gemini
+    if usage is not None:
+        return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+    usage = getattr(response, "usage", None)  # OpenAI-compatible
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    return None, None
+
+
+class _TemplateStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.estimated_calls = 0
+        self.latency_total = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.models = set()
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "avg_input_tokens": round(self.input_tokens / self.calls, 1) if self.calls else 0,
+            "avg_output_tokens": round(self.output_tokens / self.calls, 1) if self.calls else 0,
+            "estimated_calls": self.estimated_calls,
+            "avg_latency_ms": round(self.latency_total / self.calls * 1000, 1) if self.calls else None,
+            "p50_latency_ms": pct(0.5),
+            "p95_latency_ms": pct(0.95),
+            "models": sorted(self.models),
+        }
+
+
+class PromptStats:
+    """Per-template call counts, tokens and latency"""
+
+    def __init__(self, log_path: str = PROMPT_LOG_PATH):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.log_path = log_path
+
+    def record(self, prompt, response, provider: str, model: str, seconds: float, error: Exception = None):
+        template = getattr(prompt, "template", None)
+        key = template.key if template else "adhoc"
+        input_tokens, output_tokens = usage_from_response(response) if response is not None else (None, None)
+        estimated = input_tokens is None or output_tokens is None
+        if input_tokens is None:
+            input_tokens = estimate_tokens(prompt)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(getattr(response, "text", None) or "") if response is not None else 0
+
+        with self._lock:
+            stats = self._stats.setdefault(key, _TemplateStats())
+            stats.calls += 1
+            stats.errors += 1 if error else 0
+            stats.input_tokens += input_tokens
+            stats.output_tokens += output_tokens
+            stats.estimated_calls += 1 if estimated else 0
+            stats.latency_total += seconds
+            stats.latencies.append(seconds)
+            stats.models.add(f"{provider}:{model}")
+        metrics.observe_provider("llm", provider, model, key, seconds, error, input_tokens, output_tokens)
+
+        if self.log_path:
+            line = {
+                "ts": time.time(), "template": key, "provider": provider, "model": model,
+                "input_tokens": input_tokens, "output_tokens": output_tokens, "estimated": estimated,
+                "latency_ms": round(seconds * 1000, 1), "error": str(error) if error else None,
+            }
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(line) + "\n")
+            except OSError as e:
+                print(f"Error writing prompt log: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            return {key: stats.snapshot() for key, stats in sorted(self._stats.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+prompt_stats = PromptStats()
+
+
+# ==================== TEMPLATES ====================
+
+register("greeting", 1, "You are Professor Hoot, a wise and magical owl tutor. Enthusiastically say hello to {name}, a Grade {grade} student, and ask if they are ready for a fun learning adventure! Use an emoji and keep it to one short sentence.", band="early")
+register("greeting", 1, "You are Professor Hoot, a wise and magical owl tutor. Enthusiastically greet {name}, a Grade {grade} student. Be encouraging, keep it to one short sentence, and use an emoji.")
+
+register("greeting_batch", 1, """
+    You are Professor Hoot, a wise and magical owl tutor. Write {count} different greetings for a child in Grade {grade} who just opened the learning app.
+    Each greeting is one short, enthusiastic sentence that asks if they are ready for a fun learning adventure, with one emoji.
+    Write {{name}} where the child's name goes. Do not use any other placeholders or curly braces.
+    Return ONLY valid JSON: {{ "greetings": ["Hoot hoot, {{name}}! Ready for a fun learning adventure? 🦉", ...] }}
+    """, band="early")
+register("greeting_batch", 1, """
+    You are Professor Hoot, a wise and magical owl tutor. Write {count} different greetings for a Grade {grade} student who just opened the learning app.
+    Each greeting is one short, encouraging sentence with one emoji. Vary the wording, tone and emoji.
+    Write {{name}} where the student's name goes. Do not use any other placeholders or curly braces.
+    Return ONLY valid JSON: {{ "greetings": ["Welcome back, {{name}}! Let's learn something amazing today 🌟", ...] }}
+    """)
+
+register("lesson_summary", 1, """
+    Summarize this lesson for a tutor who will answer a student's questions about it.
+    Use at most {words} words. Keep key terms, facts and examples. No preamble.
+
+    Lesson:
+    {text}
+    """)
+
+register("chat", 1, """You are a friendly, encouraging tutor named "Professor Hoot" helping a Grade {grade} student.
+
+    Current Lesson Context:
+    {lesson}
+    {history}
+    Student Question:
+    {message}
+
+    Instructions:
+    1. Answer the question simply and clearly, using language appropriate for a Grade {grade} student.
+    2. Be encouraging and positive. Use emojis occasionally.
+    3. If the question is about the lesson or an earlier lesson, use the context provided.
+    4. If the question is off-topic, gently guide them back to learning.
+    5. Keep your answer concise (under 3 sentences unless a detailed explanation is needed).
+    """)
+
+register("lesson_plan", 1, """
+    Create a short lesson plan with 3 to 5 distinct sub-topics for teaching '{topic}' in '{subject}' to a Grade {grade} student.
+    Return ONLY valid JSON with a key 'plan' containing a list of strings (the sub-topic titles).
+    Example: {{ "plan": ["What is a Volcano?", "Types of Volcanoes", "Why do they Erupt?"] }}
+    """)
+
+register("lesson_content", 1, """
+    You are Professor Hoot, an engaging and magical tutor for a Grade {grade} student.
+    Subject: {subject}
+    Main Topic: {topic}
+    Current Sub-topic: {subtopic}
+
+    Write a clear, exciting, and age-appropriate explanation for this specific sub-topic.
+    Crucially, you MUST format your response beautifully using Markdown! Use **bolding** for important key words, create bulleted lists for clarity, and sprinkle in relevant emojis to make it visually engaging and less intimidating for a kid.
+    Use fun analogies if helpful. Keep it focused on '{subtopic}'.
+    """)
+
+register("lesson_image_decision", 1, """
+                Topic: {subtopic}
+                Subject: {subject}
+                Grade: {grade}
+
+                Would a visual diagram, illustration, or educational image significantly help a Grade {grade} student understand "{subtopic}"?
+                Consider: diagrams for processes, scientific concepts, historical events, geography, anatomy, chemistry, physics, etc.
+
+                Respond with JSON:
+                {{
+                    "needs_image": true/false,
+                    "image_prompt": "A detailed prompt for generating an educational illustration" (only if needs_image is true)
+                }}
+                """)
+
+register("lesson_image", 1, "Educational illustration for Grade {grade} students: {image_prompt}. Clear, colorful, age-appropriate, diagram style. No text or labels.")
+
+register("quiz", 1, """
+    You are a tutor for a Grade {grade} student.
+    Create a {num_questions}-question multiple choice quiz about '{topic}' in {subject}.
+    The output must be a JSON object with a key 'questions'.
+    Make sure to include a relevant emoji in every single 'question' string to make the quiz feel like a fun game!
+    Each question object should have:
+    - 'id'
+    - 'question' (e.g., "What is the capital of France? 🇫🇷")
+    - 'options' (list of 4 strings)
+    - 'correct' (the string of the correct answer)
+    - 'explanation' (a short sentence explaining why the correct answer is right and why others might be wrong)
+    """)
+
+register("twi_translate", 1, """
+    You are an expert Twi language translator (Asante Twi).
+    Translate the following text into natural, idiomatic Twi: "{text}"
+
+    Format the output as a JSON object with these keys:
+    - 'translation': The Twi translation.
+    - 'pronunciation': A phonetic guide for the Twi text.
+    - 'notes': Brief notes on context or literal meaning if helpful (optional).
+
+    Example:
+    {{
+      "translation": "Mema wo ahyia",
+      "pronunciation": "Meh-ma wo a-shia",
+      "notes": "Formal greeting used when meeting someone."
+    }}
+    """)
+
+register("twi_vocab", 1, """
+    You are an expert Twi language teacher (Asante Twi).
+    Create a comprehensive list of 18 common Twi words and phrases related to '{topic}'.
+    Include a diverse mix of nouns, verbs, adjectives, and useful phrases.
+    Format the output as a JSON object with a key 'vocab'.
+    Each item should have: 'twi' (the word/phrase), 'english' (translation), 'pronunciation' (phonetic guide), and 'example' (a simple sentence using the word in Twi with English translation).
+    Example:
+    {{
+      "vocab": [
+        {{
+          "twi": "Maakye",
+          "english": "Good morning",
+          "pronunciation": "Ma-chi",
+          "example": "Maakye, Papa. (Good morning, Father.)"
+        }}
+      ]
+    }}
+    """)
+
+register("flashcards", 1, """
+    Create {num_cards} flashcards from the following text.
+    Return a JSON object with a key 'flashcards' containing a list of objects.
+    Each object must have 'front' (question) and 'back' (answer).
+    Keep questions concise and answers clear.
+
+    Text: {text}
+    """)
+
+register("podcast_script", 1, """
+    Write a friendly two-host podcast episode for a Grade {grade} student about '{topic}' in {subject},
+    based only on the lesson below.
+    Host A is Professor Hoot, a wise and warm owl who explains ideas.
+    Host B is Ama, a curious student co-host who asks the questions a listener would ask.
+    Aim for about {lines} short spoken lines in total (one or two sentences each), grouped into 3 to 5 chapters.
+    No sound effects, stage directions, markdown or emojis: every line is read aloud.
+    Return a JSON object with:
+    - 'title' (episode title)
+    - 'chapters': a list of objects with 'title' and 'lines', where each line has 'speaker' ("A" or "B") and 'text'
+
+    Lesson:
+    {lesson}
+    """)
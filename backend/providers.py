@@ -0,0 +1,185 @@
+"""
+Lazily initialised model and voice providers.
+
+Importing google.genai, openai and elevenlabs costs about a second, and
+ElevenLabs voice discovery is a network call, so nothing here runs at
+import time. Each client is built on first use. Voice discovery runs in a
+background thread and is cached to data/voices.json, so a restart serves
+the last known voices without waiting on ElevenLabs.
+
+FAKE_PROVIDERS=1 swaps every client here for the offline stand-ins in
+fake_providers.py, for load tests and benchmarks without network access.
+"""
+
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # 'gemini' or 'local'
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://localhost:11434/v1")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "llama3")
+OLLAMA_API_KEY = os.getenv("OLLAMA_API_KEY", "ollama")  # real key for cloud, dummy for local
+ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
+FAKE_PROVIDERS = os.getenv("FAKE_PROVIDERS", "").lower() in ("1", "true", "yes")
+
+if FAKE_PROVIDERS:
+    # Any non-empty key enables the code paths; the fakes never use it
+    GEMINI_API_KEY = GEMINI_API_KEY or "fake"
+    ELEVENLABS_API_KEY = ELEVENLABS_API_KEY or "fake"
+
+FALLBACK_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"  # Rachel
+VOICES_PATH = os.getenv("VOICES_PATH", "./data/voices.json")
+VOICES_MAX_AGE_SECONDS = int(os.getenv("VOICES_MAX_AGE_SECONDS", str(24 * 3600)))
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def _client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def gemini_client():
+    """The google.genai client, or None without an API key"""
+    if not GEMINI_API_KEY:
+        return None
+
+    def build():
+        if FAKE_PROVIDERS:
+            import fake_providers
+            print("Using fake Gemini provider")
+            return fake_providers.FakeGeminiClient()
+        from google import genai
+        return genai.Client(api_key=GEMINI_API_KEY)
+    return _client("gemini", build)
+
+
+def gemini_types():
+    if FAKE_PROVIDERS:
+        import fake_providers
+        return fake_providers.gemini_types
+    from google.genai import types
+    return types
+
+
+def local_client():
+    """OpenAI-compatible client for Ollama (local or cloud), or None unless LLM_PROVIDER=local"""
+    if LLM_PROVIDER != "local":
+        return None
+
+    def build():
+        if FAKE_PROVIDERS:
+            import fake_providers
+            print("Using fake Local LLM provider")
+            return fake_providers.FakeOpenAIClient()
+        from openai import OpenAI
+        print(f"Using Local LLM Provider at {LOCAL_LLM_URL} with model {LOCAL_LLM_MODEL}")
+        return OpenAI(
+            base_url=LOCAL_LLM_URL,
+            api_key=OLLAMA_API_KEY,  # used as Bearer token for Ollama Cloud API
+        )
+    return _client("local", build)
+
+
+def elevenlabs_client():
+    if not ELEVENLABS_API_KEY:
+        return None
+
+    def build():
+        if FAKE_PROVIDERS:
+            import fake_providers
+            return fake_providers.FakeElevenLabsClient()
+        from elevenlabs.client import ElevenLabs
+        return ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    return _client("elevenlabs", build)
+
+
+def edge_communicate(text: str, voice: str):
+    """edge_tts.Communicate for one utterance (no client to keep; Edge needs no key)"""
+    if FAKE_PROVIDERS:
+        import fake_providers
+        return fake_providers.FakeCommunicate(text, voice)
+    import edge_tts
+    return edge_tts.Communicate(text, voice)
+
+
+class VoiceDirectory:
+    """ElevenLabs voices, refreshed in the background and cached on disk"""
+
+    def __init__(self, path: str = VOICES_PATH):
+        self.path = path
+        self._voices = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _read_cache(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data.get("voices") or [], data.get("fetched_at", 0)
+        except (OSError, ValueError):
+            return [], 0
+
+    def voices(self):
+        if self._voices is None:
+            with self._lock:
+                if self._voices is None:
+                    self._voices = self._read_cache()[0]
+        return self._voices
+
+    def default_voice_id(self) -> str:
+        voices = self.voices()
+        return voices[0]["voice_id"] if voices else FALLBACK_VOICE_ID
+
+    def refresh(self):
+        """Fetch the voice list from ElevenLabs and cache it; returns the voices"""
+        client = elevenlabs_client()
+        if client is None:
+            return self.voices()
+        response = client.voices.get_all()
+        # Handle different response structures (list or object with voices attr)
+        voices_list = response.voices if hasattr(response, "voices") else response
+        voices = [{"voice_id": v.voice_id, "name": v.name} for v in voices_list or []]
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"voices": voices, "fetched_at": time.time()}, f)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._voices = voices
+        if voices:
+            print(f"Selected voice: {voices[0]['name']} ({voices[0]['voice_id']})")
+        return voices
+
+    def start_background_discovery(self):
+        """Refresh in a daemon thread if the disk cache is missing or stale"""
+        if not ELEVENLABS_API_KEY or self._thread is not None:
+            return False
+        if time.time() - self._read_cache()[1] < VOICES_MAX_AGE_SECONDS:
+            return False
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error listing voices: {e}")
+
+        self._thread = threading.Thread(target=run, name="voice-discovery", daemon=True)
+        self._thread.start()
+        return True
+
+
+voice_directory = VoiceDirectory()
@@ -0,0 +1,229 @@
+"""
+Quiz question bank.
+
+Generated questions are stored one per row in quiz_questions, deduplicated
+by a hash of their topic, grade and normalized text. A quiz is assembled
+from the bank with a single indexed query that prefers questions the
+student has never seen, then the ones seen longest ago. When a topic's
+pool runs low a background top-up asks the LLM for more, so most quiz
+requests never wait on generation.
+"""
+
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import and_, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+TARGET_POOL = 30  # questions per topic and grade that top-ups aim for
+TOPUP_BATCH = 10
+MAX_FIELD_CHARS = 500
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="quiz-topup")
+_inflight = set()
+_inflight_lock = threading.Lock()
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", (text or "").lower()).split())
+
+
+def topic_key(subject: str, topic: str) -> str:
+    return f"{normalize(subject)}|{normalize(topic)}"
+
+
+def question_hash(key: str, grade: int, question: str) -> str:
+    return hashlib.sha256(f"{key}|{grade}|{normalize(question)}".encode("utf-8")).hexdigest()[:32]
+
+
+def validate_questions(items):
+    """Well-formed questions from LLM output: text, 2+ distinct options, correct among them"""
+    valid = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        question = item.get("question")
+        options = item.get("options")
+        correct = item.get("correct")
+        explanation = item.get("explanation")
+        if not isinstance(question, str) or not question.strip() or len(question) > MAX_FIELD_CHARS:
+            continue
+        if not isinstance(options, list) or len(options) < 2 or not all(isinstance(o, str) and o.strip() for o in options):
+            continue
+        if len(set(options)) != len(options) or correct not in options:
+            continue
+        valid.append({
+            "question": question.strip(),
+            "options": options,
+            "correct": correct,
+            "explanation": explanation.strip() if isinstance(explanation, str) else None,
+        })
+    return valid
+
+
+def question_row(question: models.QuizQuestion):
+    return {
+        "id": question.id,
+        "question": question.question,
+        "options": question.options,
+        "correct": question.correct,
+        "explanation": question.explanation,
+        "difficulty": question.difficulty,
+    }
+
+
+# ==================== WRITES ====================
+
+def add_questions(db: Session, subject: str, topic: str, grade: int, items) -> int:
+    """Validate and store generated questions, skipping duplicates. Returns how many were new."""
+    key = topic_key(subject, topic)
+    questions = validate_questions(items)
+    if not questions:
+        return 0
+    stmt = sqlite_insert(models.QuizQuestion).values([
+        dict(q, content_hash=question_hash(key, grade, q["question"]), topic_key=key, subject=subject,
+             topic=topic, grade=grade, times_served=0, created_at=datetime.utcnow())
+        for q in questions
+    ]).on_conflict_do_nothing(index_elements=["content_hash"])
+    inserted = db.execute(stmt).rowcount
+    db.commit()
+    return inserted
+
+
+def log_answers(db: Session, student_id: int, subject: str, topic: str, grade: int, answers, test_result_id=None):
+    """Bulk-insert answer events for one submitted quiz. Does not commit.
+
+    `answers` are dicts with question_id (bank id, if served from the bank),
+    question (text, used to hash questions that aren't in the bank), chosen,
+    correct and latency_ms. A question_id is only trusted when the bank row
+    has the same text: saved quizzes and the offline fallback number their
+    questions 1..N too.
+    """
+    if not answers:
+        return 0
+    key = topic_key(subject, topic)
+    bank_ids = {a["question_id"] for a in answers if a.get("question_id")}
+    hashes = dict(db.query(models.QuizQuestion.id, models.QuizQuestion.content_hash).filter(
+        models.QuizQuestion.id.in_(bank_ids)
+    ).all()) if bank_ids else {}
+
+    now = datetime.utcnow()
+    rows = []
+    for answer in answers:
+        if not answer.get("question"):
+            continue
+        question_id = answer.get("question_id")
+        content_hash = question_hash(key, grade, answer["question"])
+        if hashes.get(question_id) != content_hash:
+            question_id = None
+        rows.append({
+            "student_id": student_id, "test_result_id": test_result_id, "question_id": question_id,
+            "question_hash": content_hash, "topic_key": key, "subject": subject, "topic": topic,
+            "chosen": answer.get("chosen"), "correct": bool(answer.get("correct")),
+            "latency_ms": answer.get("latency_ms"), "created_at": now,
+        })
+    if rows:
+        db.execute(sqlite_insert(models.AnswerEvent), rows)
+    return len(rows)
+
+
+def record_exposures(db: Session, student_id, ids):
+    """Note that these question ids were served (to the student, if known). Commits."""
+    if not ids:
+        return
+    if student_id is not None:
+        now = datetime.utcnow()
+        db.execute(sqlite_insert(models.QuestionExposure).values([
+            {"student_id": student_id, "question_id": qid, "served_at": now} for qid in ids
+        ]))
+    db.query(models.QuizQuestion).filter(models.QuizQuestion.id.in_(ids)).update(
+        {models.QuizQuestion.times_served: models.QuizQuestion.times_served + 1},
+        synchronize_session=False
+    )
+    db.commit()
+
+
+# ==================== ASSEMBLY ====================
+
+def assemble(db: Session, subject: str, topic: str, grade: int, count: int, student_id=None):
+    """Up to `count` random questions: never-seen first, then least recently seen.
+
+    Among those, calibrated questions closest to the student's calibrated
+    ability come first (uncalibrated ones count as a match), with jitter so
+    quizzes still vary. Returns (questions, repeats) where repeats is True
+    if the student has already seen some of them.
+    """
+    key = topic_key(subject, topic)
+    if student_id is None:
+        questions = db.query(models.QuizQuestion).filter(
+            models.QuizQuestion.topic_key == key,
+            models.QuizQuestion.grade == grade
+        ).order_by(models.QuizQuestion.times_served, func.random()).limit(count).all()
+        return questions, False
+
+    last_seen = func.max(models.QuestionExposure.served_at)
+    ability = db.query(models.StudentAbility.ability).filter(
+        models.StudentAbility.student_id == student_id
+    ).scalar_subquery()
+    # |difficulty - ability| plus up to 0.5 logits of jitter
+    distance = func.abs(func.coalesce(models.QuizQuestion.difficulty, ability, 0) - func.coalesce(ability, 0)) \
+        + (func.abs(func.random()) % 1000) / 2000.0
+    rows = db.query(models.QuizQuestion, last_seen).outerjoin(
+        models.QuestionExposure,
+        and_(models.QuestionExposure.question_id == models.QuizQuestion.id,
+             models.QuestionExposure.student_id == student_id)
+    ).filter(
+        models.QuizQuestion.topic_key == key,
+        models.QuizQuestion.grade == grade
+    ).group_by(models.QuizQuestion.id).order_by(
+        last_seen.is_(None).desc(), last_seen, distance
+    ).limit(count).all()
+    return [question for question, _ in rows], any(seen is not None for _, seen in rows)
+
+
+def pool_size(db: Session, subject: str, topic: str, grade: int) -> int:
+    return db.query(func.count(models.QuizQuestion.id)).filter(
+        models.QuizQuestion.topic_key == topic_key(subject, topic),
+        models.QuizQuestion.grade == grade
+    ).scalar() or 0
+
+
+def schedule_top_up(subject: str, topic: str, grade: int, generate, count: int = TOPUP_BATCH):
+    """Generate more questions for a topic in the background (once at a time per topic)
+
+    `generate(subject, topic, grade, count)` returns a list of question dicts.
+    """
+    job_key = (topic_key(subject, topic), grade)
+    with _inflight_lock:
+        if job_key in _inflight:
+            return False
+        _inflight.add(job_key)
+
+    def run():
+        db = SessionLocal()
+        try:
+            added = add_questions(db, subject, topic, grade, generate(subject, topic, grade, count))
+            print(f"Question bank top-up for {subject}/{topic} (grade {grade}): {added} new")
+        except Exception as e:
+            print(f"Error topping up question bank for {subject}/{topic}: {e}")
+        finally:
+            db.close()
+            with _inflight_lock:
+                _inflight.discard(job_key)
+
+    _executor.submit(run)
+    return True
+
+
+def top_up_if_low(db: Session, subject: str, topic: str, grade: int, repeats: bool, generate):
+    """Top up when the pool is under TARGET_POOL or the student has started seeing repeats"""
+    if repeats or pool_size(db, subject, topic, grade) < TARGET_POOL:
+        return schedule_top_up(subject, topic, grade, generate)
+    return False
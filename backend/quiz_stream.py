@@ -0,0 +1,70 @@
+"""
+Incremental parsing of streamed quiz JSON.
+
+The quiz prompt asks for {"questions": [{...}, {...}]}. Rather than wait
+for the closing bracket, QuestionStreamParser scans each chunk as it
+arrives, tracking string/escape state and bracket depth, and yields every
+question object as soon as its closing brace is seen. Each character is
+scanned once, so parsing a whole quiz is linear in its length.
+"""
+
+import json
+
+
+class QuestionStreamParser:
+    """Yields complete objects that are elements of the top-level array, or of
+    an array that is a value of the top-level object"""
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    def feed(self, chunk: str):
+        """Consume a chunk of model output; returns the objects it completed"""
+        if not chunk:
+            return []
+        self._text += chunk
+        items = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if ch == "{" and self._is_item_position():
+                    self._item_start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if ch == "}" and self._item_start is not None and self._is_item_position():
+                    try:
+                        items.append(json.loads(text[self._item_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._item_start = None
+
+        # Drop text that can no longer be part of an item
+        keep_from = self._item_start if self._item_start is not None else len(text)
+        self._text = text[keep_from:]
+        if self._item_start is not None:
+            self._item_start = 0
+        self._pos = len(self._text)
+        return items
+
+    def _is_item_position(self) -> bool:
+        """Whether the current stack is directly inside a question list"""
+        return self._stack == ["["] or self._stack == ["{", "["]
@@ -0,0 +1,301 @@
+"""
+Per-student retrieval over past lessons for chat grounding.
+
+Each LessonLog is split into paragraph-sized chunks (lesson_chunks). A
+student's chunks are loaded into an in-memory BM25 inverted index the first
+time they are searched, and new lessons are added incrementally as they are
+logged, so a query only touches the postings of its own terms.
+
+When NumPy is available, chunks also get a hashed bag-of-words embedding
+(unigrams + bigrams, no model download) stored in a memory-mapped float32
+matrix under data/retrieval, one row per chunk id. Search blends the BM25
+score with cosine similarity so paraphrased questions still find the lesson.
+"""
+
+import math
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import chat_memory
+import models
+
+try:
+    import numpy as np
+except ImportError:  # BM25 only
+    np = None
+
+VECTOR_DIR = "./data/retrieval"
+VECTOR_DIM = 256
+CHUNK_CHARS = 700
+TOP_K = 3
+MAX_LOADED_STUDENTS = 256
+# Weight of BM25 vs embedding similarity in the blended score
+BM25_WEIGHT = 0.6
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokens(text: str):
+    return chat_memory.terms(text or "")
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS):
+    """Group consecutive paragraphs into chunks of up to max_chars"""
+    chunks, current = [], ""
+    for paragraph in chat_memory.split_paragraphs(text, max_chars):
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def embed(words):
+    """Signed feature-hashing embedding of unigrams and bigrams, L2-normalised"""
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    features = Counter(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for feature, count in features.items():
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % VECTOR_DIM] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(count))
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+# ==================== VECTOR STORE ====================
+
+class VectorStore:
+    """Memory-mapped float32 matrix; row i holds the embedding of chunk id i"""
+
+    def __init__(self, directory: str = VECTOR_DIR, dim: int = VECTOR_DIM):
+        self.path = os.path.join(directory, f"chunks_{dim}.f32")
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._matrix = None
+
+    def _rows_on_disk(self):
+        return os.path.getsize(self.path) // (4 * self.dim) if os.path.exists(self.path) else 0
+
+    def _map(self, min_rows: int):
+        rows = self._rows_on_disk()
+        if rows < min_rows:
+            # Grow geometrically so appends don't remap on every lesson
+            rows = max(min_rows, rows * 2, 1024)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.truncate(rows * 4 * self.dim)
+            self._matrix = None
+        if self._matrix is None or self._matrix.shape[0] < min_rows:
+            self._matrix = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+        return self._matrix
+
+    def put(self, ids, vectors):
+        if not ids:
+            return
+        with self._lock:
+            matrix = self._map(max(ids) + 1)
+            matrix[ids] = vectors
+            matrix.flush()
+
+    def get(self, ids):
+        """Rows for ids; rows never written (or past the end) come back as zeros"""
+        with self._lock:
+            matrix = self._map(max(ids) + 1 if ids else 0)
+            return np.asarray(matrix[ids])
+
+
+# ==================== BM25 INDEX ====================
+
+class StudentIndex:
+    """Inverted index over one student's chunks"""
+
+    def __init__(self):
+        self.chunk_ids = []
+        self.lengths = []
+        self.meta = []
+        self.postings = {}
+        self.total_length = 0
+        self.log_ids = set()
+
+    def add(self, chunk_id: int, words, meta):
+        """meta is (lesson_log_id, subject, topic, content)"""
+        self.log_ids.add(meta[0])
+        doc = len(self.chunk_ids)
+        self.chunk_ids.append(chunk_id)
+        self.lengths.append(len(words))
+        self.meta.append(meta)
+        self.total_length += len(words)
+        for term, tf in Counter(words).items():
+            self.postings.setdefault(term, []).append((doc, tf))
+
+    def bm25(self, query_terms):
+        n = len(self.chunk_ids)
+        if not n:
+            return {}
+        avg_len = self.total_length / n or 1
+        scores = {}
+        for term in set(query_terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / avg_len)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+
+class LessonRetriever:
+    def __init__(self, vector_dir: str = VECTOR_DIR):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        # student id -> [loaders in progress, lessons logged meanwhile]
+        self._loading = {}
+        self.vectors = VectorStore(vector_dir) if np is not None else None
+
+    def chunk_lesson(self, db: Session, log: models.LessonLog):
+        """Add chunk rows for a lesson log to the session's transaction (flushed, not committed).
+
+        Returns (chunk id, content) pairs for add_lesson once the transaction commits.
+        """
+        rows = [
+            models.LessonChunk(student_id=log.student_id, lesson_log_id=log.id, subject=log.subject,
+                               topic=log.topic, position=i, content=text)
+            for i, text in enumerate(chunk_text(log.content))
+        ]
+        db.add_all(rows)
+        db.flush()
+        return [(row.id, row.content) for row in rows]
+
+    def _store_vectors(self, chunks):
+        if self.vectors is not None and chunks:
+            self.vectors.put([chunk_id for chunk_id, _ in chunks],
+                             np.stack([embed(tokens(content)) for _, content in chunks]))
+
+    def _load(self, db: Session, student_id: int):
+        """Build a student's index from lesson_chunks, chunking any older logs first"""
+        unchunked = db.query(models.LessonLog).outerjoin(
+            models.LessonChunk, models.LessonChunk.lesson_log_id == models.LessonLog.id
+        ).filter(
+            models.LessonLog.student_id == student_id,
+            models.LessonChunk.id.is_(None)
+        ).all()
+        if unchunked:
+            try:
+                new_chunks = []
+                for log in unchunked:
+                    new_chunks.extend(self.chunk_lesson(db, log))
+                db.commit()
+                self._store_vectors(new_chunks)
+            except IntegrityError:
+                # A concurrent load chunked them first (unique lesson_log_id, position)
+                db.rollback()
+
+        index = StudentIndex()
+        chunks = db.query(
+            models.LessonChunk.id, models.LessonChunk.lesson_log_id, models.LessonChunk.subject,
+            models.LessonChunk.topic, models.LessonChunk.content
+        ).filter(models.LessonChunk.student_id == student_id).order_by(models.LessonChunk.id).all()
+        for chunk_id, log_id, subject, topic, content in chunks:
+            index.add(chunk_id, tokens(content), (log_id, subject, topic, content))
+        return index
+
+    def _get(self, db: Session, student_id: int):
+        with self._lock:
+            index = self._indexes.get(student_id)
+            if index is not None:
+                self._indexes.move_to_end(student_id)
+                return index
+            self._loading.setdefault(student_id, [0, []])[0] += 1
+
+        # The backfill reads and writes the DB, so other students' searches don't wait on it
+        try:
+            index = self._load(db, student_id)
+        finally:
+            with self._lock:
+                loading = self._loading[student_id]
+                loading[0] -= 1
+                pending = loading[1]
+                if not loading[0]:
+                    del self._loading[student_id]
+
+        with self._lock:
+            installed = self._indexes.get(student_id)
+            if installed is not None:
+                return installed
+            # Lessons logged while we were reading may have missed the snapshot
+            for log_id, subject, topic, chunks in pending:
+                self._add_rows(index, log_id, subject, topic, chunks)
+            pending.clear()
+            self._indexes[student_id] = index
+            if len(self._indexes) > MAX_LOADED_STUDENTS:
+                self._indexes.popitem(last=False)
+            return index
+
+    @staticmethod
+    def _add_rows(index, log_id, subject, topic, chunks):
+        if log_id in index.log_ids:
+            return
+        for chunk_id, content in chunks:
+            index.add(chunk_id, tokens(content), (log_id, subject, topic, content))
+
+    def add_lesson(self, log: models.LessonLog, chunks):
+        """Index the committed chunks of a newly logged lesson (from chunk_lesson)"""
+        self._store_vectors(chunks)
+        with self._lock:
+            index = self._indexes.get(log.student_id)
+            if index is not None:
+                self._add_rows(index, log.id, log.subject, log.topic, chunks)
+            elif log.student_id in self._loading:
+                self._loading[log.student_id][1].append((log.id, log.subject, log.topic, chunks))
+
+    def remove_student(self, student_id: int):
+        with self._lock:
+            self._indexes.pop(student_id, None)
+
+    def search(self, db: Session, student_id: int, query: str, k: int = TOP_K, exclude_text: str = ""):
+        """Top-k chunks from the student's past lessons for `query`.
+
+        Chunks contained in `exclude_text` (the lesson already in the prompt)
+        are skipped. Returns dicts with lesson_log_id, subject, topic, text and score.
+        """
+        index = self._get(db, student_id)
+        query_terms = tokens(query)
+        if not index.chunk_ids or not query_terms:
+            return []
+
+        scores = index.bm25(query_terms)
+        if scores:
+            top = max(scores.values())
+            scores = {doc: BM25_WEIGHT * s / top for doc, s in scores.items()}
+
+        if self.vectors is not None:
+            similarity = self.vectors.get(index.chunk_ids) @ embed(query_terms)
+            # Only let the embedding add candidates that are actually similar
+            for doc in np.flatnonzero(similarity > 0.2):
+                scores[int(doc)] = scores.get(int(doc), 0.0) + (1 - BM25_WEIGHT) * float(similarity[doc])
+
+        results = []
+        for doc, score in sorted(scores.items(), key=lambda item: -item[1]):
+            log_id, subject, topic, content = index.meta[doc]
+            if exclude_text and content in exclude_text:
+                continue
+            results.append({
+                "lesson_log_id": log_id, "subject": subject, "topic": topic,
+                "text": content, "score": round(score, 4),
+            })
+            if len(results) == k:
+                break
+        return results
+
+
+retriever = LessonRetriever()
@@ -0,0 +1,86 @@
+"""
+Fast JSON path for ORM-heavy responses.
+
+Returning SQLAlchemy rows straight from a handler sends them through
+jsonable_encoder, which reflects over every attribute of every row. The
+*_row functions below map the columns explicitly, and FastJSONResponse
+renders the result with orjson when it is installed.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (datetimes become ISO-8601 strings)"""
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(content, ensure_ascii=False, default=_default).encode("utf-8")
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def rows(mapper, items):
+    return [mapper(item) for item in items]
+
+
+def lesson_log_row(log):
+    return {
+        "id": log.id,
+        "student_id": log.student_id,
+        "subject": log.subject,
+        "topic": log.topic,
+        "content": log.content,
+        "timestamp": log.timestamp,
+    }
+
+
+def saved_quiz_row(quiz):
+    return {
+        "id": quiz.id,
+        "student_id": quiz.student_id,
+        "subject": quiz.subject,
+        "topic": quiz.topic,
+        "questions": quiz.questions,
+        "created_at": quiz.created_at,
+    }
+
+
+def flashcard_row(card):
+    return {
+        "id": card.id,
+        "student_id": card.student_id,
+        "topic": card.topic,
+        "front": card.front,
+        "back": card.back,
+        "ease_factor": card.ease_factor,
+        "interval": card.interval,
+        "next_review": card.next_review,
+        "review_count": card.review_count,
+    }
+
+
+def test_result_row(result):
+    return {
+        "id": result.id,
+        "student_id": result.student_id,
+        "student_name": result.student_name,
+        "grade": result.grade,
+        "subject": result.subject,
+        "topic": result.topic,
+        "score": result.score,
+        "total_questions": result.total_questions,
+        "timestamp": result.timestamp,
+    }
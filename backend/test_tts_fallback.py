@@ -0,0 +1,70 @@
+"""
+Check that /api/tts falls back to Edge when ElevenLabs can't serve a request.
+
+Runs offline against the fake providers in a throwaway data directory:
+an over-budget ElevenLabs request must come back from Edge with
+X-TTS-Fallback: budget, and a failing ElevenLabs call with
+X-TTS-Fallback: error.
+
+Usage: python test_tts_fallback.py
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ["FAKE_PROVIDERS"] = "1"
+os.environ.setdefault("FAKE_TIME_SCALE", "0.01")
+os.environ["AUDIO_CACHE_DIR"] = os.path.join(tempfile.mkdtemp(), "audio_cache")
+os.chdir(tempfile.mkdtemp())
+sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+import tts  # noqa: E402
+from tts import tts_service  # noqa: E402
+
+ELEVENLABS_VOICE = "EXAVITQu4vr4xnSDxMaL"
+
+
+def check(name, response, provider, fallback):
+    got = (response.status_code, response.headers.get("X-TTS-Provider"), response.headers.get("X-TTS-Fallback"))
+    want = (200, provider, fallback)
+    print(f"{'✅' if got == want else '❌'} {name}: status/provider/fallback {got}, expected {want}")
+    return got == want
+
+
+def main_check():
+    client = TestClient(main.app)
+    results = []
+
+    results.append(check(
+        "ElevenLabs within budget",
+        client.post("/api/tts", json={"text": "Hello from ElevenLabs.", "voice_id": ELEVENLABS_VOICE}),
+        "elevenlabs", None,
+    ))
+
+    tts_service.budget.limits["elevenlabs"] = 1
+    results.append(check(
+        "ElevenLabs over budget",
+        client.post("/api/tts", json={"text": "This request is over the budget.", "voice_id": ELEVENLABS_VOICE}),
+        "edge", "budget",
+    ))
+    tts_service.budget.limits["elevenlabs"] = 0
+
+    async def failing(self, text, voice):
+        raise RuntimeError("ElevenLabs is down")
+        yield b""
+    tts.ElevenLabsProvider.stream = failing
+    results.append(check(
+        "ElevenLabs error",
+        client.post("/api/tts", json={"text": "ElevenLabs fails on this one.", "voice_id": ELEVENLABS_VOICE}),
+        "edge", "error",
+    ))
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main_check() else 1)
@@ -0,0 +1,335 @@
+"""
+Text-to-speech providers, routing, budgets and the shared audio cache.
+
+/api/tts routes by voice_id: Edge voice names (en-US-JennyNeural) go to
+Edge TTS, 20-character ElevenLabs voice ids go to ElevenLabs when a key is
+configured, and anything else gets the default Edge voice. Audio is
+streamed to the client as the provider produces it and written to a
+content-addressed cache keyed by provider, voice, model and text, so a
+replay of the same lesson costs nothing and skips the provider entirely.
+
+Each provider has a daily character budget (TTS_BUDGET_<PROVIDER>_DAILY,
+0 for unlimited). Only synthesized characters count, not cache hits. When
+ElevenLabs is over budget or fails before sending audio, the request falls
+back to Edge.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import date
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+import metrics
+import models
+import providers
+from database import SessionLocal
+
+CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "./data/audio_cache")
+CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", "500")) * 1024 * 1024
+DAILY_BUDGETS = {
+    "edge": int(os.getenv("TTS_BUDGET_EDGE_DAILY", "0")),
+    "elevenlabs": int(os.getenv("TTS_BUDGET_ELEVENLABS_DAILY", "10000")),
+}
+
+# Regex to strip out common emoji ranges so the TTS engine doesn't read them out
+_EMOJI = re.compile(
+    r'['
+    r'\U0001f600-\U0001f64f'  # emoticons
+    r'\U0001f300-\U0001f5ff'  # symbols & pictographs
+    r'\U0001f680-\U0001f6ff'  # transport & map symbols
+    r'\U0001f1e0-\U0001f1ff'  # flags
+    r'\u2600-\u27bf'          # misc symbols and dingbats
+    r'\U0001f900-\U0001f9ff'  # supplemental symbols
+    r'\U0001fa70-\U0001faff'  # symbols and pictographs ext-a
+    r']+', flags=re.UNICODE)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def clean_text(text: str) -> str:
+    """Remove markdown asterisks/headings and emojis"""
+    return _EMOJI.sub("", (text or "").replace("*", "").replace("#", "")).strip()
+
+
+# ==================== PROVIDERS ====================
+
+class EdgeProvider:
+    name = "edge"
+    model = "edge"
+    # Jenny is clear and pleasant; en-US-AriaNeural and en-US-SaraNeural also work
+    default_voice = "en-US-JennyNeural"
+    _voice_pattern = re.compile(r"^[a-z]{2,3}-[A-Z]{2,4}(-[A-Za-z]+)?-\w+Neural$")
+
+    def configured(self) -> bool:
+        return True
+
+    def handles(self, voice_id: str) -> bool:
+        return bool(self._voice_pattern.match(voice_id or ""))
+
+    async def stream(self, text: str, voice: str):
+        async for chunk in providers.edge_communicate(text, voice).stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+
+
+class ElevenLabsProvider:
+    name = "elevenlabs"
+    model = "eleven_multilingual_v2"
+    output_format = "mp3_44100_128"
+    _voice_pattern = re.compile(r"^[A-Za-z0-9]{20}$")
+
+    @property
+    def default_voice(self):
+        return providers.voice_directory.default_voice_id()
+
+    def configured(self) -> bool:
+        return bool(providers.ELEVENLABS_API_KEY)
+
+    def handles(self, voice_id: str) -> bool:
+        return bool(self._voice_pattern.match(voice_id or ""))
+
+    async def stream(self, text: str, voice: str):
+        chunks = providers.elevenlabs_client().text_to_speech.stream(
+            voice, text=text, model_id=self.model, output_format=self.output_format
+        )
+        # The SDK iterator blocks on the network; pull it from the threadpool
+        async for chunk in iterate_in_threadpool(iter(chunks)):
+            if chunk:
+                yield chunk
+
+
+# ==================== CACHE AND BUDGETS ====================
+
+class AudioCache:
+    """MP3 files named by the hash of what produced them"""
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+
+    @staticmethod
+    def key(provider: str, voice: str, model: str, text: str) -> str:
+        return hashlib.sha256(f"{provider}|{voice}|{model}|{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        os.utime(path)  # recently played files survive pruning
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._files())
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._prune()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".mp3"):
+                    stat = os.stat(os.path.join(root, name))
+                    yield os.path.join(root, name), stat.st_size, stat.st_mtime
+
+    def _prune(self):
+        """Delete least recently used files until the cache is at 90% of its cap"""
+        for path, size, _ in sorted(self._files(), key=lambda f: f[2]):
+            if self._total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._total -= size
+            except OSError:
+                pass
+
+
+class CharacterBudget:
+    """Per-provider daily character allowance, persisted in tts_usage"""
+
+    def __init__(self, limits=DAILY_BUDGETS):
+        self.limits = dict(limits)
+        self._lock = threading.Lock()
+
+    def _add(self, db, provider: str, characters: int):
+        stmt = sqlite_insert(models.TTSUsage).values(provider=provider, day=date.today(), characters=characters)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["provider", "day"],
+            set_={"characters": models.TTSUsage.characters + stmt.excluded.characters}
+        ))
+        db.commit()
+
+    def used(self, db, provider: str) -> int:
+        return db.query(models.TTSUsage.characters).filter(
+            models.TTSUsage.provider == provider, models.TTSUsage.day == date.today()
+        ).scalar() or 0
+
+    def reserve(self, provider: str, characters: int) -> bool:
+        limit = self.limits.get(provider, 0)
+        db = SessionLocal()
+        try:
+            with self._lock:
+                if limit and self.used(db, provider) + characters > limit:
+                    return False
+                self._add(db, provider, characters)
+                return True
+        finally:
+            db.close()
+
+    def refund(self, provider: str, characters: int):
+        db = SessionLocal()
+        try:
+            with self._lock:
+                self._add(db, provider, -characters)
+        finally:
+            db.close()
+
+    def snapshot(self):
+        db = SessionLocal()
+        try:
+            return {
+                name: {"used_today": self.used(db, name), "daily_limit": limit or None}
+                for name, limit in self.limits.items()
+            }
+        finally:
+            db.close()
+
+
+# ==================== ROUTING ====================
+
+class SpeechStream:
+    """Audio for one request: where it came from and an async iterator of MP3 bytes"""
+
+    def __init__(self, provider: str, voice: str, cached: bool, chunks, fallback: str = None):
+        self.provider = provider
+        self.voice = voice
+        self.cached = cached
+        self.chunks = chunks
+        self.fallback = fallback
+
+    def headers(self):
+        headers = {"X-TTS-Provider": self.provider, "X-TTS-Cache": "hit" if self.cached else "miss"}
+        if self.fallback:
+            headers["X-TTS-Fallback"] = self.fallback
+        return headers
+
+
+class TTSService:
+    def __init__(self, cache: AudioCache = None, budget: CharacterBudget = None):
+        self.edge = EdgeProvider()
+        self.elevenlabs = ElevenLabsProvider()
+        self.cache = cache or AudioCache()
+        self.budget = budget or CharacterBudget()
+
+    def route(self, voice_id: str = None):
+        """(provider, voice) for a requested voice id"""
+        if voice_id == "elevenlabs" and self.elevenlabs.configured():
+            return self.elevenlabs, self.elevenlabs.default_voice
+        if voice_id and self.edge.handles(voice_id):
+            return self.edge, voice_id
+        if voice_id and self.elevenlabs.handles(voice_id) and self.elevenlabs.configured():
+            return self.elevenlabs, voice_id
+        return self.edge, self.edge.default_voice
+
+    def pending_characters(self, items) -> int:
+        """Characters that speaking these (text, voice_id) pairs would synthesize (cache misses)"""
+        total = 0
+        for text, voice_id in items:
+            text = clean_text(text)
+            provider, voice = self.route(voice_id)
+            if text and not self.cache.contains(self.cache.key(provider.name, voice, provider.model, text)):
+                total += len(text)
+        return total
+
+    async def stream(self, text: str, voice_id: str = None, fallback: bool = True, budgeted: bool = True) -> SpeechStream:
+        """Start speaking `text`. Provider errors surface here, before any audio is sent.
+
+        With fallback=False, budget and provider failures raise instead of
+        switching to Edge. budgeted=False skips the per-request budget check,
+        for callers that reserved characters up front (podcasts).
+        """
+        text = clean_text(text)
+        if not text:
+            raise ValueError("Nothing to say")
+        provider, voice = self.route(voice_id)
+        fell_back = None  # "budget" or "error" once we switch to Edge
+        while True:
+            key = self.cache.key(provider.name, voice, provider.model, text)
+            cached = self.cache.get(key)
+            metrics.cache_lookup("audio", cached is not None)
+            if cached is not None:
+                return SpeechStream(provider.name, voice, True, _once(cached), fell_back)
+
+            if budgeted and not await run_in_threadpool(self.budget.reserve, provider.name, len(text)):
+                if provider is self.edge or not fallback:
+                    raise BudgetExceeded("Today's speech budget is used up. Please try again tomorrow.")
+                provider, voice, fell_back = self.edge, self.edge.default_voice, "budget"
+                continue
+
+            chunks = provider.stream(text, voice)
+            start = time.perf_counter()
+            try:
+                with metrics.span(f"tts.{provider.name}"):
+                    first = await chunks.__anext__()
+            except StopAsyncIteration:
+                if budgeted:
+                    await run_in_threadpool(self.budget.refund, provider.name, len(text))
+                raise RuntimeError("No audio generated")
+            except Exception as e:
+                metrics.observe_provider("tts", provider.name, provider.model, "speech", time.perf_counter() - start, e)
+                if budgeted:
+                    await run_in_threadpool(self.budget.refund, provider.name, len(text))
+                if provider is self.edge or not fallback:
+                    raise
+                print(f"Error from {provider.name} TTS, falling back to Edge: {e}")
+                provider, voice, fell_back = self.edge, self.edge.default_voice, "error"
+                continue
+            # Time to first audio; the rest streams at the client's pace
+            metrics.observe_provider("tts", provider.name, provider.model, "speech", time.perf_counter() - start)
+            return SpeechStream(provider.name, voice, False, self._tee(key, first, chunks), fell_back)
+
+    async def _tee(self, key, first, chunks):
+        """Pass chunks through while collecting them for the cache"""
+        parts = [first]
+        yield first
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.cache.put(key, b"".join(parts))
+
+    async def synthesize(self, text: str, voice_id: str = None, **options) -> bytes:
+        speech = await self.stream(text, voice_id, **options)
+        return b"".join([chunk async for chunk in speech.chunks])
+
+
+async def _once(data: bytes):
+    yield data
+
+
+tts_service = TTSService()
@@ -0,0 +1,231 @@
+"""
+Asante Twi lexicon and vocabulary decks with cache-first lookup.
+
+Translations are looked up in twi_lexicon before the LLM is asked:
+first the whole text, then each comma/sentence-separated segment as a
+whole. Segments are never composed word by word, since Twi word order
+differs from English (adjectives follow nouns, negation sits on the verb).
+Only when some segment is unknown is the LLM called; its output is
+validated and stored, so the lexicon grows with use. Vocabulary topics are served from stored decks the same way.
+"""
+
+import re
+import threading
+import unicodedata
+from datetime import datetime
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+
+MAX_FIELD_CHARS = 300
+MAX_TRANSLATE_CHARS = 500
+MIN_DECK_ITEMS = 5
+
+# (english, twi, pronunciation, example, notes)
+SEED_LEXICON = [
+    ("welcome", "Akwaaba", "Ah-kwaa-bah", "Akwaaba! (Welcome!)", "Used to welcome guests and visitors."),
+    ("good morning", "Maakye", "Maa-chi", "Maakye, Maame. (Good morning, Mother.)", None),
+    ("good afternoon", "Maaha", "Maa-ha", "Maaha, Papa. (Good afternoon, Father.)", None),
+    ("good evening", "Maadwo", "Maa-jwo", "Maadwo, Nana. (Good evening, Grandparent.)", None),
+    ("good night", "Da yie", "Dah yee-eh", "Da yie, me nua. (Good night, my sibling.)", "Literally 'sleep well'."),
+    ("thank you", "Medaase", "Meh-daa-si", "Medaase, Papa. (Thank you, Father.)", None),
+    ("how are you", "Ɛte sɛn?", "Eh-teh sehn", "Ɛte sɛn, me nua? (How are you, my sibling?)", "Wo ho te sɛn? is the fuller form."),
+    ("i am fine", "Me ho yɛ", "Meh ho yeh", "Me ho yɛ, medaase. (I am fine, thank you.)", None),
+    ("yes", "Aane", "Aa-neh", "Aane, me pɛ. (Yes, I want it.)", None),
+    ("no", "Daabi", "Daa-bi", "Daabi, medaase. (No, thank you.)", None),
+    ("please", "Mepa wo kyɛw", "Meh-pa wo chew", "Mepa wo kyɛw, bra ha. (Please, come here.)", None),
+    ("goodbye", "Nante yie", "Nahn-teh yee-eh", "Nante yie! (Goodbye!)", "Literally 'walk well'."),
+    ("what is your name", "Wo din de sɛn?", "Wo din deh sehn", "Wo din de sɛn? (What is your name?)", None),
+    ("water", "Nsuo", "N-su-oh", "Mepa wo kyɛw, ma me nsuo. (Please give me water.)", None),
+    ("food", "Aduane", "Ah-dwa-neh", "Aduane no yɛ dɛ. (The food is tasty.)", None),
+    ("mother", "Maame", "Maa-meh", "Me maame wɔ fie. (My mother is at home.)", "Ɛna is also used."),
+    ("father", "Papa", "Pah-pah", "Me papa wɔ adwuma. (My father is at work.)", "Agya is also used."),
+    ("school", "Sukuu", "Su-kuu", "Merekɔ sukuu. (I am going to school.)", None),
+    ("one", "baako", "baa-ko", "Me wɔ nkate baako. (I have one groundnut.)", None),
+    ("two", "mmienu", "m-mi-eh-nu", "Me wɔ nkate mmienu. (I have two groundnuts.)", None),
+    ("three", "mmiɛnsa", "m-mi-ehn-sa", "Me wɔ nkate mmiɛnsa. (I have three groundnuts.)", None),
+    ("four", "ɛnan", "eh-nahn", "Me wɔ nkate ɛnan. (I have four groundnuts.)", None),
+    ("five", "enum", "eh-num", "Me wɔ nkate enum. (I have five groundnuts.)", None),
+    ("six", "nsia", "n-si-a", "Me wɔ nkate nsia. (I have six groundnuts.)", None),
+    ("seven", "nson", "n-sohn", "Me wɔ nkate nson. (I have seven groundnuts.)", None),
+    ("eight", "nwɔtwe", "n-wo-chweh", "Me wɔ nkate nwɔtwe. (I have eight groundnuts.)", None),
+    ("nine", "nkron", "n-krohn", "Me wɔ nkate nkron. (I have nine groundnuts.)", None),
+    ("ten", "du", "doo", "Me wɔ nkate du. (I have ten groundnuts.)", None),
+]
+# Digits are looked up like their number words
+DIGIT_WORDS = {
+    "1": "one", "2": "two", "3": "three", "4": "four", "5": "five",
+    "6": "six", "7": "seven", "8": "eight", "9": "nine", "10": "ten",
+}
+
+_SEGMENT = re.compile(r"([.,!?;:]+)")
+_NON_WORD = re.compile(r"[^\w\s']")
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace: 'Good  Morning!' -> 'good morning'"""
+    text = unicodedata.normalize("NFC", text or "").lower().replace("’", "'")
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def _clean(value, required=False):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None if not required else False
+    if not isinstance(value, str) or len(value) > MAX_FIELD_CHARS:
+        return False
+    return value.strip()
+
+
+def validate_translation(data):
+    """Cleaned {'translation', 'pronunciation', 'notes'} from LLM output, or None"""
+    if isinstance(data, list):
+        data = data[0] if data else None
+    if not isinstance(data, dict):
+        return None
+    translation = _clean(data.get("translation"), required=True)
+    pronunciation = _clean(data.get("pronunciation"))
+    notes = _clean(data.get("notes"))
+    if translation is False or pronunciation is False or notes is False:
+        return None
+    return {"translation": translation, "pronunciation": pronunciation or "", "notes": notes or ""}
+
+
+def validate_vocab(items):
+    """Vocab items with non-empty 'twi' and 'english'; malformed items are dropped"""
+    valid = []
+    seen = set()
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        fields = {key: _clean(item.get(key), required=key in ("twi", "english"))
+                  for key in ("twi", "english", "pronunciation", "example")}
+        if any(value is False for value in fields.values()):
+            continue
+        key = normalize(fields["english"])
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        valid.append({k: v or "" for k, v in fields.items()})
+    return valid
+
+
+class TwiLexicon:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None
+
+    # ---------- storage ----------
+
+    def _insert(self, db: Session, rows):
+        if not rows:
+            return
+        stmt = sqlite_insert(models.TwiEntry).values([
+            dict(row, english_norm=normalize(row["english"]), created_at=datetime.utcnow()) for row in rows
+        ]).on_conflict_do_nothing(index_elements=["english_norm"])
+        db.execute(stmt)
+        db.commit()
+        with self._lock:
+            if self._entries is not None:
+                for row in rows:
+                    self._index(normalize(row["english"]), row)
+
+    def _index(self, key, row):
+        entry = {k: row.get(k) or "" for k in ("english", "twi", "pronunciation", "example", "notes")}
+        self._entries.setdefault(key, entry)
+
+    def _load(self, db: Session):
+        if self._entries is not None:
+            return
+        if not db.query(models.TwiEntry.id).first():
+            self._insert(db, [
+                {"english": e, "twi": t, "pronunciation": p, "example": x, "notes": n, "source": "seed"}
+                for e, t, p, x, n in SEED_LEXICON
+            ])
+        rows = db.query(models.TwiEntry).all()
+        with self._lock:
+            self._entries = {}
+            for row in rows:
+                self._index(row.english_norm, {
+                    "english": row.english, "twi": row.twi, "pronunciation": row.pronunciation,
+                    "example": row.example, "notes": row.notes,
+                })
+
+    # ---------- translation ----------
+
+    def lookup(self, db: Session, text: str):
+        """Translation from the lexicon alone, or None if any part needs the LLM"""
+        self._load(db)
+        key = normalize(text)
+        if not key:
+            return None
+        entry = self._entries.get(DIGIT_WORDS.get(key, key))
+        if entry:
+            return {
+                "translation": entry["twi"], "pronunciation": entry["pronunciation"],
+                "notes": entry["notes"], "example": entry["example"], "source": "lexicon",
+            }
+
+        # Phrase level: every segment must be a lexicon entry in its own right
+        twi, pronunciation, used = [], [], []
+        for piece in _SEGMENT.split(text):
+            if _SEGMENT.fullmatch(piece):
+                if twi and not twi[-1].endswith(piece.strip()):
+                    twi[-1] += piece.strip()
+                continue
+            segment = normalize(piece)
+            if not segment:
+                continue
+            entry = self._entries.get(DIGIT_WORDS.get(segment, segment))
+            if entry is None:
+                return None
+            twi.append(entry["twi"])
+            pronunciation.append(entry["pronunciation"])
+            used.append(f"{entry['english']} = {entry['twi']}")
+        if not twi:
+            return None
+        return {
+            "translation": " ".join(twi),
+            "pronunciation": " / ".join(p for p in pronunciation if p),
+            "notes": "Built from the phrase dictionary: " + "; ".join(used),
+            "source": "lexicon",
+        }
+
+    def remember_translation(self, db: Session, text: str, data):
+        """Validate an LLM translation and store it; returns the cleaned result or None"""
+        result = validate_translation(data)
+        if result and len(text) <= MAX_TRANSLATE_CHARS:
+            self._load(db)
+            self._insert(db, [{
+                "english": text.strip(), "twi": result["translation"],
+                "pronunciation": result["pronunciation"], "notes": result["notes"], "source": "llm",
+            }])
+        return result
+
+    # ---------- vocab decks ----------
+
+    def get_deck(self, db: Session, topic: str):
+        deck = db.query(models.TwiDeck).filter(models.TwiDeck.topic_norm == normalize(topic)).first()
+        return deck.vocab if deck else None
+
+    def store_deck(self, db: Session, topic: str, items):
+        """Validate and store a generated deck (and its words in the lexicon); returns the cleaned items"""
+        vocab = validate_vocab(items)
+        if len(vocab) < MIN_DECK_ITEMS:
+            return vocab
+        stmt = sqlite_insert(models.TwiDeck).values(
+            topic_norm=normalize(topic), topic=topic.strip(), vocab=vocab, created_at=datetime.utcnow()
+        ).on_conflict_do_nothing(index_elements=["topic_norm"])
+        db.execute(stmt)
+        db.commit()
+        self._load(db)
+        self._insert(db, [
+            {"english": v["english"], "twi": v["twi"], "pronunciation": v["pronunciation"],
+             "example": v["example"], "source": "llm"}
+            for v in vocab
+        ])
+        return vocab
+
+
+lexicon = TwiLexicon()
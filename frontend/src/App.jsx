@@ -1,4 +1,4 @@
-import { useState } from 'react'
+import { useState, useEffect } from 'react'
 import PWAInstallPrompt from './components/PWAInstallPrompt'
 import ProfileSelection from './components/ProfileSelection'
 import SubjectDashboard from './components/SubjectDashboard'
@@ -43,17 +43,46 @@ function App() {
   };
 
   const [recommendations, setRecommendations] = useState([]);
+  // Dashboard data from /bootstrap; only used for the first dashboard render after profile selection
+  const [bootstrap, setBootstrap] = useState(null);
+  // Hold the dashboard back until /bootstrap answers so its widgets don't each fetch on mount
+  const [bootstrapPending, setBootstrapPending] = useState(false);
+
+  useEffect(() => {
+    if (viewMode !== 'dashboard') setBootstrap(null);
+  }, [viewMode]);
 
   const handleProfileSelect = async (profile) => {
+    setBootstrap(null);
+    setBootstrapPending(!!profile.id);
     setCurrentProfile(profile); // Profile now has id, xp, level from backend
     setGreeting('Loading your special message...');
 
     try {
+      // One round-trip for greeting, streak, badges, recommendations, leaderboard and due cards
+      if (profile.id) {
+        try {
+          const bootRes = await fetch(`/api/students/${profile.id}/bootstrap`);
+          if (bootRes.ok) {
+            const bootData = await bootRes.json();
+            setBootstrap(bootData);
+            setGreeting(bootData.greeting.message);
+            setRecommendations(bootData.recommendations);
+            return;
+          }
+        } catch (err) {
+          console.error(err);
+        } finally {
+          // Success or failure, the widgets can mount now (and fetch for themselves if it failed)
+          setBootstrapPending(false);
+        }
+      }
+
       // Fetch Greeting
       const res = await fetch('/api/greet', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ name: profile.name, grade: profile.grade })
+        body: JSON.stringify({ name: profile.name, grade: profile.grade, student_id: profile.id })
       });
       const data = await res.json();
       setGreeting(data.message);
@@ -350,14 +379,19 @@ function App() {
                 "{greeting}"
               </p>
             </div>
-            <SubjectDashboard
-              studentProfile={currentProfile}
-              onSelectSubject={handleSubjectSelect}
-              recommendations={recommendations}
-              onStartFlashcards={() => setViewMode('flashcards')}
-              onOpenQuizLibrary={() => setViewMode('quiz-library')}
-              onOpenLessonLibrary={() => setViewMode('lesson-library')}
-            />
+            {bootstrapPending ? (
+              <div className="text-center text-slate-400 py-12">Loading your dashboard...</div>
+            ) : (
+              <SubjectDashboard
+                studentProfile={currentProfile}
+                onSelectSubject={handleSubjectSelect}
+                recommendations={recommendations}
+                bootstrap={bootstrap}
+                onStartFlashcards={() => setViewMode('flashcards')}
+                onOpenQuizLibrary={() => setViewMode('quiz-library')}
+                onOpenLessonLibrary={() => setViewMode('lesson-library')}
+              />
+            )}
           </div>
         )}
 
@@ -54,7 +54,8 @@ const AdminDashboard = ({ onBack }) => {
             // Fetch Results
             try {
                 console.log("Fetching results...");
-                const res = await fetch('/api/results');
+                // Only the recent rows are shown; aggregates come from /api/analytics
+                const res = await fetch('/api/results?limit=50');
                 if (res.ok) {
                     const data = await res.json();
                     console.log("Results loaded:", data);
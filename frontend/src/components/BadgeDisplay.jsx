@@ -1,12 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import './BadgeDisplay.css';
 
-const BadgeDisplay = ({ studentId }) => {
-    const [badges, setBadges] = useState([]);
-    const [loading, setLoading] = useState(true);
+const BadgeDisplay = ({ studentId, initialBadges }) => {
+    const [badges, setBadges] = useState(initialBadges || []);
+    const [loading, setLoading] = useState(!initialBadges);
 
     useEffect(() => {
-        if (studentId) {
+        if (studentId && !initialBadges) {
             fetchBadges();
         }
     }, [studentId]);
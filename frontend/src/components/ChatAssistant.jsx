@@ -1,7 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
 import ReactMarkdown from 'react-markdown';
 
-const ChatAssistant = ({ context, studentGrade }) => {
+const ChatAssistant = ({ context, studentGrade, studentId, lessonKey }) => {
     const [isOpen, setIsOpen] = useState(false);
     const [messages, setMessages] = useState([
         { role: 'assistant', text: "Hi! I'm Professor Hoot 🦉. I'm here to help you with this lesson. Ask me anything!" }
@@ -9,6 +9,9 @@ const ChatAssistant = ({ context, studentGrade }) => {
     const [input, setInput] = useState('');
     const [isTyping, setIsTyping] = useState(false);
     const messagesEndRef = useRef(null);
+    // The backend keeps the lesson text; after the first message we only send its id
+    const [contextId, setContextId] = useState(null);
+    const sentContextRef = useRef(null);
 
     const scrollToBottom = () => {
         messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -26,17 +29,37 @@ const ChatAssistant = ({ context, studentGrade }) => {
         setInput('');
         setIsTyping(true);
 
-        try {
+        const lessonText = context || "General learning context";
+        const contextChanged = !contextId || sentContextRef.current !== lessonText;
+
+        const postChat = async (sendContext) => {
             const res = await fetch('/api/chat', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
                     message: userMessage.text,
-                    context: context || "General learning context",
-                    student_grade: studentGrade || 3
+                    context: sendContext ? lessonText : "",
+                    context_id: sendContext ? null : contextId,
+                    student_grade: studentGrade || 3,
+                    student_id: studentId || null,
+                    lesson_key: lessonKey || null
                 })
             });
-            const data = await res.json();
+            return res.json();
+        };
+
+        try {
+            let data = await postChat(contextChanged);
+            // The server no longer has our lesson text (e.g. a new database); send it again
+            if (data.resend_context) {
+                data = await postChat(true);
+            }
+            if (data.context_id) {
+                setContextId(data.context_id);
+                sentContextRef.current = lessonText;
+            } else {
+                setContextId(null);
+            }
 
             const aiMessage = { role: 'assistant', text: data.reply };
             setMessages(prev => [...prev, aiMessage]);
@@ -1,13 +1,15 @@
 import React, { useState, useEffect } from 'react';
 import './Leaderboard.css';
 
-const Leaderboard = ({ currentStudentId, onPrivacyChange }) => {
-    const [leaders, setLeaders] = useState([]);
-    const [loading, setLoading] = useState(true);
+const Leaderboard = ({ currentStudentId, onPrivacyChange, initialLeaders }) => {
+    const [leaders, setLeaders] = useState(initialLeaders || []);
+    const [loading, setLoading] = useState(!initialLeaders);
     const [isPublic, setIsPublic] = useState(false);
 
     useEffect(() => {
-        fetchLeaderboard();
+        if (!initialLeaders) {
+            fetchLeaderboard();
+        }
     }, []);
 
     // Check current user's privacy setting when list updates
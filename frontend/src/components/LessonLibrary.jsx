@@ -1,10 +1,55 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import ReactMarkdown from 'react-markdown';
 
 const LessonLibrary = ({ studentId, onExit }) => {
     const [logs, setLogs] = useState([]);
     const [loading, setLoading] = useState(true);
     const [selectedLog, setSelectedLog] = useState(null);
+    const [podcast, setPodcast] = useState(null); // { logId, jobId, status, message, result }
+    const audioRef = useRef(null);
+    const pollRef = useRef(null);
+
+    useEffect(() => () => clearTimeout(pollRef.current), []);
+
+    const selectLog = (log) => {
+        clearTimeout(pollRef.current);
+        setPodcast(null);
+        setSelectedLog(log);
+    };
+
+    const pollPodcast = async (logId, jobId) => {
+        try {
+            const res = await fetch(`/api/jobs/${jobId}`);
+            const job = await res.json();
+            setPodcast({ logId, jobId, status: job.status, message: job.progress_message || job.error, result: job.result });
+            if (job.status === 'queued' || job.status === 'running') {
+                pollRef.current = setTimeout(() => pollPodcast(logId, jobId), 1500);
+            }
+        } catch (err) {
+            console.error("Error checking podcast:", err);
+        }
+    };
+
+    const makePodcast = async () => {
+        const logId = selectedLog.id;
+        setPodcast({ logId, status: 'queued', message: 'Getting the hosts ready...' });
+        try {
+            const res = await fetch(`/api/lesson-logs/${logId}/podcast`, { method: 'POST' });
+            const data = await res.json();
+            if (!res.ok) throw new Error(data.detail || 'Could not make a podcast');
+            pollPodcast(logId, data.id);
+        } catch (err) {
+            setPodcast({ logId, status: 'failed', message: err.message });
+        }
+    };
+
+    const seekTo = (seconds) => {
+        if (!audioRef.current) return;
+        audioRef.current.currentTime = seconds;
+        audioRef.current.play();
+    };
+
+    const formatTime = (seconds) => `${Math.floor(seconds / 60)}:${String(Math.floor(seconds % 60)).padStart(2, '0')}`;
 
     useEffect(() => {
         const fetchLogs = async () => {
@@ -47,7 +92,7 @@ const LessonLibrary = ({ studentId, onExit }) => {
                         logs.map(log => (
                             <div
                                 key={log.id}
-                                onClick={() => setSelectedLog(log)}
+                                onClick={() => selectLog(log)}
                                 className={`p-4 rounded-xl cursor-pointer transition-all border ${selectedLog?.id === log.id ? 'bg-blue-50 border-blue-200 shadow-md' : 'bg-white border-gray-100 hover:bg-gray-50'}`}
                             >
                                 <div className="font-bold text-gray-800 mb-1">{log.topic}</div>
@@ -68,6 +113,31 @@ const LessonLibrary = ({ studentId, onExit }) => {
                             <div className="text-sm text-gray-400 mb-8 border-b pb-4">
                                 {selectedLog.subject} • {new Date(selectedLog.timestamp).toLocaleString()}
                             </div>
+                            <div className="not-prose mb-8">
+                                {!podcast || podcast.logId !== selectedLog.id || podcast.status === 'failed' ? (
+                                    <div className="flex items-center gap-4">
+                                        <button onClick={makePodcast} className="px-5 py-2 bg-purple-500 hover:bg-purple-600 text-white rounded-xl font-bold transition-colors">
+                                            🎧 Make Podcast
+                                        </button>
+                                        {podcast?.status === 'failed' && <span className="text-sm text-red-400">{podcast.message}</span>}
+                                    </div>
+                                ) : podcast.status === 'succeeded' ? (
+                                    <div className="bg-purple-50 rounded-2xl p-4">
+                                        <div className="font-bold text-purple-700 mb-2">🎧 {podcast.result.title}</div>
+                                        <audio ref={audioRef} controls preload="metadata" src={`/api/jobs/${podcast.jobId}/artifact`} className="w-full mb-3" />
+                                        <div className="space-y-1">
+                                            {podcast.result.chapters.map((chapter, i) => (
+                                                <button key={i} onClick={() => seekTo(chapter.start_seconds)} className="w-full text-left text-sm px-3 py-1 rounded-lg hover:bg-purple-100 flex justify-between">
+                                                    <span>{chapter.title}</span>
+                                                    <span className="text-gray-400">{formatTime(chapter.start_seconds)}</span>
+                                                </button>
+                                            ))}
+                                        </div>
+                                    </div>
+                                ) : (
+                                    <div className="text-sm text-purple-500 animate-pulse">🎙️ {podcast.message || 'Making your podcast...'}</div>
+                                )}
+                            </div>
                             <ReactMarkdown>{selectedLog.content}</ReactMarkdown>
                         </div>
                     ) : (
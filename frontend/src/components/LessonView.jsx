@@ -27,11 +27,23 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
     const [showFlashcards, setShowFlashcards] = useState(false);
     const [flippedCards, setFlippedCards] = useState({});
     const [numCardsToGenerate, setNumCardsToGenerate] = useState(3);
+    const lessonStartRef = useRef(null); // For time-on-subject analytics
+    // Lets the server prefetch upcoming subtopics, and cancel them when we leave
+    const lessonSessionRef = useRef(null);
+
+    const endLessonSession = () => {
+        if (lessonSessionRef.current) {
+            fetch(`/api/lesson/session/${lessonSessionRef.current}/end`, { method: 'POST', keepalive: true })
+                .catch(() => {});
+            lessonSessionRef.current = null;
+        }
+    };
 
     useEffect(() => {
-        // Cleanup speech on unmount
+        // Cleanup speech and prefetches on unmount
         return () => {
             window.speechSynthesis.cancel();
+            endLessonSession();
         };
     }, []);
 
@@ -46,8 +58,11 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
                 body: JSON.stringify({ subject, topic, grade })
             });
             const data = await res.json();
+            endLessonSession();
+            lessonSessionRef.current = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
             setLessonPlan(data.plan || []);
             setMode('plan');
+            lessonStartRef.current = Date.now();
         } catch (error) {
             console.error("Error fetching plan:", error);
         } finally {
@@ -63,7 +78,7 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
             const res = await fetch('/api/lesson/content', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ subject, topic, subtopic, grade })
+                body: JSON.stringify({ subject, topic, subtopic, grade, plan: lessonPlan, session_id: lessonSessionRef.current })
             });
             const data = await res.json();
             
@@ -116,8 +131,8 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
         setMode('quiz-setup');
     };
 
-    const startQuiz = (numQuestions) => {
-        setQuizConfig({ numQuestions });
+    const startQuiz = (numQuestions, adaptive = false) => {
+        setQuizConfig({ numQuestions, adaptive });
         setMode('quiz');
     };
 
@@ -171,7 +186,8 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
                             body: JSON.stringify({
                                 subject: subject,
                                 topic: topic,
-                                content: currentContent
+                                content: currentContent,
+                                duration_seconds: lessonStartRef.current ? Math.round((Date.now() - lessonStartRef.current) / 1000) : null
                             })
                         });
                     } catch (err) {
@@ -273,7 +289,7 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
                 const errorMsg = errorData.detail || "Failed to generate speech";
 
                 if (res.status === 429 || errorMsg.includes("quota")) {
-                    alert("⚠️ ElevenLabs quota exceeded. The text has been shortened to fit your remaining credits. Please upgrade your plan for full lessons.");
+                    alert("⚠️ " + errorMsg);
                 } else {
                     alert("Failed to generate speech: " + errorMsg);
                 }
@@ -396,7 +412,7 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
                     <div className="text-6xl mb-6">🤔</div>
                     <h3 className="text-3xl font-bold mb-4 text-gray-800">Ready for a Quiz?</h3>
                     <p className="mb-8 text-xl text-gray-600">How many questions can you handle?</p>
-                    <div className="grid grid-cols-3 gap-4 mb-10">
+                    <div className="grid grid-cols-3 gap-4 mb-4">
                         {[5, 10, 15].map(num => (
                             <button
                                 key={num}
@@ -407,6 +423,12 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
                             </button>
                         ))}
                     </div>
+                    <button
+                        onClick={() => startQuiz(10, true)}
+                        className="w-full mb-10 p-4 bg-fuchsia-100 hover:bg-fuchsia-200 text-fuchsia-800 rounded-2xl font-bold text-lg transition-colors border-2 border-fuchsia-200"
+                    >
+                        🎯 Smart Quiz: questions that match how you're doing
+                    </button>
                     <button onClick={() => setMode('learning')} className="text-gray-500 hover:text-gray-800 font-medium underline decoration-2 underline-offset-4">
                         Maybe later
                     </button>
@@ -424,6 +446,7 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
                 studentName={studentProfile.name}
                 studentId={studentProfile.id}
                 numQuestions={quizConfig?.numQuestions || 5}
+                adaptive={!!quizConfig?.adaptive}
                 onComplete={handleQuizComplete}
                 onBack={() => setMode('learning')}
             />
@@ -674,6 +697,8 @@ const LessonView = ({ subject, defaultGrade, studentProfile, initialTopic = '',
                 <ChatAssistant
                     context={currentContent}
                     studentGrade={grade}
+                    studentId={studentProfile?.id}
+                    lessonKey={`${subject}:${topic}`}
                 />
             )}
         </div>
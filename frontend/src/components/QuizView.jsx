@@ -1,7 +1,7 @@
 
 import React, { useState, useEffect } from 'react';
 
-const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions = 5, onBack, onComplete, onBadgeUnlock, initialQuestions = null }) => {
+const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions = 5, onBack, onComplete, onBadgeUnlock, initialQuestions = null, adaptive = false }) => {
     const [loading, setLoading] = useState(!initialQuestions);
     const [questions, setQuestions] = useState(initialQuestions || []);
     const [currentQuestionIndex, setCurrentQuestionIndex] = useState(0);
@@ -12,6 +12,16 @@ const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions
     const [isAnswerChecked, setIsAnswerChecked] = useState(false);
     const [isListening, setIsListening] = useState(false);
     const [isSaved, setIsSaved] = useState(false);
+    const [startedAt] = useState(() => Date.now());
+    // Per-question answers for difficulty calibration
+    const [answers, setAnswers] = useState([]);
+    const questionShownAtRef = React.useRef(Date.now());
+    // Adaptive mode: the server scores each answer and picks the next question
+    const [adaptiveState, setAdaptiveState] = useState(null);
+    const [nextQuestion, setNextQuestion] = useState(null);
+    const [isChecking, setIsChecking] = useState(false);
+    // True while later questions are still being generated
+    const [isStreaming, setIsStreaming] = useState(false);
     const recognitionRef = React.useRef(null);
 
     useEffect(() => {
@@ -67,47 +77,174 @@ const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions
     };
 
     useEffect(() => {
+        const controller = new AbortController();
+        const request = { subject, topic, grade, num_questions: numQuestions, student_id: studentId || null };
+
+        // Questions arrive one NDJSON line at a time; show the first as soon as it lands
+        const streamQuiz = async () => {
+            const res = await fetch('/api/quiz/stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(request),
+                signal: controller.signal
+            });
+            if (!res.ok || !res.body) throw new Error(`Quiz stream failed: ${res.status}`);
+            setIsStreaming(true);
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let received = 0;
+            try {
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop();
+                    for (const line of lines) {
+                        if (!line.trim()) continue;
+                        const event = JSON.parse(line);
+                        if (event.type === 'question') {
+                            setQuestions(prev => [...prev, event.question]);
+                            if (received++ === 0) {
+                                questionShownAtRef.current = Date.now();
+                                setLoading(false);
+                            }
+                        } else if (event.type === 'error' && received === 0) {
+                            throw new Error(event.detail);
+                        }
+                    }
+                }
+            } catch (error) {
+                // Once questions are showing, keep them rather than starting over
+                if (received === 0 || error.name === 'AbortError') throw error;
+                console.error("Quiz stream ended early:", error);
+            } finally {
+                setIsStreaming(false);
+            }
+            return received;
+        };
+
         const fetchQuiz = async () => {
             try {
+                if (adaptive) {
+                    const res = await fetch('/api/quiz/adaptive/start', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ subject, topic, grade, student_id: studentId || null, max_questions: numQuestions }),
+                        signal: controller.signal
+                    });
+                    const data = await res.json();
+                    if (res.ok) {
+                        setAdaptiveState(data);
+                        setQuestions([data.question]);
+                        questionShownAtRef.current = Date.now();
+                    }
+                    return;
+                }
+                try {
+                    if (await streamQuiz()) return;
+                } catch (error) {
+                    if (error.name === 'AbortError') return;
+                    console.error("Quiz stream failed, falling back:", error);
+                }
                 const res = await fetch('/api/quiz', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ subject, topic, grade, num_questions: numQuestions })
+                    body: JSON.stringify(request),
+                    signal: controller.signal
                 });
                 const data = await res.json();
                 // Handle case where data might be a string (if parsed manually) or object
                 const parsedData = typeof data === 'string' ? JSON.parse(data) : data;
                 setQuestions(parsedData.questions || []);
+                questionShownAtRef.current = Date.now();
             } catch (error) {
-                console.error("Error fetching quiz:", error);
+                if (error.name !== 'AbortError') console.error("Error fetching quiz:", error);
             } finally {
-                setLoading(false);
+                if (!controller.signal.aborted) {
+                    setLoading(false);
+                }
             }
         };
 
         if (!initialQuestions) {
             fetchQuiz();
         }
-    }, [subject, topic, grade, numQuestions, initialQuestions]);
+        return () => controller.abort();
+    }, [subject, topic, grade, numQuestions, studentId, initialQuestions, adaptive]);
 
     const handleAnswerSelect = (option) => {
         if (isAnswerChecked) return;
         setSelectedAnswer(option);
     };
 
+    const handleAdaptiveCheck = async () => {
+        const current = questions[currentQuestionIndex];
+        const latency = Date.now() - questionShownAtRef.current;
+        setIsChecking(true);
+        try {
+            const res = await fetch(`/api/quiz/adaptive/${adaptiveState.session_id}/answer`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ question_id: current.id, chosen: selectedAnswer, latency_ms: latency })
+            });
+            if (!res.ok) throw new Error(`Answer failed: ${res.status}`);
+            const result = await res.json();
+            const { next_question, correct, correct_answer, explanation, ...state } = result;
+            setQuestions(prev => prev.map((q, i) => i === currentQuestionIndex ? { ...q, correct: correct_answer, explanation } : q));
+            setAnswers(prev => [...prev, {
+                question_id: current.id,
+                question: current.question,
+                chosen: selectedAnswer,
+                correct,
+                latency_ms: latency
+            }]);
+            if (correct) setScore(prev => prev + 1);
+            setAdaptiveState(state);
+            setNextQuestion(next_question);
+            setIsAnswerChecked(true);
+        } catch (error) {
+            console.error("Error checking answer:", error);
+        } finally {
+            setIsChecking(false);
+        }
+    };
+
     const handleCheckAnswer = () => {
+        if (adaptive) {
+            handleAdaptiveCheck();
+            return;
+        }
         setIsAnswerChecked(true);
+        const current = questions[currentQuestionIndex];
+        setAnswers(prev => [...prev, {
+            question_id: typeof current.id === 'number' ? current.id : null,
+            question: current.question,
+            chosen: selectedAnswer,
+            correct: selectedAnswer === current.correct,
+            latency_ms: Date.now() - questionShownAtRef.current
+        }]);
         if (selectedAnswer === questions[currentQuestionIndex].correct) {
             setScore(score + 1);
             // Play sound effect here if desired
         }
     };
 
+    const isLastQuestion = adaptive ? !!adaptiveState?.done : !isStreaming && currentQuestionIndex + 1 === questions.length;
+    // Streaming: the student caught up with generation, so Next waits for the next question
+    const isWaitingForNext = !adaptive && isStreaming && currentQuestionIndex + 1 >= questions.length;
+
     const handleNextQuestion = async () => {
-        if (currentQuestionIndex + 1 < questions.length) {
+        if (adaptive && !isLastQuestion && nextQuestion) {
+            setQuestions(prev => [...prev, nextQuestion]);
+            setNextQuestion(null);
+        }
+        if (adaptive ? !isLastQuestion : currentQuestionIndex + 1 < questions.length) {
             setCurrentQuestionIndex(currentQuestionIndex + 1);
             setSelectedAnswer(null);
             setIsAnswerChecked(false);
+            questionShownAtRef.current = Date.now();
         } else {
             const finalScore = score; // Score is already updated by handleCheckAnswer
             // setScore(finalScore); // No need to update state again if it's already correct
@@ -120,11 +257,14 @@ const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({
                         student_name: studentName || "Student",
+                        student_id: studentId || null,
                         grade: grade,
                         subject: subject,
                         topic: topic,
                         score: finalScore,
-                        total_questions: questions.length
+                        total_questions: questions.length,
+                        duration_seconds: Math.round((Date.now() - startedAt) / 1000),
+                        answers
                     })
                 });
 
@@ -204,6 +344,11 @@ const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions
                 <div className="text-6xl font-bold text-gray-800 mb-4">
                     {score} / {questions.length}
                 </div>
+                {adaptive && adaptiveState && (
+                    <p className="text-lg text-indigo-600 font-bold mb-2">
+                        Topic mastery: {Math.round(adaptiveState.mastery * 100)}%
+                    </p>
+                )}
                 <p className="text-xl text-gray-600 mb-8">
                     {score === questions.length ? "Perfect Score! You're a star! 🌟" : "Great effort! Keep learning!"}
                 </p>
@@ -262,7 +407,7 @@ const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions
     return (
         <div className="bg-white rounded-2xl shadow-xl p-8 max-w-2xl mx-auto">
             <div className="flex justify-between items-center mb-6">
-                <span className="text-sm font-bold text-gray-400 uppercase tracking-wide">Question {currentQuestionIndex + 1} of {questions.length}</span>
+                <span className="text-sm font-bold text-gray-400 uppercase tracking-wide">Question {currentQuestionIndex + 1} of {adaptive ? `up to ${adaptiveState?.max_questions ?? numQuestions}` : isStreaming ? numQuestions : questions.length}</span>
                 <span className="text-sm font-bold text-blue-500">Score: {score}</span>
             </div>
 
@@ -323,17 +468,18 @@ const QuizView = ({ subject, topic, grade, studentName, studentId, numQuestions
                     {!isAnswerChecked ? (
                         <button
                             onClick={handleCheckAnswer}
-                            disabled={!selectedAnswer || isListening} // Disable check answer when listening
-                            className={`px-8 py-3 rounded-xl font-bold text-white transition-all ${!selectedAnswer || isListening ? 'bg-gray-300 cursor-not-allowed' : 'bg-blue-500 hover:bg-blue-600'}`}
+                            disabled={!selectedAnswer || isListening || isChecking} // Disable check answer when listening
+                            className={`px-8 py-3 rounded-xl font-bold text-white transition-all ${!selectedAnswer || isListening || isChecking ? 'bg-gray-300 cursor-not-allowed' : 'bg-blue-500 hover:bg-blue-600'}`}
                         >
                             Check Answer
                         </button>
                     ) : (
                         <button
                             onClick={handleNextQuestion}
-                            className="px-8 py-3 bg-purple-500 text-white font-bold rounded-xl shadow-lg hover:bg-purple-600 hover:scale-105 transition-transform"
+                            disabled={isWaitingForNext}
+                            className={`px-8 py-3 text-white font-bold rounded-xl shadow-lg transition-transform ${isWaitingForNext ? 'bg-gray-300 cursor-not-allowed' : 'bg-purple-500 hover:bg-purple-600 hover:scale-105'}`}
                         >
-                            {currentQuestionIndex + 1 === questions.length ? 'Finish Quiz' : 'Next Question →'}
+                            {isWaitingForNext ? 'Writing the next question...' : isLastQuestion ? 'Finish Quiz' : 'Next Question →'}
                         </button>
                     )}
                 </div>
@@ -1,12 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import './StreakCounter.css';
 
-const StreakCounter = ({ studentId }) => {
-    const [streak, setStreak] = useState({ current_streak: 0, longest_streak: 0 });
-    const [loading, setLoading] = useState(true);
+const StreakCounter = ({ studentId, initialStreak }) => {
+    const [streak, setStreak] = useState(initialStreak || { current_streak: 0, longest_streak: 0 });
+    const [loading, setLoading] = useState(!initialStreak);
 
     useEffect(() => {
-        if (studentId) {
+        if (studentId && !initialStreak) {
             fetchStreak();
         }
     }, [studentId]);
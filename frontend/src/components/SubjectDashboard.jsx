@@ -3,7 +3,7 @@ import BadgeDisplay from './BadgeDisplay';
 import StreakCounter from './StreakCounter';
 import Leaderboard from './Leaderboard';
 
-const SubjectDashboard = ({ onSelectSubject, recommendations = [], studentProfile, onStartFlashcards, onOpenQuizLibrary, onOpenLessonLibrary }) => {
+const SubjectDashboard = ({ onSelectSubject, recommendations = [], bootstrap = null, studentProfile, onStartFlashcards, onOpenQuizLibrary, onOpenLessonLibrary }) => {
     const subjects = [
         { id: 'math', name: 'Mathematics', icon: '📐', colors: 'from-blue-500 to-cyan-400' },
         { id: 'english', name: 'English', icon: '📚', colors: 'from-emerald-500 to-teal-400' },
@@ -79,11 +79,11 @@ const SubjectDashboard = ({ onSelectSubject, recommendations = [], studentProfil
                                         <span>Achievements</span>
                                     </h2>
                                     <div className="bg-slate-800/80 px-3 py-1 rounded-full border border-slate-600">
-                                      <StreakCounter studentId={studentProfile.id} />
+                                      <StreakCounter studentId={studentProfile.id} initialStreak={bootstrap?.streak} />
                                     </div>
                                 </div>
                                 <div className="bg-slate-800/30 rounded-2xl p-4 border border-slate-700/30">
-                                  <BadgeDisplay studentId={studentProfile.id} />
+                                  <BadgeDisplay studentId={studentProfile.id} initialBadges={bootstrap?.badges} />
                                 </div>
                             </div>
 
@@ -119,7 +119,7 @@ const SubjectDashboard = ({ onSelectSubject, recommendations = [], studentProfil
 
                             {/* Leaderboard Section */}
                             <div className="glass-panel rounded-3xl overflow-hidden h-[500px] border border-slate-700/50">
-                                <Leaderboard currentStudentId={studentProfile.id} />
+                                <Leaderboard currentStudentId={studentProfile.id} initialLeaders={bootstrap?.leaderboard?.entries} />
                             </div>
                         </>
                     )}